@@ -1,4 +1,5 @@
-import networkx as nx
+import IdAllocator
+import JoinCache
 
 from abc import ABCMeta, abstractmethod 
 from collections import deque
@@ -11,11 +12,28 @@ class AbstractTreeBuilder:
     #Maximum VLAN tag number
     max_vid = 4094
 
-    def __init__(self, F, controller, join):
+    #Maximum amount of join results kept in the join cache, 0 disables it
+    JOIN_CACHE_SIZE = 4096
+
+    def __init__(self, F, controller, join, join_many = None):
         self.F = F
         self.groups = {}
         self.controller = controller
-        self.join = join
+
+        #Paths are shared by all groups until the topology changes (see JoinCache)
+        #Paths that are not cached are computed outside the event loop (see GroupWorkers.offload)
+        offload = controller.workers.offload
+        self.join_cache = JoinCache.JoinCache(offload(join), offload(join_many), self.JOIN_CACHE_SIZE)
+
+        #The time spent computing paths is recorded separately from the time spent installing them
+        self.join = controller.metrics.timed('join_seconds', self.join_cache.join, call = 'join')
+
+        #Optional function computing the joins of many subscribers at once (see SPT.join_many)
+        self.join_many = controller.metrics.timed('join_seconds', self.join_cache.join_many, call = 'join_many')
+
+        #Subscribers waiting for their protection to be restored after a failure
+        self.repairs = deque()
+        self.queued_repairs = set()
 
     def create_group(self, ip_group, ip_source, switch_id):
         """Create a new multicast group/tree rooted at switch_id.
@@ -33,55 +51,56 @@ class AbstractTreeBuilder:
         key = (ip_group, ip_source)
 
         if key in self.groups:
-            self.controller.log('group ' + str(key) + ' already created')
+            self.controller.log('group %s already created', key)
         else:
             self.groups[key] = self._create_tree(switch_id)
-            self.controller.log('created new group: ' + str(key))
+            self.controller.log('created new group: %s', key)
 
     def _create_tree(self, switch_id, parent = None, predecessor_switch = None):
         """Create a new tree rooted at switch_id. Automatically assigns correct tag.
         
+        Returns None if all tags of the primary tree are in use.
+        
         Arguments:
         switch_id: id of the root switch
         parent: parent tree, or None if the new tree is a primary tree
         predecessor_switch: id of previous switch on current packet path, or None if it does not exist
         """
         
-        tree = nx.DiGraph(root = switch_id, parent = parent)
+        tree = JoinCache.Tree(root = switch_id, parent = parent)
         tree.add_node(switch_id)
         
         tree.graph['predecessor_switch'] = predecessor_switch
 
         if parent == None:
-            tree.graph['tag_index'] = 1
+            #All backup trees below a primary tree need a different tag
+            tree.graph['tags'] = IdAllocator.IdAllocator(1, self.max_vid)
             tree.graph['tag'] = None
             tree.graph['primary'] = tree
         else:
             primary = parent.graph['primary']
             tree.graph['primary'] = primary
 
-            tag = primary.graph['tag_index']
+            tag = primary.graph['tags'].allocate()
+            if tag is None:
+                self.controller.logger.error('All VLAN tags of the tree rooted at %s are in use', 
+                                             primary.graph['root'])
+                self.controller.metrics.inc('tags_exhausted_total')
+                return None
             tree.graph['tag'] = tag
-
-            tag = tag + 1
-            if tag > self.max_vid:
-                tag = 1 #Assuming we can cycle through tags
-            primary.graph['tag_index'] = tag
             
         return tree
 
-    def _undo_tree(self, tree):
-        """Undoes creating tree. DOES NOT WORK PROPERLY IF tree WAS NOT THE LAST TREE CREATED."""
-        
-        if tree.graph['parent'] != None:
-            primary = tree.graph['primary']
-            tag = primary.graph['tag_index']
+    def _release_tags(self, tree):
+        """Return the tags of backup tree tree and of all backup trees below it.
 
-            tag = tag - 1
-            if tag < 1:
-                tag = self.max_vid
+        They are reused once the deletes of their entries have been sent, see MulticastController.release_id.
+        """
 
-            primary.graph['tag_index'] = tag
+        tags = tree.graph['primary'].graph['tags']
+        self.controller.release_id(tags, tree.graph['tag'])
+        for parent, x, y, backup in self._backup_trees(tree):
+            self.controller.release_id(tags, backup.graph['tag'])
             
     @abstractmethod   
     def _process_request(self, T, v, r, F, ip_group, ip_source):
@@ -109,16 +128,72 @@ class AbstractTreeBuilder:
     
         key = (ip_group, ip_source)
         if key not in self.groups:
-            self.controller.log('group ' + str(key) + ' does not exist')
+            self.controller.log('group %s does not exist', key)
             return
 
         tree = self.groups[key]
         if subscriber in tree:
-            self.controller.log(str(subscriber) + ' already added to ' + str(key))
+            self.controller.log('%s already added to %s', subscriber, key)
+            return
+
+        self.controller.begin_transaction()
+        try:
+            self.controller.track_install(key, [subscriber], self.F + 1)
+            with self.controller.metrics.time('request_seconds', operation = 'join'):
+                added = self._process_request(tree, subscriber, True, self.F, ip_group, ip_source)
+        finally:
+            self.controller.commit_transaction()
+
+        if added:
+            self.controller.log('%s added to group %s', subscriber, key)
+
+    def add_subscribers(self, ip_group, ip_source, subscribers):
+        """Add all subscribers to the multicast group identified by ip_group and ip_source at once.
+        
+        The flows of all subscribers are installed in a single transaction. When the TreeBuilder has a 
+        join_many function, the paths of all subscribers are also computed together.
+        
+        Arguments:
+        ip_group: IP address of the group
+        ip_source: IP address of the source
+        subscribers: ids of new subscribers
+        """
+
+        key = (ip_group, ip_source)
+        if key not in self.groups:
+            self.controller.log('group %s does not exist', key)
+            return
+
+        tree = self.groups[key]
+
+        new_subscribers = []
+        for subscriber in subscribers:
+            if subscriber in tree or subscriber in new_subscribers:
+                self.controller.log('%s already added to %s', subscriber, key)
+            else:
+                new_subscribers.append(subscriber)
+
+        if len(new_subscribers) == 0:
             return
 
-        if self._process_request(tree, subscriber, True, self.F, ip_group, ip_source):
-            self.controller.log(str(subscriber) + ' added to group ' + str(key))
+        self.controller.begin_transaction()
+        try:
+            self.controller.track_install(key, new_subscribers, self.F + 1)
+            with self.controller.metrics.time('request_seconds', operation = 'bulk_join'):
+                added = self._process_requests(tree, new_subscribers, self.F, ip_group, ip_source)
+        finally:
+            self.controller.commit_transaction()
+
+        for subscriber in added:
+            self.controller.log('%s added to group %s', subscriber, key)
+
+    def _process_requests(self, T, subscribers, F, ip_group, ip_source):
+        """Add all subscribers to tree T. Returns the subscribers that were added.
+        
+        TreeBuilders can override this to handle all subscribers at once, by default they are added one by one.
+        """
+
+        return [v for v in subscribers if self._process_request(T, v, True, F, ip_group, ip_source)]
 
     def remove_group(self, ip_group, ip_source):
         """Remove/Destroy multicast group/tree identified by ip_group and ip_source.
@@ -130,29 +205,20 @@ class AbstractTreeBuilder:
     
         key = (ip_group, ip_source)
         if key not in self.groups:
-            self.controller.log('group ' + str(key) + ' does not exist')
+            self.controller.log('group %s does not exist', key)
             return
         
-        tree = self.groups[key]
-        
-        self._remove_all_flows(ip_group, ip_source, tree)
+        self.controller.begin_transaction()
+        try:
+            #All flows and groups of the group carry its cookie, its trees do not have to be walked
+            self.controller.remove_all_flows(ip_group, ip_source)
+        finally:
+            self.controller.commit_transaction()
             
         del self.groups[key]
+        self.controller.installs.forget(key)
 
-        self.controller.log('Group ' + str(key) + ' removed')
-
-    def _remove_all_flows(self, ip_group, ip_source, tree):
-        tag = tree.graph['tag']
-
-        for node in tree:            
-            dsts = list(tree.successors(node))
-            if len(dsts) > 0:
-                self.controller.remove_flow(node, ip_group, 'all', True, ip_source, tag)
-                
-                for dst in dsts:
-                    backup = tree[node][dst]['backup']
-                    if backup != None:
-                        self._remove_all_flows(ip_group, ip_source, backup)
+        self.controller.log('Group %s removed', key)
 
     def remove_subscriber(self, ip_group, ip_source, subscriber):
         """Remove subscriber from the multicast group identified by ip_group and ip_source.
@@ -165,17 +231,25 @@ class AbstractTreeBuilder:
         
         key = (ip_group, ip_source)
         if key not in self.groups:
-            self.controller.log('group ' + str(key) + ' does not exist')
+            self.controller.log('group %s does not exist', key)
             return
             
         tree = self.groups[key]
         
         if subscriber not in tree:
-            self.controller.log(str(subscriber) + ' not subscribed to ' + str(key))
+            self.controller.log('%s not subscribed to %s', subscriber, key)
             return
         
-        if self._process_request(tree, subscriber, False, self.F, ip_group, ip_source):
-            self.controller.log(str(subscriber) + ' removed from group ' + str(key))
+        self.controller.begin_transaction()
+        try:
+            with self.controller.metrics.time('request_seconds', operation = 'leave'):
+                removed = self._process_request(tree, subscriber, False, self.F, ip_group, ip_source)
+        finally:
+            self.controller.commit_transaction()
+
+        if removed:
+            self.controller.installs.forget(key, subscriber)
+            self.controller.log('%s removed from group %s', subscriber, key)
 
     @abstractmethod
     def _remove_flow(self, src, dst, ip_group, ip_source, tree):
@@ -225,40 +299,296 @@ class AbstractTreeBuilder:
             if backup != None:
                 self._leave(backup, v, ip_group, ip_source, cur)
 
+                #Empty backup trees give back their tag
+                if backup.number_of_edges() == 0:
+                    T[pre][cur]['backup'] = None
+                    self._release_tags(backup)
+
             cur = pre
 
         cur = v
         while T.out_degree(cur) == 0 and cur != root:
             pre = list(T.predecessors(cur))[0]
 
+            backup = T[pre][cur]['backup']
+            if backup != None:
+                self._release_tags(backup)
+
             T.remove_node(cur)
 
             cur = pre
     
+    @abstractmethod
+    def _protect(self, T, v, ip_group, ip_source):
+        """Add backups for the path from the root of primary tree T to v."""
+        pass
+
+    @abstractmethod
+    def _reprotect(self, T, x, y, backup, v, ip_group, ip_source):
+        """Recompute the path to v in backup, the backup tree of link (x,y) of tree T.
+        
+        If backup is None, or has been detached from (x,y) in the meantime, a new backup tree is created
+        instead.
+        """
+        pass
+
     def repair(self, broken_links):
-        """Repair all trees for failures broken_links. Currently calls to this function are ignored, 
-        because this should be done in a more sophisticated way."""
+        """Repair all trees for failures broken_links.
+        
+        Only trees that use a broken link are touched. Only the part of a tree below a broken link is
+        detached, subscribers below it are rerouted right away. Restoring the protection of the links their
+        new paths added, and the protection of subscribers whose backup paths use a broken link, is queued
+        and done by process_repairs. Backups that do not use a broken link are kept.
+        """
         
-        return
+        broken_links = set(broken_links)
+        if len(broken_links) == 0:
+            return
+
         self.controller.log('Starting repairs')
 
-        for key in self.groups:
-            tree = self.groups[key]
-            self._repair(set(broken_links), tree, key[0], key[1])
+        self.controller.begin_transaction()
+        try:
+            for key in list(self.groups):
+                self._repair(broken_links, self.groups[key], key[0], key[1])
+        finally:
+            self.controller.commit_transaction()
+
+        self.controller.log('Repairs finished, %s subscribers waiting for protection', len(self.repairs))
+
+    def repair_group(self, key, broken_links):
+        """Repair the tree of the multicast group identified by key (group, source) for failures broken_links.
+        
+        See repair, which repairs all trees in a single transaction.
+        """
+
+        tree = self.groups.get(key)
+        broken_links = set(broken_links)
+        if tree is None or len(broken_links) == 0:
+            return
 
-        self.controller.log('Repairs finished')
+        self.controller.begin_transaction()
+        try:
+            self._repair(broken_links, tree, key[0], key[1])
+        finally:
+            self.controller.commit_transaction()
 
     def _repair(self, broken_links, tree, ip_group, ip_source):
-        affected = set()
-        for link in broken_links:
-            if tree.has_edge(link[0], link[1]):
-                affected.update(self._get_subscribers(tree, link[1]))
+        key = (ip_group, ip_source)
+        network = self.controller.get_network()
+
+        #Subscriber -> path from the root to the broken link it was below
+        above = {}
+        ends = []
+        for x, y in broken_links:
+            if tree.has_edge(x, y):
+                path = self._get_path(tree, x)
+                for subscriber in self._detach(tree, x, y, ip_group, ip_source):
+                    above[subscriber] = path
+                ends.append(x)
+
+        rerouted = set(above)
+        for subscriber in rerouted:
+            if self._process_request(tree, subscriber, True, 0, ip_group, ip_source):
+                self.controller.log('rerouted %s in group %s', subscriber, key)
+            else:
+                self.controller.log('could not reroute %s in group %s', subscriber, key)
+
+        for subscriber in rerouted:
+            path = self._get_path(tree, subscriber) if subscriber in tree else []
+            links = set(zip(path, path[1:]))
+
+            #Backups of links the subscriber no longer uses would send it duplicates
+            old = above[subscriber]
+            for x, y in zip(old, old[1:]):
+                if (x, y) in links or not tree.has_edge(x, y):
+                    continue
+                backup = tree[x][y]['backup']
+                if backup is not None and subscriber in backup:
+                    self._leave(backup, subscriber, ip_group, ip_source, y)
+                    if backup.number_of_edges() == 0:
+                        tree[x][y]['backup'] = None
+                        self._release_tags(backup)
+
+            #Links the subscriber used before keep protecting it, only the others need a backup for it
+            if self.F > 0:
+                for x, y in zip(path, path[1:]):
+                    backup = tree[x][y]['backup']
+                    if not network.node[y]['host'] and (backup is None or subscriber not in backup):
+                        self._queue_repair(key, subscriber, (tree, x, y, backup))
+
+        #Switches left without anything below them
+        for x in ends:
+            self._prune(tree, x, ip_group, ip_source)
+
+        #The broken parts of backup trees are removed right away, otherwise they would block the new backup paths
+        for parent, x, y, backup in list(self._backup_trees(tree)):
+            if not parent.has_edge(x, y) or parent[x][y]['backup'] is not backup:
+                continue
+
+            broken = set()
+            for link in broken_links:
+                if backup.has_edge(link[0], link[1]):
+                    broken.update(self._get_subscribers_below(backup, link[1]))
+
+            #Rerouted subscribers that still use (x,y) keep its backup as well
+            for subscriber in broken:
+                self._leave(backup, subscriber, ip_group, ip_source, y)
+                self._queue_repair(key, subscriber, (parent, x, y, backup))
+
+    def _detach(self, T, x, y, ip_group, ip_source):
+        """Remove link (x,y) of primary tree T and the part of T below it, along with the backups of these links.
+
+        Returns the subscribers that were below the link.
+        """
+
+        subscribers = self._get_subscribers_below(T, y)
+
+        links = [(x, y)]
+        queue = deque([y])
+        while len(queue) > 0:
+            node = queue.popleft()
+            for child in T.successors(node):
+                links.append((node, child))
+                queue.append(child)
+
+        #Removing the flow of a link removes the groups holding the first links of its backup as well
+        self._remove_flow(x, y, ip_group, ip_source, T)
+        for node in [b for a, b in links]:
+            if T.out_degree(node) > 0:
+                self.controller.remove_flow(node, ip_group, 'all', True, ip_source, T.graph['tag'])
+
+        for a, b in links:
+            backup = T[a][b]['backup']
+            if backup is not None:
+                for subscriber in self._get_subscribers(backup, backup.graph['root']):
+                    self._leave(backup, subscriber, ip_group, ip_source, b)
+                self._release_tags(backup)
+
+        T.remove_nodes_from([b for a, b in links])
+        return subscribers
+
+    def _prune(self, T, x, ip_group, ip_source):
+        """Remove switch x from primary tree T if nothing is below it anymore, and the switches above it that
+        are left without anything below them as well."""
+
+        network = self.controller.get_network()
+        root = T.graph['root']
+
+        cur = x
+        while cur != root and cur in T and T.out_degree(cur) == 0 and not network.node[cur]['host']:
+            pre = list(T.predecessors(cur))[0]
+
+            self._remove_flow(pre, cur, ip_group, ip_source, T)
+            backup = T[pre][cur]['backup']
+            if backup is not None:
+                for subscriber in self._get_subscribers(backup, backup.graph['root']):
+                    self._leave(backup, subscriber, ip_group, ip_source, cur)
+                self._release_tags(backup)
+
+            T.remove_node(cur)
+            cur = pre
+
+    def _queue_repair(self, key, subscriber, location):
+        item = (key, subscriber, location)
+        if item not in self.queued_repairs:
+            self.queued_repairs.add(item)
+            self.repairs.append(item)
+
+    def process_repairs(self, limit = None):
+        """Restore the protection of up to limit subscribers queued by repair.
+        
+        Returns the amount of subscribers still waiting for protection.
+        """
+
+        for item in self.take_repairs(limit):
+            self.process_repair(item)
+
+        return len(self.repairs)
+
+    def take_repairs(self, limit = None):
+        """Returns up to limit queued repairs as (key, subscriber, location), they are no longer queued."""
+
+        items = []
+        while len(self.repairs) > 0 and (limit is None or len(items) < limit):
+            item = self.repairs.popleft()
+            self.queued_repairs.discard(item)
+            items.append(item)
+
+        return items
+
+    def process_repair(self, item):
+        """Restore the protection of a subscriber, item is one of the repairs returned by take_repairs."""
+
+        key, subscriber, location = item
+        tree = self.groups.get(key)
+        if tree is None or subscriber not in tree:
+            return
+
+        self.controller.begin_transaction()
+        try:
+            if location is None:
+                self._protect(tree, subscriber, key[0], key[1])
+            else:
+                parent, x, y, backup = location
+
+                #The backup may have been replaced, repaired or emptied and detached in the meantime
+                if self._uses_link(parent, subscriber, x, y):
+                    current = parent[x][y]['backup']
+                    if current is None or subscriber not in current or (current is backup 
+                            and not self._path_is_live(backup, subscriber)):
+                        self._reprotect(parent, x, y, current, subscriber, key[0], key[1])
+        finally:
+            self.controller.commit_transaction()
+
+        self.controller.log('restored protection of %s in group %s', subscriber, key)
+
+    def _backup_trees(self, tree):
+        """Yields (parent tree, x, y, backup tree) for all backup trees below tree."""
+
+        for x, y, data in tree.edges(data = True):
+            backup = data['backup']
+            if backup is not None:
+                yield tree, x, y, backup
+                for item in self._backup_trees(backup):
+                    yield item
+
+    def _get_path(self, tree, v):
+        """Returns the path from the root of tree to v."""
+
+        path = [v]
+        root = tree.graph['root']
+        cur = v
+        while cur != root:
+            cur = list(tree.predecessors(cur))[0]
+            path.append(cur)
+
+        path.reverse()
+        return path
+
+    def _uses_link(self, tree, v, x, y):
+        """Returns True if the path from the root of tree to v uses link (x,y)."""
+
+        if v not in tree or not tree.has_edge(x, y):
+            return False
+        return y == v or y in self._get_path(tree, v)
+
+    def _path_is_live(self, tree, v):
+        """Returns True if all links on the path from the root of tree to v are live."""
+
+        network = self.controller.get_network()
+        path = self._get_path(tree, v)
+        for i in range(1, len(path)):
+            if not network[path[i-1]][path[i]]['live']:
+                return False
+        return True
 
-        for subscriber in affected:
-            self.remove_subscriber(ip_group, ip_source, subscriber)
+    def _get_subscribers_below(self, tree, node):
+        """Returns all subscribers in tree that receive packets through node (including node itself)."""
 
-        for subscriber in affected:
-            self.add_subscriber(ip_group, ip_source, subscriber)
+        if tree.out_degree(node) == 0:
+            return [node]
+        return self._get_subscribers(tree, node)
 
     def _get_subscribers(self, tree, root):
         subscribers = []
@@ -0,0 +1,88 @@
+from ryu.lib import hub
+
+class BarrierTracker(object):
+    """Tells when switches have processed all messages sent to them so far.
+
+    Every switch gets a barrier request, which it answers once it processed everything it received before.
+    When all switches answered, or after a timeout, a callback is called. Nothing waits for the replies: the
+    callback runs in the handler of the last barrier reply (see MulticastController.barrier_reply_handler),
+    so the event loop that delivers the replies is never blocked.
+    """
+
+    def __init__(self, send):
+        """
+        Arguments:
+        send: function sending a message to a datapath, called with (datapath, message)
+        """
+
+        self.send = send
+        self.pending = {} #(datapath id, xid) -> [_Confirmation]
+
+    def confirm(self, dps, callback, timeout):
+        """Call callback(True) once all datapaths dps answered a barrier request.
+
+        callback(False) is called instead if they did not all answer within timeout seconds.
+        """
+
+        barriers = self.requests(dps)
+
+        #Replies can come in while the requests are sent, so all of them are registered first
+        self.watch(barriers, callback, timeout)
+        for dp, msg in barriers:
+            self.send(dp, msg)
+
+    def requests(self, dps):
+        """Returns a (datapath, barrier request) pair for every datapath of dps, the requests have their xid."""
+
+        barriers = []
+        for dp in dps:
+            msg = dp.ofproto_parser.OFPBarrierRequest(dp)
+            dp.set_xid(msg)
+            barriers.append((dp, msg))
+        return barriers
+
+    def watch(self, barriers, callback, timeout):
+        """Like confirm, for barrier requests (see requests) the caller sends after this call.
+
+        Several calls can watch the same barrier request.
+        """
+
+        confirmation = _Confirmation(callback)
+        for dp, msg in barriers:
+            key = (dp.id, msg.xid)
+            confirmation.keys.add(key)
+            self.pending.setdefault(key, []).append(confirmation)
+
+        if len(confirmation.keys) == 0:
+            callback(True)
+            return
+
+        confirmation.timer = hub.spawn_after(timeout, self._expire, confirmation)
+
+    def reply(self, msg):
+        """Process barrier reply msg."""
+
+        key = (msg.datapath.id, msg.xid)
+        for confirmation in self.pending.pop(key, ()):
+            confirmation.keys.discard(key)
+            if len(confirmation.keys) == 0:
+                hub.kill(confirmation.timer)
+                confirmation.callback(True)
+
+    def _expire(self, confirmation):
+        for key in confirmation.keys:
+            confirmations = self.pending.get(key)
+            if confirmations is not None:
+                confirmations.remove(confirmation)
+                if len(confirmations) == 0:
+                    del self.pending[key]
+        confirmation.keys.clear()
+        confirmation.callback(False)
+
+class _Confirmation(object):
+    __slots__ = ('callback', 'keys', 'timer')
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.keys = set() #(datapath id, xid) of the barriers that have not been answered
+        self.timer = None
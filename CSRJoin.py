@@ -0,0 +1,137 @@
+import numpy as np
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from CSRTopology import CSRTopology
+
+#Value scipy uses in predecessor arrays for nodes without predecessor
+_NO_PREDECESSOR = -9999
+
+def spt_join(network, exclude, T, v):
+    """Used to construct SPTs. Same result as SPT.join, computed on a CSRTopology with scipy.
+
+    Arguments:
+    network: network graph
+    exclude: all links that should be excluded from the trees
+    T: current trees
+    v: node to be added to T
+    """
+
+    return spt_join_many(network, exclude, T, [v])[v]
+
+def spt_join_many(network, exclude, T, targets):
+    """Same result as SPT.join_many, computed on a CSRTopology with scipy.
+
+    Arguments:
+    network: network graph
+    exclude: all links that should be excluded from the trees
+    T: current trees
+    targets: nodes to be added to T
+    """
+
+    topology = CSRTopology.get(network)
+
+    paths = {}
+    predecessors = None
+    for v in targets:
+        paths[v] = []
+        if v in T or v not in topology.index:
+            continue
+
+        if predecessors is None:
+            allowed, tree_links = _allowed_links(topology, exclude, T)
+
+            epsilon = 1.0/(T.size() + 1) #1/(num_edges + 1)
+            weights = np.ones(topology.number_of_links())
+            weights[tree_links] = 1.0 - epsilon
+
+            graph = _graph(topology, allowed, weights)
+
+            root = topology.index[T.graph['root']]
+            dist, predecessors = dijkstra(graph, directed = True, indices = root, return_predecessors = True)
+
+        target = topology.index[v]
+        if np.isfinite(dist[target]):
+            paths[v] = _path(topology, predecessors, target)
+
+    return paths
+
+def dst_join(network, exclude, T, v):
+    """Used to construct DSTs. Same result as DST.join, computed on a CSRTopology with scipy.
+
+    Arguments:
+    network: network graph
+    exclude: all links that should be excluded from the trees
+    T: current trees
+    v: node to be added to T
+    """
+
+    topology = CSRTopology.get(network)
+    if v in T or v not in topology.index:
+        return []
+
+    allowed, tree_links = _allowed_links(topology, exclude, T)
+    graph = _graph(topology, allowed, np.ones(topology.number_of_links()))
+
+    target = topology.index[v]
+
+    dist, predecessors, sources = dijkstra(graph, directed = True, indices = topology.node_ids(T),
+                                           return_predecessors = True, unweighted = True, min_only = True)
+    if not np.isfinite(dist[target]):
+        return []
+
+    path = _path(topology, predecessors, target)
+
+    pre = []
+
+    cur = path[0]
+    root = T.graph['root']
+    while cur != root:
+        cur = next(iter(T.pred[cur]))
+        pre.append(cur)
+
+    pre.reverse()
+
+    return pre + path
+
+def _allowed_links(topology, exclude, T):
+    """Returns (mask of usable links, positions of the links of T).
+
+    Links are usable if they are live, not excluded and either part of T or not ending in T
+    (resulting trees should actually be trees).
+    """
+
+    in_tree = np.zeros(len(topology), dtype = bool)
+    in_tree[topology.node_ids(T)] = True
+
+    tree_links = topology.link_ids(T.edges())
+    tree_links = tree_links[tree_links >= 0]
+
+    is_tree_link = np.zeros(topology.number_of_links(), dtype = bool)
+    is_tree_link[tree_links] = True
+
+    allowed = topology.live & (is_tree_link | ~in_tree[topology.indices])
+
+    excluded = topology.link_ids(exclude)
+    allowed[excluded[excluded >= 0]] = False
+
+    return allowed, tree_links
+
+def _graph(topology, allowed, weights):
+    n = len(topology)
+    return csr_matrix((weights[allowed], (topology.rows[allowed], topology.indices[allowed])), shape = (n, n))
+
+def _path(topology, predecessors, target):
+    """Returns the path ending in target stored in predecessors, with the original node ids."""
+
+    nodes = topology.nodes
+
+    path = []
+    cur = target
+    while cur != _NO_PREDECESSOR:
+        path.append(nodes[cur])
+        cur = predecessors[cur]
+
+    path.reverse()
+    return path
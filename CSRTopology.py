@@ -0,0 +1,89 @@
+import numpy as np
+
+class CSRTopology(object):
+    """Compact, integer indexed snapshot of the network graph.
+
+    Nodes (dpids and MAC addresses) are mapped to dense integers. The links are stored in CSR form:
+    the links leaving node i are indices[indptr[i]:indptr[i+1]], sorted by destination.
+    Link attributes are kept in arrays parallel to indices.
+
+    A snapshot is only valid for the topology version it was taken at, use CSRTopology.get to obtain
+    an up to date snapshot.
+    """
+
+    def __init__(self, network):
+        self.version = network.graph.get('version', 0)
+
+        self.nodes = list(network)
+        self.index = dict((node, i) for i, node in enumerate(self.nodes))
+
+        n = len(self.nodes)
+        index = self.index
+
+        sources = []
+        destinations = []
+        live = []
+        src_ports = []
+        dst_ports = []
+        for x, y, edata in network.edges(data = True):
+            sources.append(index[x])
+            destinations.append(index[y])
+            live.append(edata['live'])
+            src_ports.append(edata['src_port'])
+            dst_ports.append(edata['dst_port'])
+
+        sources = np.array(sources, dtype = np.int64)
+        destinations = np.array(destinations, dtype = np.int64)
+        order = np.lexsort((destinations, sources))
+
+        #Row and column of every link, the keys are sorted because of the order above
+        self.rows = sources[order].astype(np.int32)
+        self.indices = destinations[order].astype(np.int32)
+        self.keys = sources[order] * n + destinations[order]
+
+        self.indptr = np.zeros(n + 1, dtype = np.int64)
+        np.cumsum(np.bincount(self.rows, minlength = n), out = self.indptr[1:])
+
+        self.live = np.array(live, dtype = bool)[order]
+        self.src_port = np.array(src_ports, dtype = np.int32)[order]
+        self.dst_port = np.array(dst_ports, dtype = np.int32)[order]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def number_of_links(self):
+        return len(self.indices)
+
+    def link_ids(self, links):
+        """Returns an array with the position of every (src, dst) link in links, or -1 if it does not exist."""
+
+        n = len(self.nodes)
+        index = self.index
+
+        keys = np.array([index[x] * n + index[y] if x in index and y in index else -1 for x, y in links],
+                        dtype = np.int64)
+        if len(keys) == 0 or len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype = np.int64)
+
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where((keys >= 0) & (self.keys[pos] == keys), pos, -1)
+
+    def node_ids(self, nodes):
+        """Returns an array with the integer id of every node in nodes."""
+
+        index = self.index
+        return np.array([index[node] for node in nodes], dtype = np.int32)
+
+    @staticmethod
+    def get(network):
+        """Returns a snapshot of network for its current topology version.
+
+        The snapshot is cached in network.graph and only rebuilt after the topology changed.
+        """
+
+        snapshot = network.graph.get('csr')
+        version = network.graph.get('version', 0)
+        if snapshot is None or snapshot.version != version or len(snapshot) != len(network):
+            snapshot = CSRTopology(network)
+            network.graph['csr'] = snapshot
+        return snapshot
@@ -1,47 +1,236 @@
-import networkx as nx
+import heapq
 
 def join(network, exclude, T, v):
     """Implementation of the greedy approximation algorithm for constructing DSTs.
-    
+
     See algorithm 3 in 'Resilient SDN-based multicast'.
-    
+
+    All links have the same weight, so the node of T closest to v is found with a bidirectional breadth-first
+    search. The search starts backward from v, and only also searches forward from the nodes of T once
+    the backward frontier has grown larger than T. It stops as soon as both searches meet, which for large
+    trees usually is the moment the backward search touches the tree.
+
     Arguments:
     network: network graph
     exclude: all links that should be excluded from the trees
     T: current trees
     v: node to be added to T
     """
-    
-    if v in T:
+
+    if v in T or v not in network:
         return []
-        
-    def weight(x, y, edata):
-        if not edata['live']:
-            return None
-        if (x,y) in exclude:
-            return None
-        if not T.has_edge(x,y) and y in T:
-            return None #Resulting trees should actually be trees
-        return 1
-    try:
-        length, paths = nx.multi_source_dijkstra(G=network, sources=set(T.nodes()), target=v, weight=weight)
-        if v not in paths:
+
+    #node -> (next node towards v, distance to v)
+    backward = {v: (None, 0)}
+    backward_frontier = [v]
+
+    #node -> (previous node coming from T, distance from T), filled once the forward search starts
+    forward = None
+    forward_frontier = None
+
+    meet = None
+    while meet is None:
+        if forward is None and len(backward_frontier) > len(T):
+            forward = dict((node, (None, 0)) for node in T)
+            forward_frontier = list(T)
+
+        if len(backward_frontier) == 0 or (forward is not None and len(forward_frontier) == 0):
             return []
-        path = paths[v]
 
-        w = path[0]
+        if forward is None or len(backward_frontier) <= len(forward_frontier):
+            backward_frontier, meet = _expand_backward(network, exclude, T, backward, backward_frontier, forward)
+        else:
+            forward_frontier, meet = _expand_forward(network, exclude, backward, forward, forward_frontier)
 
-        
-        pre = []
+    #Path from the tree to meet
+    path = []
+    cur = meet
+    while cur is not None:
+        path.append(cur)
+        cur = forward[cur][0] if forward is not None else None
+    path.reverse()
 
-        cur = w
-        root = T.graph['root']
-        while cur != root:
-            cur = list(T.predecessors(cur))[0]
-            pre.append(cur)
+    #Path from meet to v
+    cur = backward[meet][0]
+    while cur is not None:
+        path.append(cur)
+        cur = backward[cur][0]
 
-        pre.reverse()
-        
-        return pre + path
-    except (nx.NetworkXNoPath, nx.NetworkXError):
-        return []
+    #Path from the root to the tree node the new branch starts at
+    pre = []
+
+    cur = path[0]
+    root = T.graph['root']
+    T_pred = T.pred
+    while cur != root:
+        for cur in T_pred[cur]:
+            break
+        pre.append(cur)
+
+    pre.reverse()
+
+    return pre + path
+
+def join_many(network, exclude, T, targets):
+    """Computes the joins of all targets to T at once.
+
+    Returns a dictionary target -> path, where every path starts at the root of T. T is not changed,
+    together the paths form a tree with T.
+
+    Just like repeated joins, the target closest to the tree is connected first, after which its new
+    branch counts as part of the tree for the remaining targets. The distances of all nodes to the tree
+    are kept in a single search, which only continues from the nodes of every new branch.
+
+    Arguments:
+    network: network graph
+    exclude: all links that should be excluded from the trees
+    T: current trees
+    targets: nodes to be added to T
+    """
+
+    exclude = set(exclude)
+
+    paths = {}
+    remaining = []
+    for v in targets:
+        paths[v] = []
+        if v not in T and v in network and v not in remaining:
+            remaining.append(v)
+
+    #Predecessors of the nodes of the new branches
+    branch_pred = {}
+
+    dist = dict((node, 0) for node in T)
+    pred = dict((node, None) for node in T)
+    heap = [(0, node) for node in T]
+
+    while len(remaining) > 0:
+        _expand_tree_search(network, exclude, T, branch_pred, dist, pred, heap)
+
+        closest = None
+        for v in remaining:
+            if v in dist and (closest is None or dist[v] < dist[closest]):
+                closest = v
+        if closest is None:
+            break
+
+        #Add the new branch to the tree
+        branch = []
+        cur = closest
+        while dist[cur] != 0:
+            branch.append(cur)
+            cur = pred[cur]
+        branch.reverse()
+
+        for node in branch:
+            branch_pred[node] = cur
+            cur = node
+
+            dist[node] = 0
+            pred[node] = None
+            heapq.heappush(heap, (0, node))
+
+        for v in remaining:
+            if v in branch_pred:
+                paths[v] = _tree_path(T, branch_pred, v)
+        remaining = [v for v in remaining if v not in branch_pred]
+
+    return paths
+
+def _expand_tree_search(network, exclude, T, branch_pred, dist, pred, heap):
+    """Dijkstra's algorithm with unit weights from the (distance, node) pairs in heap.
+
+    Links into the tree are never followed (resulting trees should actually be trees).
+    """
+
+    while len(heap) > 0:
+        d, x = heapq.heappop(heap)
+        if d != dist[x]:
+            continue
+
+        for y, edata in network.succ[x].items():
+            if y in T or y in branch_pred or not edata['live'] or (x,y) in exclude:
+                continue
+
+            if y not in dist or d + 1 < dist[y]:
+                dist[y] = d + 1
+                pred[y] = x
+                heapq.heappush(heap, (d + 1, y))
+
+def _tree_path(T, branch_pred, v):
+    """Returns the path from the root of T to v, where v is either in T or in a new branch."""
+
+    path = [v]
+    root = T.graph['root']
+    T_pred = T.pred
+
+    cur = v
+    while cur != root:
+        if cur in branch_pred:
+            cur = branch_pred[cur]
+        else:
+            for cur in T_pred[cur]:
+                break
+        path.append(cur)
+
+    path.reverse()
+    return path
+
+def _expand_backward(network, exclude, T, backward, frontier, forward):
+    """Expand the backward search by one level. Returns (new frontier, meeting node or None)."""
+
+    next_frontier = []
+    meet = None
+    meet_distance = None
+
+    for y in frontier:
+        distance = backward[y][1] + 1
+
+        for x, edata in network.pred[y].items():
+            if x in backward or not edata['live'] or (x,y) in exclude:
+                continue
+
+            backward[x] = (y, distance)
+
+            if x in T:
+                remaining = 0
+            elif forward is not None and x in forward:
+                remaining = forward[x][1]
+            else:
+                next_frontier.append(x)
+                continue
+
+            if meet is None or remaining < meet_distance:
+                meet = x
+                meet_distance = remaining
+
+    return next_frontier, meet
+
+def _expand_forward(network, exclude, backward, forward, frontier):
+    """Expand the forward search by one level. Returns (new frontier, meeting node or None).
+
+    Nodes of T are all part of forward, so links into T are never followed (resulting trees should actually be trees).
+    """
+
+    next_frontier = []
+    meet = None
+    meet_distance = None
+
+    for x in frontier:
+        distance = forward[x][1] + 1
+
+        for y, edata in network.succ[x].items():
+            if y in forward or not edata['live'] or (x,y) in exclude:
+                continue
+
+            forward[y] = (x, distance)
+
+            if y in backward:
+                remaining = backward[y][1]
+                if meet is None or remaining < meet_distance:
+                    meet = y
+                    meet_distance = remaining
+            else:
+                next_frontier.append(y)
+
+    return next_frontier, meet
@@ -0,0 +1,445 @@
+import AbstractTreeBuilder
+import JoinCache
+
+class DetourTreeBuilder(AbstractTreeBuilder.AbstractTreeBuilder):
+    """Protects against F link failures with a detour around every protected link.
+
+    The backup tree of link (x,y) is a single path from x to y that avoids the link, a detour. At y the packets
+    get the tag of the tree the link belongs to again and are forwarded by its flow entries (see
+    MulticastController.add_rejoin), so a detour is shared by all subscribers below the link and does not
+    depend on them. The links of a detour are protected by detours of their own, up to F levels deep.
+
+    When F failures can cut y off, one of these detours does not exist and the detours of (x,y) do not protect
+    the subscribers below y that can still be reached. Such a link gets a backup tree to the subscribers below
+    it instead, as in PerLinkTreeBuilder, whose links are protected by detours or backup trees in turn.
+
+    PerLinkTreeBuilder installs a backup tree to all subscribers below every protected link instead, which
+    makes the amount of flow and group entries grow with the size of the trees at every level.
+    """
+
+    def __init__(self, F, controller, join, join_many = None):
+        """
+        Arguments:
+        F: amount of (link) fault tolerance
+        controller: MulticastController used to install flows
+        join: join function used to compute paths
+        join_many: function used to compute the paths of many subscribers at once, see add_subscribers
+        """
+
+        super(DetourTreeBuilder, self).__init__(F, controller, join, join_many)
+
+        self.complete = {} #(x, y, excluded links) -> whether link (x,y) can get a detour, see _detour_complete
+        self.complete_version = None #Path version of the network self.complete belongs to
+
+    def _process_request(self, T, v, r, F, ip_group, ip_source):
+        if not r:
+            return self._leave(T, v, ip_group, ip_source)
+
+        network = self.controller.get_network()
+        path = self.join(network, [], T, v)
+
+        if len(path) == 0:
+            self.controller.log('no path from %s to %s', T.graph['root'], v)
+            return False
+
+        links = self._add_path(ip_group, ip_source, T, path)
+
+        if F > 0:
+            self._protect_links(T, [v], links, F, ip_group, ip_source)
+
+        return True
+
+    def _process_requests(self, T, subscribers, F, ip_group, ip_source):
+        """Add all subscribers to T at once, their primary paths come from a single join_many call."""
+
+        if self.join_many is None:
+            return super(DetourTreeBuilder, self)._process_requests(T, subscribers, F, ip_group, ip_source)
+
+        network = self.controller.get_network()
+        paths = self.join_many(network, [], T, subscribers)
+
+        added = []
+        links = []
+        for v in subscribers:
+            path = paths.get(v, [])
+            if len(path) == 0:
+                self.controller.log('no path from %s to %s', T.graph['root'], v)
+                continue
+
+            links.extend(self._add_path(ip_group, ip_source, T, path))
+            added.append(v)
+
+        if F > 0:
+            self._protect_links(T, added, links, F, ip_group, ip_source)
+
+        return added
+
+    def _protect_links(self, T, subscribers, links, F, ip_group, ip_source):
+        """Protect the links added to primary tree T for subscribers.
+
+        Links already in T are protected already, but subscribers still have to be added to the backup trees of
+        those that have one instead of a detour.
+        """
+
+        network = self.controller.get_network()
+        added = set(links)
+
+        missing = {}
+        for v in subscribers:
+            path = self._get_path(T, v)
+            for i in range(1, len(path)):
+                link = (path[i-1], path[i])
+                backup = T[link[0]][link[1]]['backup']
+                if link not in added and backup is not None and v not in backup and not self._is_detour(backup):
+                    missing.setdefault(link, []).append(v)
+
+        for x, y in sorted(missing):
+            self._add_backup_tree(network, T, x, y, [], F, ip_group, ip_source, missing[(x,y)])
+
+        for x, y in links:
+            self._protect_link(T, x, y, [], F, ip_group, ip_source)
+
+    def _protect_link(self, P, x, y, down, F, ip_group, ip_source):
+        """Make sure link (x,y) of tree P has a detour, and all links of that detour up to F levels deep.
+
+        If F failures can cut y off (see _detour_complete), the link gets a backup tree to the subscribers below
+        it instead.
+
+        Arguments:
+        P: tree holding link (x,y)
+        x, y: link to protect
+        down: links excluded by P (both directions)
+        F: amount of (link) fault tolerance
+        ip_group: IP address of multicast group of P
+        ip_source: IP address of source of P
+        """
+
+        network = self.controller.get_network()
+
+        #Hosts only have a single link
+        if network.node[y]['host']:
+            return
+
+        detour = P[x][y]['backup']
+        if detour is not None and not self._is_detour(detour):
+            subscribers = [v for v in self._get_subscribers_below(P, y) if v not in detour]
+            if len(subscribers) > 0:
+                self._add_backup_tree(network, P, x, y, down, F, ip_group, ip_source, subscribers)
+            return
+
+        if detour is None:
+            L = set(down)
+            L.add((x,y))
+            L.add((y,x))
+
+            #The links of a detour only get detours, the check of the link it protects included them
+            if (P.graph['parent'] is None or not self._is_detour(P)) and \
+               not self._detour_complete(network, x, y, L, F):
+                self._add_backup_tree(network, P, x, y, down, F, ip_group, ip_source,
+                                      self._get_subscribers_below(P, y))
+                return
+
+            detour = self._add_detour(network, P, x, y, down, F, ip_group, ip_source)
+            if detour is None:
+                return
+
+        L = detour.graph['exclude']
+        if len(L)/2 < F:
+            path = self._get_path(detour, y)
+            for i in range(1, len(path)):
+                self._protect_link(detour, path[i-1], path[i], L, F, ip_group, ip_source)
+
+    def _detour_complete(self, network, x, y, L, F):
+        """Returns True if link (x,y) has a detour avoiding links L, and so have all links of that detour and of
+        their detours, up to F levels deep.
+
+        Every failure a packet meets on its way to y takes it one level deeper, so these detours protect against
+        any F failures that leave y reachable. When F failures cut y off, one of them does not exist.
+        The results are kept until the paths of the network change.
+        """
+
+        version = network.graph.get('paths_version', 0)
+        if version != self.complete_version:
+            self.complete = {}
+            self.complete_version = version
+
+        key = (x, y, frozenset(L))
+        if key not in self.complete:
+            path = self.join(network, L, self._empty_tree(x), y)
+            complete = len(path) > 0
+
+            if complete and len(L)/2 < F:
+                for i in range(1, len(path)):
+                    down = set(L)
+                    down.add((path[i-1], path[i]))
+                    down.add((path[i], path[i-1]))
+                    if not self._detour_complete(network, path[i-1], path[i], down, F):
+                        complete = False
+                        break
+
+            self.complete[key] = complete
+
+        return self.complete[key]
+
+    def _add_backup_tree(self, network, P, x, y, down, F, ip_group, ip_source, subscribers):
+        """Add subscribers below link (x,y) of tree P to the backup tree of the link, which is created if needed.
+
+        The links of the backup tree the subscribers use are protected in turn, up to F levels deep: new links
+        get a detour or backup tree, the backup trees of links already there get the subscribers as well.
+        """
+
+        L = set(down)
+        L.add((x,y))
+        L.add((y,x))
+
+        backup = P[x][y]['backup']
+        predecessor = self._predecessor(P, x)
+
+        self.controller.install_stage(len(L)/2)
+
+        links = []
+        used = set()
+        for v in subscribers:
+            b_path = self.join(network, L, backup if backup is not None else self._empty_tree(x), v)
+            if len(b_path) == 0:
+                self.controller.log('no backup path from %s to %s', x, v)
+                continue
+
+            if backup is None:
+                backup = self._create_tree(x, P, predecessor)
+                if backup is None:
+                    return
+                backup.graph['exclude'] = L
+                P[x][y]['backup'] = backup
+
+            if b_path[1] not in backup[x]:
+                self.controller.add_backup(predecessor, x, ip_group, y, b_path[1], ip_source, backup.graph['tag'],
+                                           P.graph['tag'], len(L)/2 < F)
+                backup.add_edge(x, b_path[1], backup = None)
+            self._add_path(ip_group, ip_source, backup, b_path[1:])
+
+            for i in range(1, len(b_path)):
+                if (b_path[i-1], b_path[i]) not in used:
+                    used.add((b_path[i-1], b_path[i]))
+                    links.append((b_path[i-1], b_path[i]))
+
+        if len(L)/2 < F:
+            for a, b in links:
+                self._protect_link(backup, a, b, L, F, ip_group, ip_source)
+
+    def _add_detour(self, network, P, x, y, down, F, ip_group, ip_source):
+        """Compute and install the detour of link (x,y) of tree P. Returns the detour, or None if there is none."""
+
+        L = set(down)
+        L.add((x,y))
+        L.add((y,x))
+
+        path = self.join(network, L, self._empty_tree(x), y)
+        if len(path) == 0:
+            self.controller.log('no detour from %s to %s', x, y)
+            return None
+
+        predecessor = self._predecessor(P, x)
+
+        detour = self._create_tree(x, P, predecessor)
+        if detour is None:
+            return None
+        detour.graph['exclude'] = L
+        P[x][y]['backup'] = detour
+
+        tag = detour.graph['tag']
+
+        #A detour avoiding k links belongs to protection level k
+        self.controller.install_stage(len(L)/2)
+        self.controller.add_backup(predecessor, x, ip_group, y, path[1], ip_source, tag, P.graph['tag'],
+                                   len(L)/2 < F)
+        detour.add_edge(x, path[1], backup = None)
+        self._add_path(ip_group, ip_source, detour, path[1:])
+
+        self.controller.add_rejoin(y, ip_group, ip_source, tag, self._rejoin_tag(detour))
+
+        return detour
+
+    def _remove_detour(self, P, x, y, ip_group, ip_source, keep_link = True):
+        """Remove the detour or backup tree of link (x,y) of tree P, and all detours and backup trees below it.
+
+        If keep_link is False, the flow entry of (x,y) is about to be removed, which removes the group the
+        detour starts from as well.
+        """
+
+        detour = P[x][y]['backup']
+        if detour is None:
+            return
+
+        if keep_link:
+            for first in list(detour.successors(x)):
+                self.controller.remove_backup(detour.graph['predecessor_switch'], x, ip_group, y, first,
+                                              ip_source, detour.graph['tag'])
+
+        for parent, a, b, backup in [(P, x, y, detour)] + list(self._backup_trees(detour)):
+            if self._is_detour(backup):
+                self.controller.remove_rejoin(b, ip_group, ip_source, backup.graph['tag'],
+                                              self._rejoin_tag(backup))
+
+            for node in backup:
+                if node != a and backup.out_degree(node) > 0:
+                    self.controller.remove_flow(node, ip_group, 'all', True, ip_source, backup.graph['tag'])
+
+        P[x][y]['backup'] = None
+        self._release_tags(detour)
+
+    def _rejoin_tag(self, detour):
+        """Returns the tag the packets of detour get when they rejoin at the end of the link it protects."""
+
+        parent = detour.graph['parent']
+        rejoin = self._get_leaf(detour)
+
+        #A detour ending where its parent detour ends rejoins the tree its parent rejoins
+        if parent.graph['parent'] is not None and rejoin == self._get_leaf(parent):
+            return self._rejoin_tag(parent)
+        return parent.graph['tag']
+
+    def _is_detour(self, backup):
+        """Returns True if backup is a detour, False if it is a backup tree to the subscribers below a link."""
+
+        return not self.controller.get_network().node[self._get_leaf(backup)]['host']
+
+    def _get_leaf(self, detour):
+        """Returns the switch where detour ends."""
+
+        cur = detour.graph['root']
+        while detour.out_degree(cur) > 0:
+            cur = list(detour.successors(cur))[0]
+        return cur
+
+    def _predecessor(self, T, x):
+        if x == T.graph['root']:
+            return T.graph['predecessor_switch']
+        return list(T.predecessors(x))[0]
+
+    def _leave(self, T, v, ip_group, ip_source, origin_dst = None):
+        """Remove subscriber v from tree T, along with the detours and backup trees of the links only v used.
+
+        If T is the backup tree of link (x,y), origin_dst is y.
+        """
+
+        root = T.graph['root']
+
+        if v not in T or v == root:
+            return False
+
+        links = []
+        cur = v
+        while cur != root and T.out_degree(cur) == (0 if cur == v else 1):
+            pre = list(T.predecessors(cur))[0]
+            links.append((pre, cur))
+            cur = pre
+
+        #Removing the detours first keeps T whole, which tells detours and backup trees apart (see _is_detour)
+        for x, y in links:
+            self._remove_detour(T, x, y, ip_group, ip_source, False)
+
+        for x, y in links:
+            if x == root and T.graph['parent'] is not None:
+                self._remove_backup(T.graph['predecessor_switch'], x, origin_dst, y, ip_group, ip_source,
+                                    T.graph['tag'])
+            else:
+                self._remove_flow(x, y, ip_group, ip_source, T)
+            T.remove_node(y)
+
+        #The links v shares with other subscribers keep their protection, v only leaves their backup trees
+        while cur != root:
+            pre = list(T.predecessors(cur))[0]
+
+            backup = T[pre][cur]['backup']
+            if backup is not None and v in backup and not self._is_detour(backup):
+                self._leave(backup, v, ip_group, ip_source, cur)
+                if backup.number_of_edges() == 0:
+                    T[pre][cur]['backup'] = None
+                    self._release_tags(backup)
+
+            cur = pre
+
+        return True
+
+    def _repair(self, broken_links, tree, ip_group, ip_source):
+        """Reroute the subscribers of tree using a broken link, and remove the detours using a broken link.
+
+        Restoring the protection of the affected links is queued.
+        """
+
+        key = (ip_group, ip_source)
+
+        rerouted = set()
+        for link in broken_links:
+            if tree.has_edge(link[0], link[1]):
+                rerouted.update(self._get_subscribers_below(tree, link[1]))
+
+        for subscriber in rerouted:
+            self._leave(tree, subscriber, ip_group, ip_source)
+
+        for subscriber in rerouted:
+            if self._process_request(tree, subscriber, True, 0, ip_group, ip_source):
+                self.controller.log('rerouted %s in group %s', subscriber, key)
+                if self.F > 0:
+                    self._queue_repair(key, subscriber, None)
+            else:
+                self.controller.log('could not reroute %s in group %s', subscriber, key)
+
+        #Broken detours are replaced as a whole, the new detour may well be the same without the broken link
+        for x, y in list(tree.edges()):
+            if not tree.has_edge(x, y):
+                continue
+
+            detour = tree[x][y]['backup']
+            if detour is None:
+                continue
+
+            if any(self._uses_broken_link(backup, broken_links) for backup in
+                   [detour] + [item[3] for item in self._backup_trees(detour)]):
+                self._remove_detour(tree, x, y, ip_group, ip_source)
+                for subscriber in self._get_subscribers_below(tree, y):
+                    self._queue_repair(key, subscriber, None)
+
+    def _uses_broken_link(self, tree, broken_links):
+        return any(tree.has_edge(link[0], link[1]) for link in broken_links)
+
+    def _protect(self, T, v, ip_group, ip_source):
+        path = self._get_path(T, v)
+        for i in range(1, len(path)):
+            self._protect_link(T, path[i-1], path[i], [], self.F, ip_group, ip_source)
+
+    def _reprotect(self, T, x, y, backup, v, ip_group, ip_source):
+        #Repairs are always queued for the primary tree, see _repair
+        self._protect(T.graph['primary'], v, ip_group, ip_source)
+
+    def _empty_tree(self, switch_id):
+        tree = JoinCache.Tree(root = switch_id)
+        tree.add_node(switch_id)
+        return tree
+
+    def _add_path(self, ip_group, ip_source, tree, path):
+        """Add path to tree and install the necessary flow entries. Returns the links that were added."""
+
+        tag = tree.graph['tag']
+
+        links = []
+        for i in range(len(path) - 1, 0, -1):
+            prev = path[i - 1]
+            cur = path[i]
+
+            if prev not in tree or cur not in tree[prev]:
+                self.controller.add_flow(prev, ip_group, [cur], True, ip_source, tag)
+                tree.add_edge(prev, cur, backup = None)
+                links.append((prev, cur))
+            else:
+                break
+
+        links.reverse()
+        return links
+
+    def _remove_flow(self, src, dst, ip_group, ip_source, tree):
+        self.controller.remove_flow(src, ip_group, [dst], True, ip_source, tree.graph['tag'])
+
+    def _remove_backup(self, predecessor, src, orig_dst, dst, ip_group, ip_source, tag):
+        self.controller.remove_backup(predecessor, src, ip_group, orig_dst, dst, ip_source, tag)
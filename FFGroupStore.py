@@ -0,0 +1,200 @@
+class FFBucket(object):
+    """A bucket of a Fast Failover group."""
+
+    __slots__ = ('ports', 'tag', 'drop', 'shared')
+
+    def __init__(self, ports, tag, drop = False, shared = False):
+        """
+        Arguments:
+        ports: output ports of the bucket
+        tag: VLAN tag packets get in this bucket, or None
+        drop: True if the bucket drops packets, it only keeps the bucket order of the group it was copied from
+        shared: True if the bucket outputs to several ports, it then watches the in port of the group
+        """
+
+        self.ports = ports
+        self.tag = tag
+        self.drop = drop
+        self.shared = shared
+
+    def copy(self, drop):
+        return FFBucket(list(self.ports), self.tag, drop, self.shared)
+
+class FFGroup(object):
+    """A Fast Failover group of a switch."""
+
+    __slots__ = ('id', 'buckets', 'in_port')
+
+    def __init__(self, id, buckets, in_port):
+        """
+        Arguments:
+        id: group id
+        buckets: list of FFBucket, the first live bucket is used
+        in_port: port the packets using this group come in on, or None if unknown
+        """
+
+        self.id = id
+        self.buckets = buckets
+        self.in_port = in_port
+
+class FFGroupStore(object):
+    """The Fast Failover groups of a single switch.
+
+    Groups are indexed by their id, by the (port, flow key) pairs that use them and by the tags of their buckets.
+    A (port, flow key) pair refers to a list of (group id, bucket index): the groups that hold the
+    bucket outputting to port for packets of that flow. The first pair of a group points to its first bucket,
+    all copies of a group are listed under that pair.
+
+    Changes to buckets mark their group dirty. take_dirty() returns the groups whose GroupMod has to be sent,
+    so every group is serialized once, no matter how many of its buckets changed.
+    """
+
+    def __init__(self):
+        self.groups = {} #group id -> FFGroup
+        self.refs = {} #(port, flow key) -> [(group id, bucket index)]
+        self.users = {} #group id -> (port, flow key) pairs whose list refers to the group
+        self.tags = {} #tag -> group id -> amount of buckets with that tag
+        self.dirty = set() #ids of groups that changed since the last take_dirty
+
+    def __contains__(self, g_key):
+        return g_key in self.refs
+
+    def __getitem__(self, g_key):
+        return self.refs[g_key]
+
+    def get(self, g_key, default = None):
+        """Returns the (group id, bucket index) list of (port, flow key) pair g_key, or default."""
+        return self.refs.get(g_key, default)
+
+    def group(self, g_id):
+        return self.groups[g_id]
+
+    def __len__(self):
+        return len(self.groups)
+
+    def add_group(self, g_id, buckets, in_port):
+        """Add a new group with buckets. New groups are not dirty, their GroupMod is sent when adding them."""
+
+        group = FFGroup(g_id, buckets, in_port)
+        self.groups[g_id] = group
+        for bucket in buckets:
+            self._index_tag(g_id, bucket.tag)
+        return group
+
+    def remove_group(self, g_id):
+        """Remove group g_id and returns it. References to it have to be removed by the caller."""
+
+        group = self.groups.pop(g_id)
+        for bucket in group.buckets:
+            self._unindex_tag(g_id, bucket.tag)
+        self.dirty.discard(g_id)
+        return group
+
+    def remove_groups(self, g_ids):
+        """Remove groups g_ids together with every (port, flow key) pair that refers to one of them.
+
+        Meant for groups that are removed along with all flows using them, the lists of the pairs are dropped
+        as a whole.
+        """
+
+        for g_id in g_ids:
+            self.remove_group(g_id)
+        for g_id in g_ids:
+            for g_key in list(self.users.get(g_id, ())):
+                self.pop_refs(g_key)
+
+    def set_refs(self, g_key, refs):
+        self._unindex_refs(g_key)
+        self.refs[g_key] = refs
+        for g_id, index in refs:
+            self.users.setdefault(g_id, set()).add(g_key)
+
+    def add_ref(self, g_key, g_id, index):
+        self.refs.setdefault(g_key, []).append((g_id, index))
+        self.users.setdefault(g_id, set()).add(g_key)
+
+    def remove_ref(self, g_key, g_id):
+        """Remove group g_id from the list of g_key, which is removed once it is empty."""
+
+        refs = self.refs.get(g_key)
+        if refs is None:
+            return
+
+        refs[:] = [ref for ref in refs if ref[0] != g_id]
+        self._unuse(g_id, g_key)
+        if len(refs) == 0:
+            del self.refs[g_key]
+
+    def pop_refs(self, g_key):
+        self._unindex_refs(g_key)
+        return self.refs.pop(g_key, None)
+
+    def append_bucket(self, g_id, bucket, in_port):
+        group = self.groups[g_id]
+        group.buckets.append(bucket)
+        self._index_tag(g_id, bucket.tag)
+        self._changed(group, in_port)
+
+    def add_port(self, g_id, index, port, in_port):
+        """Let bucket index of group g_id also output to port."""
+
+        group = self.groups[g_id]
+        bucket = group.buckets[index]
+        bucket.ports.append(port)
+        bucket.shared = True
+        self._changed(group, in_port)
+
+    def remove_port(self, g_id, index, port, in_port):
+        group = self.groups[g_id]
+        group.buckets[index].ports.remove(port)
+        self._changed(group, in_port)
+
+    def truncate(self, g_id, index, in_port):
+        """Remove all buckets of group g_id from index on and returns them."""
+
+        group = self.groups[g_id]
+        removed = group.buckets[index:]
+        del group.buckets[index:]
+        for bucket in removed:
+            self._unindex_tag(g_id, bucket.tag)
+        self._changed(group, in_port)
+        return removed
+
+    def groups_with_tag(self, tag):
+        """Returns the ids of the groups with a bucket for tag."""
+        return self.tags.get(tag, {})
+
+    def take_dirty(self):
+        """Returns the groups that changed since the last call."""
+
+        groups = [self.groups[g_id] for g_id in sorted(self.dirty)]
+        self.dirty = set()
+        return groups
+
+    def _unindex_refs(self, g_key):
+        for g_id, index in self.refs.get(g_key, ()):
+            self._unuse(g_id, g_key)
+
+    def _unuse(self, g_id, g_key):
+        keys = self.users.get(g_id)
+        if keys is not None:
+            keys.discard(g_key)
+            if len(keys) == 0:
+                del self.users[g_id]
+
+    def _changed(self, group, in_port):
+        group.in_port = in_port
+        self.dirty.add(group.id)
+
+    def _index_tag(self, g_id, tag):
+        groups = self.tags.setdefault(tag, {})
+        groups[g_id] = groups.get(g_id, 0) + 1
+
+    def _unindex_tag(self, g_id, tag):
+        groups = self.tags[tag]
+        if groups[g_id] == 1:
+            del groups[g_id]
+            if len(groups) == 0:
+                del self.tags[tag]
+        else:
+            groups[g_id] -= 1
@@ -0,0 +1,198 @@
+import numpy as np
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+import SPT
+
+#Value scipy uses in predecessor arrays for nodes without predecessor
+_NO_PREDECESSOR = -9999
+
+class FailureRoutes(object):
+    """Shortest paths between all switches, for the intact network and for every single link failure.
+
+    The links between switches are searched once per topology version: a breadth-first search from every
+    switch for the intact network, and for every link a search from both of its ends without that link.
+    Joining a subscriber to a tree without links, such as the first subscriber of a group or the first
+    backup path protecting a link, then only reads a path from these tables (see spt_join).
+
+    The tables are only valid for the topology version they were built at, use FailureRoutes.get to obtain
+    up to date tables.
+    """
+
+    def __init__(self, network):
+        self.version = network.graph.get('version', 0)
+
+        self.nodes = [node for node in network if not network.node[node].get('host', False)]
+        self.index = dict((node, i) for i, node in enumerate(self.nodes))
+
+        n = len(self.nodes)
+        index = self.index
+
+        links = [(index[x], index[y]) for x, y, edata in network.edges(data = True)
+                 if x in index and y in index and edata['live']]
+        rows = np.array([x for x, y in links], dtype = np.int32)
+        cols = np.array([y for x, y in links], dtype = np.int32)
+
+        graph = csr_matrix((np.ones(len(links)), (rows, cols)), shape = (n, n))
+        self.distances, self.predecessors = dijkstra(graph, directed = True, unweighted = True,
+                                                     return_predecessors = True)
+        self.predecessors = self.predecessors.astype(np.int32)
+
+        #Every link between two switches is a failure scenario, (x,y) and (y,x) fail together
+        scenarios = sorted(set((min(x, y), max(x, y)) for x, y in links))
+        self.scenarios = {} #(switch index, switch index) -> scenario, in both orders
+        self.failure_predecessors = np.empty((len(scenarios), 2, n), dtype = np.int32)
+
+        for scenario, (x, y) in enumerate(scenarios):
+            up = ~(((rows == x) & (cols == y)) | ((rows == y) & (cols == x)))
+            failed = csr_matrix((np.ones(np.count_nonzero(up)), (rows[up], cols[up])), shape = (n, n))
+            dist, predecessors = dijkstra(failed, directed = True, unweighted = True, indices = [x, y],
+                                          return_predecessors = True)
+            self.failure_predecessors[scenario] = predecessors
+
+            self.scenarios[(x, y)] = scenario
+            self.scenarios[(y, x)] = scenario
+
+    def path(self, network, exclude, T, v):
+        """Returns the path join would return from the root of T to v, [] if there is none.
+
+        Returns None if the tables do not hold the answer: T has links, or exclude is more than a single
+        link between switches with the root of T at one of its ends.
+        """
+
+        predecessors = self._predecessors(exclude, T)
+        if predecessors is None:
+            return None
+
+        if v in T:
+            return []
+
+        #Hosts are connected to a single switch, and are never passed through
+        last = []
+        if v not in self.index:
+            if v not in network:
+                return []
+
+            switch = next(iter(network.pred[v]), None)
+            if switch not in self.index or not network[switch][v]['live'] or (switch, v) in exclude:
+                return []
+
+            last = [v]
+            v = switch
+
+        root = self.index[T.graph['root']]
+        target = self.index[v]
+        if target == root:
+            return [self.nodes[root]] + last
+
+        if predecessors[target] == _NO_PREDECESSOR:
+            return []
+
+        path = []
+        cur = target
+        while cur != _NO_PREDECESSOR:
+            path.append(self.nodes[cur])
+            cur = predecessors[cur]
+
+        path.reverse()
+        return path + last
+
+    def _predecessors(self, exclude, T):
+        """Returns the predecessors of the shortest paths from the root of T without the links of exclude."""
+
+        root = T.graph['root']
+        if T.number_of_edges() > 0 or root not in self.index:
+            return None
+
+        root = self.index[root]
+        if len(exclude) == 0:
+            return self.predecessors[root]
+
+        ends = set()
+        for x, y in exclude:
+            if x not in self.index or y not in self.index:
+                return None
+            ends.add((self.index[x], self.index[y]))
+
+        scenario = None
+        for link in ends:
+            if scenario is not None and self.scenarios.get(link) != scenario:
+                return None
+            scenario = self.scenarios.get(link)
+
+        #A link that does not exist or is down does not change any path
+        if scenario is None:
+            return self.predecessors[root]
+
+        x, y = min(link), max(link)
+        if root == x:
+            return self.failure_predecessors[scenario][0]
+        if root == y:
+            return self.failure_predecessors[scenario][1]
+        return None
+
+    def _switches_changed(self, network):
+        """Returns True if links between switches changed since the tables were built."""
+
+        changes = network.graph.get('changes')
+        if changes is None or len(changes) == 0 or changes[0][0] > self.version + 1:
+            return True
+
+        for version, links in changes:
+            if version > self.version:
+                for x, y in links:
+                    if not network.node[x].get('host', False) and not network.node[y].get('host', False):
+                        return True
+        return False
+
+    @staticmethod
+    def get(network):
+        """Returns the tables of network for its current topology version.
+
+        The tables are cached in network.graph. They are only rebuilt after links between switches changed,
+        hosts coming and going do not change them.
+        """
+
+        routes = network.graph.get('failure_routes')
+        version = network.graph.get('version', 0)
+        if routes is None or (routes.version != version and routes._switches_changed(network)):
+            routes = FailureRoutes(network)
+            network.graph['failure_routes'] = routes
+        routes.version = version
+        return routes
+
+def spt_join(network, exclude, T, v):
+    """Used to construct SPTs like SPT.join. Joins to trees without links are read from the FailureRoutes tables.
+
+    Paths read from the tables are shortest paths too, but ties between paths of the same length may be broken
+    differently than SPT.join does.
+
+    Arguments:
+    network: network graph
+    exclude: all links that should be excluded from the trees
+    T: current trees
+    v: node to be added to T
+    """
+
+    path = FailureRoutes.get(network).path(network, exclude, T, v)
+    if path is None:
+        return SPT.join(network, exclude, T, v)
+    return path
+
+def spt_join_many(network, exclude, T, targets):
+    """Like SPT.join_many. Joins to trees without links are read from the FailureRoutes tables.
+
+    All paths of a tree without links come from the same shortest path tree, so together they form a tree.
+
+    Arguments:
+    network: network graph
+    exclude: all links that should be excluded from the trees
+    T: current trees
+    targets: nodes to be added to T
+    """
+
+    routes = FailureRoutes.get(network)
+    if routes._predecessors(exclude, T) is None:
+        return SPT.join_many(network, exclude, T, targets)
+    return dict((v, routes.path(network, exclude, T, v)) for v in targets)
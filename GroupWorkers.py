@@ -0,0 +1,143 @@
+from collections import deque
+
+import networkx as nx
+
+from eventlet import tpool
+from eventlet import corolocal
+from ryu.lib import hub
+
+class GroupWorkers(object):
+    """Processes the requests of every multicast (group, source) pair in order, outside the event handlers.
+
+    Every pair with pending requests gets a green thread of its own, at most workers of them run at the same
+    time. The requests of a pair are handled one after another in the order they were submitted, so its tree
+    is only changed by one request at a time. Requests of different pairs interleave whenever one of them
+    waits for a path computation, which runs in a native thread on a copy of the network (see offload) while
+    the event loop keeps handling LLDP, topology events and other packet-ins. Event handlers change the
+    network itself and never wait for a path computation.
+    """
+
+    #Networks with fewer nodes are searched in the green thread itself, handing the search to a native thread
+    #takes longer than the search
+    OFFLOAD_MIN_NODES = 256
+
+    def __init__(self, workers, logger):
+        """
+        Arguments:
+        workers: maximum amount of pairs processed at the same time, 0 to process requests when submitted
+        logger: logger for requests that fail
+        """
+
+        self.workers = workers
+        self.logger = logger
+        self.queues = {} #(group, source) -> deque of (function, args)
+        self.slots = hub.BoundedSemaphore(max(workers, 1))
+
+        #Held by a path computation, join functions keep state of their own (see SPT) that only one of them
+        #may change at a time
+        self.join_lock = hub.Semaphore(1)
+
+        #Copy of the network read by path computations in a native thread, see _snapshot
+        self.snapshot = None
+
+        self.idle = hub.Event()
+        self.idle.set()
+
+        #Key of the pair processed by the current green thread, if it is a worker
+        self.local = corolocal.local()
+
+    def submit(self, key, function, *args):
+        """Call function(*args) after all requests submitted earlier for key."""
+
+        if self.workers <= 0:
+            function(*args)
+            return
+
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+            self.idle.clear()
+            hub.spawn(self._run, key, queue)
+
+        queue.append((function, args))
+
+    def _run(self, key, queue):
+        self.local.key = key
+        with self.slots:
+            while len(queue) > 0:
+                function, args = queue.popleft()
+                try:
+                    function(*args)
+                except Exception:
+                    self.logger.exception('Request for %s failed', key)
+
+                #Give the event loop a turn, even if the request did not have to wait for anything
+                hub.sleep(0)
+
+        del self.queues[key]
+        if len(self.queues) == 0:
+            self.idle.set()
+
+    def offload(self, function):
+        """Returns function wrapped so it runs in a native thread, the calling green thread waits for it.
+
+        The first argument of function must be the network. The native thread gets a copy of the network for
+        its topology version instead, which the event loop does not change while function reads it. Only one
+        wrapped function runs at a time, holding join_lock. Networks with fewer than OFFLOAD_MIN_NODES nodes
+        are searched in the calling green thread, which gives the event loop a turn after every search.
+        """
+
+        if function is None or self.workers <= 0:
+            return function
+
+        def wrapper(network, *args, **kwargs):
+            with self.join_lock:
+                if len(network) >= self.OFFLOAD_MIN_NODES:
+                    return tpool.execute(function, self._snapshot(network), *args, **kwargs)
+
+                result = function(network, *args, **kwargs)
+
+            hub.sleep(0)
+            return result
+
+        return wrapper
+
+    def _snapshot(self, network):
+        """Returns a copy of network for its current topology version.
+
+        The copy holds the links with their attributes and whether nodes are hosts. Values join functions
+        cache in network.graph (see CSRTopology.get and FailureRoutes.get) are carried over from the copy of
+        the previous version, they check the version themselves.
+        """
+
+        graph = network.graph
+        snapshot = self.snapshot
+        if (snapshot is not None and snapshot.graph['version'] == graph.get('version', 0) 
+                and len(snapshot) == len(network)):
+            return snapshot
+
+        attributes = dict(snapshot.graph) if snapshot is not None else {}
+        attributes.update(graph)
+        changes = graph.get('changes')
+        if changes is not None:
+            attributes['changes'] = deque(changes, changes.maxlen)
+
+        snapshot = nx.DiGraph(**attributes)
+        for node, data in network.nodes(data = True):
+            snapshot.add_node(node, host = data.get('host', False))
+        snapshot.add_edges_from(network.edges(data = True))
+
+        self.snapshot = snapshot
+        return snapshot
+
+    def in_worker(self):
+        """Returns True if the current green thread is a worker, which may wait without blocking the event loop."""
+        return getattr(self.local, 'key', None) is not None
+
+    def pending(self):
+        """Returns the amount of requests waiting to be processed."""
+        return sum(len(queue) for queue in self.queues.values())
+
+    def wait(self):
+        """Wait until all submitted requests have been processed."""
+        self.idle.wait()
@@ -0,0 +1,95 @@
+from collections import deque
+
+class IdAllocator(object):
+    """Hands out ids from the range first..last and reuses released ids, all in O(1).
+
+    Ids that were never used are handed out in increasing order, released ids are kept in a free list.
+    Released ids only become available again after recycle() is called, so an id is never reused
+    while messages about its previous use can still be pending.
+    """
+
+    #Fraction of the capacity after which the allocator reports to be nearly full
+    WARNING_FRACTION = 0.9
+
+    def __init__(self, first, last, capacity = None):
+        """
+        Arguments:
+        first: lowest id
+        last: highest id
+        capacity: maximum amount of ids in use at the same time, or None if only limited by the range
+        """
+
+        self.first = first
+        self.last = last
+        self.next_id = first #Lowest id that was never handed out
+        self.free = deque()
+        self.released = set() #Released ids waiting for recycle()
+        self.used = set()
+        self.set_capacity(capacity)
+
+    def set_capacity(self, capacity):
+        """Limit the amount of ids in use at the same time to capacity (None for no limit).
+
+        Ids that are already in use stay in use, even if there are more than capacity.
+        """
+
+        size = self.last - self.first + 1
+        self.capacity = size if capacity is None else max(0, min(capacity, size))
+        self.warning_level = max(1, int(self.capacity * self.WARNING_FRACTION))
+
+    def allocate(self):
+        """Returns an unused id, or None if capacity ids are in use already.
+
+        Ids waiting to be recycled count as in use, the switch may not have deleted their groups yet.
+        """
+
+        if len(self.used) + len(self.released) >= self.capacity:
+            return None
+
+        if len(self.free) > 0:
+            id = self.free.popleft()
+        elif self.next_id <= self.last:
+            id = self.next_id
+            self.next_id += 1
+        else:
+            return None
+
+        self.used.add(id)
+        return id
+
+    def release(self, id):
+        """Release id, which becomes available again after the next recycle() call.
+
+        Returns False if id was not in use.
+        """
+
+        if id not in self.used:
+            return False
+
+        self.used.remove(id)
+        self.released.add(id)
+        return True
+
+    def recycle(self, ids = None):
+        """Make all ids released since the last call available again, or only those of ids.
+
+        Only takes time in the amount of ids recycled, not in the amount of ids waiting to be recycled.
+        """
+
+        if ids is None:
+            self.free.extend(sorted(self.released))
+            self.released = set()
+            return
+
+        for id in ids:
+            if id in self.released:
+                self.released.remove(id)
+                self.free.append(id)
+
+    def in_use(self):
+        """Returns the amount of ids in use."""
+        return len(self.used)
+
+    def near_full(self):
+        """Returns True if at least WARNING_FRACTION of the capacity is in use."""
+        return len(self.used) >= self.warning_level
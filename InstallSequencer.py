@@ -0,0 +1,206 @@
+import timeit
+
+from ryu.lib import hub
+
+class InstallFuture(object):
+    """Completion of one stage of the install of a subscriber, see InstallSequencer."""
+
+    def __init__(self):
+        self.event = hub.Event()
+        self.confirmed = None #True once the switches confirmed the stage, False if they did not in time
+        self.seconds = None #seconds from the start of the request until the stage was done
+        self.callbacks = []
+
+    def done(self):
+        return self.confirmed is not None
+
+    def wait(self, timeout = None):
+        """Wait until the stage is done. Returns True if the switches confirmed it, None if it is not done yet."""
+
+        self.event.wait(timeout)
+        return self.confirmed
+
+    def add_done_callback(self, callback):
+        """Call callback(future) once the stage is done, right away if it is done already."""
+
+        if self.done():
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def _set(self, confirmed, seconds):
+        self.confirmed = confirmed
+        self.seconds = seconds
+        self.event.set()
+
+        callbacks = self.callbacks
+        self.callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+class Install(object):
+    """The datapaths a request sent messages to, by the stage of the messages."""
+
+    __slots__ = ('key', 'futures', 'start', 'stage', 'stages')
+
+    def __init__(self, key, futures):
+        """
+        Arguments:
+        key: (group, source) of the request
+        futures: dictionary subscriber -> InstallFutures of every stage, for every subscriber of the request
+        """
+
+        self.key = key
+        self.futures = futures
+        self.start = timeit.default_timer()
+        self.stage = 0
+        self.stages = {} #datapath id -> lowest stage of the messages sent to it
+
+    def sent(self, dpid):
+        """Record a message of the current stage for datapath dpid."""
+
+        stage = self.stages.get(dpid)
+        if stage is None or self.stage < stage:
+            self.stages[dpid] = self.stage
+
+class InstallSequencer(object):
+    """Sends the messages of joins in two waves, and tells when the stages of the joins are live.
+
+    Stage 0 of a join holds the primary paths of its subscribers, stage k the backups of protection level k
+    (see MulticastController.install_stage). Once committed, every switch with messages gets a barrier and
+    a stage is live once all switches with messages of that stage or an earlier one answered. Every
+    subscriber of the join gets an InstallFuture per stage, see future.
+
+    Switches whose messages only add new entries get them first. Switches whose messages change entries that
+    may be in use, such as the flow of a branch point getting a new output port, and the switch where the
+    packets enter the tree, get them once the first wave is confirmed. So packets only start to use the new
+    entries once they are installed everywhere, bottom-up. Only green threads that may wait (see
+    GroupWorkers.in_worker) hold back the second wave, others send both waves right away.
+    """
+
+    def __init__(self, barriers, metrics, logger, timeout):
+        """
+        Arguments:
+        barriers: BarrierTracker used to confirm the messages
+        metrics: Metrics recording the time until the stages are live
+        logger: logger for stages the switches did not confirm
+        timeout: seconds to wait for the barrier replies of a stage
+        """
+
+        self.barriers = barriers
+        self.metrics = metrics
+        self.logger = logger
+        self.timeout = timeout
+        self.futures = {} #(group, source) -> subscriber -> InstallFutures of the last join of the subscriber
+
+    def begin(self, key, subscribers, stages):
+        """Returns the Install of a join of subscribers to the group identified by key (group, source)."""
+
+        futures = self.futures.setdefault(key, {})
+        install = {}
+        for subscriber in subscribers:
+            futures[subscriber] = install[subscriber] = [InstallFuture() for stage in range(stages)]
+        return Install(key, install)
+
+    def future(self, key, subscriber, stage = 0):
+        """Returns the InstallFuture of stage 'stage' of the last join of subscriber, or None.
+
+        Stage 0 is done once the primary path of the subscriber is live, stage k once protection level k is.
+        """
+
+        futures = self.futures.get(key, {}).get(subscriber)
+        if futures is None or stage >= len(futures):
+            return None
+        return futures[stage]
+
+    def forget(self, key, subscriber = None):
+        """Drop the InstallFutures of subscriber, or of all subscribers of the group identified by key."""
+
+        if subscriber is None:
+            self.futures.pop(key, None)
+        else:
+            self.futures.get(key, {}).pop(subscriber, None)
+
+    def commit(self, install, batch, tree, wait):
+        """Send the messages of batch, whose outermost transaction ends, and track the stages of install.
+
+        Returns the datapaths messages were sent to.
+
+        Arguments:
+        install: Install recorded while the messages were sent
+        batch: MessageBatch holding the messages
+        tree: primary tree of the join, subscribers that are not in it were not added. None if there is none
+        wait: True if the second wave may wait for the first one to be confirmed
+        """
+
+        root = tree.graph['root'] if tree is not None else None
+
+        #Subscribers without a path are never live
+        for subscriber in list(install.futures):
+            if tree is None or subscriber not in tree:
+                for future in install.futures.pop(subscriber):
+                    future._set(False, timeit.default_timer() - install.start)
+
+        batches = batch.take()
+        dps = dict((dp.id, dp) for dp, msgs in batches)
+        barriers = dict((dp.id, msg) for dp, msg in self.barriers.requests(dps.values()))
+
+        stages = max([len(futures) for futures in install.futures.values()] + [0])
+        for stage in range(stages):
+            confirm = [(dps[dpid], barriers[dpid]) for dpid, lowest in install.stages.items()
+                       if lowest <= stage and dpid in dps]
+            self.barriers.watch(confirm, self._callback(install, stage), self.timeout)
+
+        first = [(dp, msgs) for dp, msgs in batches if dp.id != root and not self._in_use(dp, msgs)]
+        second = [(dp, msgs) for dp, msgs in batches if dp.id == root or self._in_use(dp, msgs)]
+
+        if wait and len(first) > 0 and len(second) > 0:
+            confirmed = []
+            event = hub.Event()
+
+            def done(result):
+                confirmed.append(result)
+                event.set()
+
+            self.barriers.watch([(dp, barriers[dp.id]) for dp, msgs in first], done, self.timeout)
+            for dp, msgs in first:
+                batch.send_batch(dp, msgs, barriers[dp.id])
+
+            event.wait()
+            if not confirmed[0]:
+                self.logger.warning('Switches did not confirm the new entries of %s within %s seconds',
+                                    install.key, self.timeout)
+        else:
+            second = first + second
+
+        for dp, msgs in second:
+            batch.send_batch(dp, msgs, barriers[dp.id])
+
+        return [dp for dp, msgs in batches]
+
+    def _in_use(self, dp, msgs):
+        """Returns True if msgs change or remove entries of datapath dp that packets may use."""
+
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+
+        for msg in msgs:
+            if isinstance(msg, parser.OFPFlowMod) and msg.command != ofp.OFPFC_ADD:
+                return True
+            if isinstance(msg, parser.OFPGroupMod) and msg.command != ofp.OFPGC_ADD:
+                return True
+        return False
+
+    def _callback(self, install, stage):
+        def live(confirmed):
+            seconds = timeit.default_timer() - install.start
+            if confirmed:
+                self.metrics.observe('install_seconds', seconds, stage = stage)
+            else:
+                self.logger.warning('Switches did not confirm stage %s of %s within %s seconds', stage,
+                                    install.key, self.timeout)
+
+            for futures in install.futures.values():
+                futures[stage]._set(confirmed, seconds)
+
+        return live
@@ -0,0 +1,172 @@
+import networkx as nx
+
+from collections import OrderedDict
+
+class JoinCache(object):
+    """Remembers the results of a join function, shared by the trees of all multicast groups.
+
+    A result is identified by the root of the tree, the target, the excluded links, the links of the tree
+    and the path version of the network (see MulticastController._topology_changed). For a Tree the key only
+    holds the signature of its links, different link sets can share one, so the links are stored along with
+    the result and compared on every hit.
+    Groups whose sources sit behind the same switch ask for the same backup paths over and over, only the
+    first search is done. Results of an older path version are never returned, they are evicted as the least
+    recently used ones. Hosts that are discovered do not change the path version, no path passes through them.
+    """
+
+    def __init__(self, join, join_many = None, size = 4096):
+        """
+        Arguments:
+        join: join function used to compute paths
+        join_many: function used to compute the paths of many subscribers at once, or None
+        size: maximum amount of results to keep
+        """
+
+        self.join_function = join
+        self.join_many_function = join_many
+        self.size = size
+        self.results = OrderedDict() #key -> (links of the tree or None, path, or target -> path for join_many)
+        self.hits = 0
+        self.misses = 0
+
+        if join_many is None:
+            self.join_many = None
+
+    def join(self, network, exclude, T, v):
+        """Returns join(network, exclude, T, v), computed only if it is not known yet."""
+
+        key = self.key(network, exclude, T, v)
+        path = self.get(key, T)
+        if path is None:
+            path = self.join_function(network, exclude, T, v)
+            self.put(key, path, T)
+        return list(path)
+
+    def join_many(self, network, exclude, T, targets):
+        """Returns join_many(network, exclude, T, targets), computed only if it is not known yet.
+
+        The paths of join_many together form a tree, so they are only reused for the same set of targets.
+        """
+
+        key = self.key(network, exclude, T, frozenset(targets))
+        paths = self.get(key, T)
+        if paths is None:
+            paths = self.join_many_function(network, exclude, T, targets)
+            self.put(key, paths, T)
+        return dict((v, list(path)) for v, path in paths.items())
+
+    def join_all(self, network, requests, v, compute):
+        """Returns the path to v for every (exclude, T) in requests.
+
+        The paths that are not known yet are computed together by compute(network, requests, v), such as
+        JoinPool.map.
+        """
+
+        keys = [self.key(network, L, T, v) for L, T in requests]
+        paths = [self.get(key, T) for key, (L, T) in zip(keys, requests)]
+
+        missing = [i for i, path in enumerate(paths) if path is None]
+        if len(missing) > 0:
+            computed = compute(network, [requests[i] for i in missing], v)
+            for i, path in zip(missing, computed):
+                paths[i] = path
+                self.put(keys[i], path, requests[i][1])
+
+        return [list(path) for path in paths]
+
+    def key(self, network, exclude, T, v):
+        links = T.signature() if isinstance(T, Tree) else frozenset(T.edges())
+        return (T.graph['root'], v, frozenset(exclude), links, network.graph.get('paths_version', 0))
+
+    def get(self, key, T = None):
+        """Returns the result stored under key for tree T, or None."""
+
+        entry = self.results.pop(key, None)
+        if entry is None or not _same_links(entry[0], T):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.results[key] = entry
+        return entry[1]
+
+    def put(self, key, result, T = None):
+        if self.size <= 0:
+            return
+
+        self.results[key] = (tuple(T.edges()) if isinstance(T, Tree) else None, result)
+        if len(self.results) > self.size:
+            self.results.popitem(last = False)
+
+    def hit_rate(self):
+        """Returns the fraction of lookups that were answered from the cache."""
+
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups > 0 else 0.0
+
+    def clear(self):
+        self.results.clear()
+
+def _same_links(links, T):
+    """Returns True if T has exactly links, or if links is None (the key holds all links of the tree)."""
+
+    if links is None:
+        return True
+    return len(links) == T.links and all(T.has_edge(u, v) for u, v in links)
+
+class Tree(nx.DiGraph):
+    """DiGraph of a multicast tree that keeps a signature of its links up to date while they change.
+
+    The signature takes constant time, where a set of all links takes time in the size of the tree on every
+    join. It is not unique, JoinCache compares the links of a result it finds with it. All trees of the
+    TreeBuilders are Trees.
+    """
+
+    def __init__(self, incoming_graph_data = None, **attr):
+        self.links = 0
+        self.links_hash = 0 #XOR of the hashes of all links
+        super(Tree, self).__init__(incoming_graph_data, **attr)
+
+    def signature(self):
+        """Returns a value for the links of the tree, equal for equal sets of links."""
+        return (self.links, self.links_hash)
+
+    def add_edge(self, u, v, **attr):
+        if not self.has_edge(u, v):
+            self.links += 1
+            self.links_hash ^= hash((u, v))
+        super(Tree, self).add_edge(u, v, **attr)
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        for e in ebunch_to_add:
+            data = dict(attr)
+            if len(e) > 2:
+                data.update(e[2])
+            self.add_edge(e[0], e[1], **data)
+
+    def remove_edge(self, u, v):
+        super(Tree, self).remove_edge(u, v)
+        self.links -= 1
+        self.links_hash ^= hash((u, v))
+
+    def remove_edges_from(self, ebunch):
+        for e in ebunch:
+            if self.has_edge(e[0], e[1]):
+                self.remove_edge(e[0], e[1])
+
+    def remove_node(self, n):
+        if n in self:
+            for link in list(self.in_edges(n)) + list(self.out_edges(n)):
+                self.links -= 1
+                self.links_hash ^= hash(link)
+        super(Tree, self).remove_node(n)
+
+    def remove_nodes_from(self, nodes):
+        for n in list(nodes):
+            if n in self:
+                self.remove_node(n)
+
+    def clear(self):
+        super(Tree, self).clear()
+        self.links = 0
+        self.links_hash = 0
@@ -0,0 +1,88 @@
+import networkx as nx
+import multiprocessing
+
+class JoinPool(object):
+    """Runs batches of independent join calls in a pool of worker processes.
+
+    Workers get a read-only snapshot of the network, which only holds the links and their attributes.
+    The snapshot is taken again (and the pool restarted) whenever the paths of the network change, see
+    MulticastController._topology_changed. Discovering a host does not change them: the links of the host a
+    join targets are sent along with it. Trees are sent to the workers as plain copies without their backup
+    trees.
+
+    The join function has to be picklable, e.g. a module level function like SPT.join or DST.join.
+    """
+
+    def __init__(self, join, processes):
+        """
+        Arguments:
+        join: join function used to compute paths
+        processes: amount of worker processes
+        """
+
+        self.join = join
+        self.processes = processes
+        self.pool = None
+        self.version = None
+
+    def map(self, network, requests, v):
+        """Returns [join(network, exclude, tree, v) for exclude, tree in requests], computed in parallel."""
+
+        version = network.graph.get('paths_version', 0)
+        if self.pool is None or self.version != version:
+            self.close()
+            self.pool = multiprocessing.Pool(self.processes, _init_worker, (_network_snapshot(network), self.join))
+            self.version = version
+
+        links = _host_links(network, v)
+        tasks = [(list(exclude), _tree_snapshot(tree), v, links) for exclude, tree in requests]
+        chunksize = max(1, len(tasks) // (self.processes * 4))
+
+        return self.pool.map(_worker_join, tasks, chunksize)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+def _network_snapshot(network):
+    snapshot = nx.DiGraph(version = network.graph.get('version', 0))
+    snapshot.add_nodes_from(network)
+    snapshot.add_edges_from(_link_snapshot(x, y, edata) for x, y, edata in network.edges(data = True))
+    return snapshot
+
+def _host_links(network, v):
+    """Returns the links of v if it is a host, an empty list otherwise."""
+
+    if v not in network or not network.node[v].get('host', False):
+        return []
+    return [_link_snapshot(x, y, edata) for x, y, edata in
+            list(network.in_edges(v, data = True)) + list(network.out_edges(v, data = True))]
+
+def _link_snapshot(x, y, edata):
+    return (x, y, {'live': edata['live'], 'src_port': edata['src_port'], 'dst_port': edata['dst_port']})
+
+def _tree_snapshot(tree):
+    snapshot = nx.DiGraph(root = tree.graph['root'])
+    snapshot.add_nodes_from(tree)
+    snapshot.add_edges_from(tree.edges())
+    return snapshot
+
+_worker_network = None
+_worker_join_function = None
+
+def _init_worker(network, join):
+    global _worker_network, _worker_join_function
+    _worker_network = network
+    _worker_join_function = join
+
+def _worker_join(task):
+    exclude, tree, v, links = task
+
+    #Hosts may have been discovered or moved since the snapshot was taken
+    if len(links) > 0:
+        if v in _worker_network:
+            _worker_network.remove_node(v)
+        _worker_network.add_edges_from(links)
+
+    return _worker_join_function(_worker_network, exclude, tree, v)
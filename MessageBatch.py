@@ -0,0 +1,229 @@
+from collections import OrderedDict
+
+class MessageBatch(object):
+    """Buffers the OpenFlow messages produced by one join or leave and sends them per datapath.
+
+    Between begin() and the matching commit() every message passed to send() is kept per datapath.
+    Repeated FlowMods of the same (table, priority, match) and repeated GroupMods of the same group id
+    are merged into their final state, so entries that get overwritten later in the same request
+    are never sent. On the outermost commit() every datapath receives its messages in one go, wrapped
+    in a bundle when the switch supports them, or followed by a single barrier otherwise.
+
+    Outside a transaction send() passes messages straight to the datapath.
+    """
+
+    def __init__(self, use_bundles = None, on_send = None):
+        """
+        Arguments:
+        use_bundles: function taking a datapath and returning True if messages to it should be bundled,
+                     or None if bundles should never be used
+        on_send: function called with (datapath, message) for every message sent, bundled messages are
+                 passed unwrapped, or None
+        """
+
+        self.use_bundles = use_bundles
+        self.on_send = on_send
+        self.depth = 0
+        self.batches = OrderedDict() #dpid -> _DatapathBatch
+        self.bundle_id = 0
+
+    def begin(self):
+        """Start a (possibly nested) transaction."""
+
+        self.depth += 1
+
+    def commit(self):
+        """End a transaction. Flushes all buffered messages when the outermost transaction ends.
+
+        Returns the datapaths messages were sent to.
+        """
+
+        batches = self.take()
+        for dp, msgs in batches:
+            self.send_batch(dp, msgs)
+        return [dp for dp, msgs in batches]
+
+    def take(self):
+        """End a transaction like commit, but return the buffered messages instead of sending them.
+
+        Returns a (datapath, messages) pair for every datapath with messages when the outermost transaction
+        ends, an empty list otherwise. The messages are meant for send_batch.
+        """
+
+        self.depth -= 1
+        if self.depth > 0:
+            return []
+
+        self.depth = 0
+        batches = self.batches
+        self.batches = OrderedDict()
+
+        taken = []
+        for batch in batches.values():
+            msgs = batch.flush()
+            if len(msgs) > 0:
+                taken.append((batch.dp, msgs))
+        return taken
+
+    def send(self, dp, msg):
+        """Send msg to datapath dp, or buffer it if a transaction is active."""
+
+        if self.depth == 0:
+            self._send(dp, msg)
+            return
+
+        batch = self.batches.get(dp.id)
+        if batch is None or batch.dp is not dp:
+            if batch is not None:
+                #The switch reconnected during the transaction, the old connection is gone
+                del self.batches[dp.id]
+            batch = _DatapathBatch(dp)
+            self.batches[dp.id] = batch
+
+        batch.add(msg)
+
+    def send_batch(self, dp, msgs, barrier = None):
+        """Send msgs, the flushed messages of datapath dp, followed by a barrier.
+
+        Bundles do not get a barrier, their commit tells the switch applied them, unless the barrier request
+        to send is given in barrier.
+        """
+
+        if len(msgs) == 0:
+            return
+
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+
+        if self.use_bundles is not None and self.use_bundles(dp):
+            bundled = [msg for msg in msgs if _mergeable_type(parser, msg)]
+            others = [msg for msg in msgs if not _mergeable_type(parser, msg)]
+
+            self.bundle_id = (self.bundle_id + 1) & 0xffffffff
+            ctrl, add, open_type, commit_type, flags = _bundle_api(ofp, parser)
+
+            self._send(dp, ctrl(dp, self.bundle_id, open_type, flags, []))
+            for msg in bundled:
+                dp.set_xid(msg)
+                dp.send_msg(add(dp, self.bundle_id, flags, msg, []))
+                if self.on_send is not None:
+                    self.on_send(dp, msg)
+            self._send(dp, ctrl(dp, self.bundle_id, commit_type, flags, []))
+
+            for msg in others:
+                self._send(dp, msg)
+            if barrier is not None:
+                self._send(dp, barrier)
+        else:
+            for msg in msgs:
+                self._send(dp, msg)
+            self._send(dp, barrier if barrier is not None else parser.OFPBarrierRequest(dp))
+
+    def _send(self, dp, msg):
+        dp.send_msg(msg)
+        if self.on_send is not None:
+            self.on_send(dp, msg)
+
+def supports_bundles(dp, onf_extension = False):
+    """Returns True if bundles can be used for datapath dp.
+
+    Bundles are part of OpenFlow 1.4 and later. For OpenFlow 1.3 they are only available as an ONF extension,
+    which is only used when onf_extension is True.
+    """
+
+    ofp = dp.ofproto
+    if hasattr(ofp, 'OFPBCT_OPEN_REQUEST'):
+        return True
+    return onf_extension and hasattr(ofp, 'ONF_BCT_OPEN_REQUEST')
+
+def _bundle_api(ofp, parser):
+    """Returns (ctrl message class, add message class, open type, commit type, flags)."""
+
+    if hasattr(ofp, 'OFPBCT_OPEN_REQUEST'):
+        return (parser.OFPBundleCtrlMsg, parser.OFPBundleAddMsg, ofp.OFPBCT_OPEN_REQUEST,
+                ofp.OFPBCT_COMMIT_REQUEST, ofp.OFPBF_ATOMIC | ofp.OFPBF_ORDERED)
+
+    return (parser.ONFBundleCtrlMsg, parser.ONFBundleAddMsg, ofp.ONF_BCT_OPEN_REQUEST,
+            ofp.ONF_BCT_COMMIT_REQUEST, ofp.ONF_BF_ATOMIC | ofp.ONF_BF_ORDERED)
+
+def _mergeable_type(parser, msg):
+    return isinstance(msg, (parser.OFPFlowMod, parser.OFPGroupMod))
+
+class _DatapathBatch(object):
+    """Messages buffered for a single datapath.
+
+    Flow and group modifications are merged per entry. Any other message (or a non-strict FlowMod)
+    seals everything buffered before it, so ordering with respect to that message is kept.
+    """
+
+    __slots__ = ('dp', 'flows', 'groups', 'sealed')
+
+    def __init__(self, dp):
+        self.dp = dp
+        self.flows = OrderedDict() #(table_id, priority, match) -> [first command, last message]
+        self.groups = OrderedDict() #group id -> [first command, last message]
+        self.sealed = []
+
+    def add(self, msg):
+        ofp = self.dp.ofproto
+        parser = self.dp.ofproto_parser
+
+        if isinstance(msg, parser.OFPFlowMod) and msg.command in (ofp.OFPFC_ADD, ofp.OFPFC_MODIFY_STRICT,
+                ofp.OFPFC_DELETE_STRICT) and msg.table_id != ofp.OFPTT_ALL:
+            key = (msg.table_id, msg.priority, tuple(sorted(msg.match.items())))
+            entry = self.flows.pop(key, None)
+            #Re-inserting moves the entry to the back, flows are sent in order of their last change
+            self.flows[key] = [msg.command if entry is None else entry[0], msg]
+
+        elif isinstance(msg, parser.OFPGroupMod) and msg.group_id != ofp.OFPG_ALL:
+            entry = self.groups.get(msg.group_id)
+            if entry is None:
+                self.groups[msg.group_id] = [msg.command, msg]
+            else:
+                entry[1] = msg
+
+        else:
+            self.sealed.extend(self._merged())
+            self.sealed.append(msg)
+
+    def flush(self):
+        """Returns all buffered messages in the order they should be sent."""
+
+        msgs = self.sealed
+        msgs.extend(self._merged())
+        self.sealed = []
+        return msgs
+
+    def _merged(self):
+        """Returns and clears the merged flow and group modifications.
+
+        Groups that are added or modified come first so every flow finds the groups it outputs to.
+        Groups that are deleted come last, after the flows that pointed to them have been changed.
+        """
+
+        ofp = self.dp.ofproto
+
+        group_updates = []
+        group_deletes = []
+        for first, msg in self.groups.values():
+            if msg.command == ofp.OFPGC_DELETE:
+                if first != ofp.OFPGC_ADD:
+                    group_deletes.append(msg)
+            else:
+                msg.command = ofp.OFPGC_ADD if first == ofp.OFPGC_ADD else ofp.OFPGC_MODIFY
+                group_updates.append(msg)
+
+        flow_mods = []
+        for first, msg in self.flows.values():
+            if msg.command == ofp.OFPFC_DELETE_STRICT:
+                if first != ofp.OFPFC_ADD:
+                    flow_mods.append(msg)
+            else:
+                if first == ofp.OFPFC_ADD:
+                    msg.command = ofp.OFPFC_ADD
+                flow_mods.append(msg)
+
+        self.flows.clear()
+        self.groups.clear()
+
+        return group_updates + flow_mods + group_deletes
@@ -0,0 +1,138 @@
+"""Counters, latency histograms and gauges of the controller, rendered in the Prometheus text format."""
+
+import timeit
+from contextlib import contextmanager
+
+#Upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics(object):
+    """Collects the metrics of the controller.
+
+    Every metric is identified by its name and a set of labels given as keyword arguments, e.g.
+    inc('messages_sent_total', switch = 1, type = 'OFPFlowMod'). Metrics do not have to be declared
+    before they are used, describe() only adds the help text shown by render().
+    """
+
+    def __init__(self, prefix = 'multicast_'):
+        """
+        Arguments:
+        prefix: prepended to all metric names when rendering
+        """
+
+        self.prefix = prefix
+        self.counters = {} #name -> labels -> value
+        self.histograms = {} #name -> labels -> [bucket counts, sum, count]
+        self.gauges = {} #name -> function returning the value
+        self.help = {} #name -> help text
+
+    def describe(self, name, help):
+        """Set the help text of metric name."""
+        self.help[name] = help
+
+    def inc(self, name, amount = 1, **labels):
+        """Add amount to counter name."""
+
+        values = self.counters.get(name)
+        if values is None:
+            values = self.counters[name] = {}
+
+        key = _key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Add value (in seconds) to histogram name."""
+
+        values = self.histograms.get(name)
+        if values is None:
+            values = self.histograms[name] = {}
+
+        key = _key(labels)
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = [[0] * len(BUCKETS), 0.0, 0]
+
+        counts = histogram[0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                counts[i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Context manager adding the time spent in its body to histogram name."""
+
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.observe(name, timeit.default_timer() - start, **labels)
+
+    def timed(self, name, function, **labels):
+        """Returns function wrapped so the time spent in every call is added to histogram name."""
+
+        if function is None:
+            return None
+
+        timer = timeit.default_timer
+        def wrapper(*args, **kwargs):
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe(name, timer() - start, **labels)
+
+        return wrapper
+
+    def gauge(self, name, help, function):
+        """Register gauge name, whose value is the result of function() at the time of rendering."""
+
+        self.gauges[name] = function
+        self.help[name] = help
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+
+        lines = []
+
+        for name in sorted(self.counters):
+            self._header(lines, name, 'counter')
+            for key, value in sorted(self.counters[name].items()):
+                lines.append(self._sample(name, key, value))
+
+        for name in sorted(self.histograms):
+            self._header(lines, name, 'histogram')
+            for key, (counts, total, count) in sorted(self.histograms[name].items()):
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, counts):
+                    cumulative += bucket_count
+                    lines.append(self._sample(name + '_bucket', key + (('le', repr(bound)),), cumulative))
+                lines.append(self._sample(name + '_bucket', key + (('le', '+Inf'),), count))
+                lines.append(self._sample(name + '_sum', key, total))
+                lines.append(self._sample(name + '_count', key, count))
+
+        for name in sorted(self.gauges):
+            self._header(lines, name, 'gauge')
+            lines.append(self._sample(name, (), self.gauges[name]()))
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines, name, metric_type):
+        if name in self.help:
+            lines.append('# HELP %s%s %s' % (self.prefix, name, self.help[name]))
+        lines.append('# TYPE %s%s %s' % (self.prefix, name, metric_type))
+
+    def _sample(self, name, key, value):
+        if len(key) == 0:
+            return '%s%s %s' % (self.prefix, name, value)
+
+        labels = ','.join('%s="%s"' % (label, _escape(label_value)) for label, label_value in key)
+        return '%s%s{%s} %s' % (self.prefix, name, labels, value)
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,17 @@
+"""Serves the metrics of the MulticastController on GET /metrics of Ryu's WSGI server."""
+
+from ryu.app.wsgi import ControllerBase, Response, route
+
+METRICS_INSTANCE = 'metrics'
+
+class MetricsAPI(ControllerBase):
+    """WSGI controller rendering a Metrics object in the Prometheus text format."""
+
+    def __init__(self, req, link, data, **config):
+        super(MetricsAPI, self).__init__(req, link, data, **config)
+        self.metrics = data[METRICS_INSTANCE]
+
+    @route('metrics', '/metrics', methods = ['GET'])
+    def get_metrics(self, req, **kwargs):
+        body = self.metrics.render()
+        return Response(content_type = 'text/plain', charset = 'utf-8', body = body.encode('utf-8'))
@@ -2,6 +2,7 @@ from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
+from ryu.app.wsgi import WSGIApplication
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
@@ -11,13 +12,32 @@ from ryu.lib.packet import in_proto
 from ryu.lib.packet import igmp
 
 from ryu.topology import event, switches
+from ryu.lib import hub
+from ryu.lib.ip import ipv4_to_int
+from eventlet import corolocal
 from ryu.topology.api import get_switch, get_link, get_host
 
+import os
+import timeit
 import networkx as nx
 import itertools as it
+from collections import deque
 
 import PerLinkTreeBuilder
+import MessageBatch
+import GroupWorkers
+import RequestCoalescer
+import BarrierTracker
+import InstallSequencer
+import PacketClassifier
+import IdAllocator
+import FFGroupStore
+import ShadowTable
+import Snapshot
+import Metrics
+import MetricsAPI
 from SPT import join as SPT_join
+from SPT import join_many as SPT_join_many
 from DST import join as DST_join
 
 class MulticastController(app_manager.RyuApp):
@@ -26,6 +46,7 @@ class MulticastController(app_manager.RyuApp):
     and generally facilitating all communication with the OpenFlow switches."""
     
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'wsgi': WSGIApplication}
     LOWPRIO = 1
     MEDPRIO = 2
     HIGHPRIO = 3
@@ -33,25 +54,283 @@ class MulticastController(app_manager.RyuApp):
 
     FLOOD_TABLE = 4
 
+    #Cookies of multicast flows hold the group address in the upper and the source address in the lower 32 bits
+    COOKIE_MASK = 0xffffffffffffffff
+
+    #Use the ONF bundle extension for OpenFlow 1.3 switches that support it
+    ONF_BUNDLES = False
+
+    #Amount of topology changes remembered for incremental path computations
+    TOPOLOGY_LOG_SIZE = 1024
+
+    #Amount of (group, source) pairs whose requests are processed at the same time (see GroupWorkers), 
+    #0 to process requests in the event handlers
+    WORKERS = 4
+
+    #Seconds joins and leaves are collected so opposing requests cancel each other (see RequestCoalescer), 
+    #0 to process them right away
+    COALESCE_WINDOW = 0.05
+    #Amount of collected joins and leaves after which they are processed without waiting for the window
+    COALESCE_LIMIT = 256
+
+    #Seconds link changes are collected, so correlated failures (a switch or line card going down) share a
+    #single topology version and repair, 0 to apply them right away
+    TOPOLOGY_WINDOW = 0.05
+    #Amount of collected link changes after which they are applied without waiting for the window
+    TOPOLOGY_LIMIT = 1024
+
+    #Packets per second of a new source punted to the controller while its tree is set up, 0 to drop them.
+    #Punting needs meter support, all new sources of a switch share its meter SETUP_METER_ID
+    SETUP_PUNT_RATE = 0
+    SETUP_METER_ID = 1
+    #Amount of packets of a new source kept while its tree is set up, besides its first packet. They are sent to 
+    #the subscribers once the switches confirmed the tree
+    SETUP_BUFFER = 32
+    #Seconds to wait for the switches to confirm the tree of a new source
+    SETUP_TIMEOUT = 1.0
+
+    #Seconds to wait for the switches to confirm the entries of a join, see InstallSequencer
+    INSTALL_TIMEOUT = 1.0
+
+    #Seconds between checks for subscribers waiting for their protection after a failure
+    REPAIR_INTERVAL = 1
+    #Amount of subscribers whose protection is restored before yielding to other events
+    REPAIR_BATCH = 10
+
+    #File the state of the controller is saved to and restored from at startup, None to disable snapshots
+    SNAPSHOT_PATH = None
+    #Seconds between snapshots
+    SNAPSHOT_INTERVAL = 10
+
     def __init__(self, *args, **kwargs):
         super(MulticastController, self).__init__(*args, **kwargs)
 
-        self.network = nx.DiGraph()
+        self.network = nx.DiGraph(version = 0, paths_version = 0, changes = deque(maxlen = self.TOPOLOGY_LOG_SIZE))
         self.span_tree = None
-        self.builder = PerLinkTreeBuilder.PerLinkTreeBuilder(3, self, SPT_join) #F,.,join function
+        self.metrics = Metrics.Metrics()
+        self.workers = GroupWorkers.GroupWorkers(self.WORKERS, self.logger)
+        self.coalescer = RequestCoalescer.RequestCoalescer(self.COALESCE_WINDOW, self.COALESCE_LIMIT,
+                                                           self._submit_requests, self.metrics)
+        self.topology = RequestCoalescer.RequestCoalescer(self.TOPOLOGY_WINDOW, self.TOPOLOGY_LIMIT,
+                                                          self._update_links, self.metrics,
+                                                          'coalesced_link_changes_total')
+        self.builder = PerLinkTreeBuilder.PerLinkTreeBuilder(3, self, SPT_join, join_many = SPT_join_many) #F,.,join function
         self.groups = {} #ip_group -> [ip_sources]
-        self.subscribers = {} #ip_group -> subscriber -> [MODE (include = True, exclude = False) ip_sources]
+        self.subscribers = {} #ip_group -> subscriber -> [MODE (include = True, exclude = False), set of ip_sources]
 
         self.ip_2_mac = {}
 
-    def log(self, message):
-        self.logger.info(message)
+        self.group_capacity = {} #switch id -> maximum amount of FF groups reported by the switch
+
+        self.shadows = {} #switch id -> ShadowTable, kept when switches disconnect
+        self.pair_switches = {} #(ip_group, ip_source) -> ids of the switches with entries of the pair
+        self.setups = {} #(ip_group, ip_source) -> state of a new source whose tree is being set up
+        self.barriers = BarrierTracker.BarrierTracker(self.send_msg)
+        self.installs = InstallSequencer.InstallSequencer(self.barriers, self.metrics, self.logger,
+                                                          self.INSTALL_TIMEOUT)
+        self.reconciliations = {} #switch id -> state of the reconciliation of a (re)connected switch
+
+        #Every green thread has transactions of its own, see _transaction
+        self.transactions = corolocal.local()
+
+        self._init_metrics()
+        if 'wsgi' in kwargs:
+            kwargs['wsgi'].register(MetricsAPI.MetricsAPI, {MetricsAPI.METRICS_INSTANCE: self.metrics})
+
+        if self.SNAPSHOT_PATH is not None and os.path.exists(self.SNAPSHOT_PATH):
+            start = timeit.default_timer()
+            Snapshot.load(self, self.SNAPSHOT_PATH)
+            self.log('Restored %s trees from %s in %.3f seconds', len(self.builder.groups), self.SNAPSHOT_PATH, 
+                     timeit.default_timer() - start)
+
+        self.repair_thread = hub.spawn(self._repair_loop)
+        if self.SNAPSHOT_PATH is not None:
+            self.snapshot_thread = hub.spawn(self._snapshot_loop)
+
+    def _init_metrics(self):
+        """Describe the metrics of the controller and register its gauges."""
+
+        metrics = self.metrics
+        metrics.describe('join_seconds', 'Time spent in the join function computing paths')
+        metrics.describe('request_seconds', 'Time spent adding or removing subscribers, by operation')
+        metrics.describe('send_seconds', 'Time spent sending the messages of a transaction to the switches')
+        metrics.describe('backup_seconds', 'Time spent in add_backup and remove_backup, by operation')
+        metrics.describe('messages_sent_total', 'OpenFlow messages sent, by switch and message type')
+        metrics.describe('packet_in_total', 'Packet-ins received, by packet class')
+        metrics.describe('reconciled_entries_total', 'Messages sent to make reconnected switches match their shadow tables')
+        metrics.describe('snapshot_seconds', 'Time spent writing snapshots')
+        metrics.describe('coalesced_requests_total', 'Joins and leaves cancelled by an opposing request')
+        metrics.describe('coalesced_link_changes_total', 'Links that went down and came back up, or the other '
+                                                         'way around, before the change was applied')
+        metrics.describe('link_change_batches_total', 'Batches of link changes applied with a single repair')
+        metrics.describe('setup_packets_total', 'Packets of new sources received while their tree was set up, '
+                                                'by whether they were buffered or dropped')
+        metrics.describe('setup_seconds', 'Time from the first packet of a new source until its tree was confirmed')
+        metrics.describe('install_seconds', 'Time from the start of a join until the switches confirmed its '
+                                            'primary paths (stage 0) or protection level (stage k)')
+        metrics.describe('group_table_full_total', 'Groups that could not be added because the group table was full')
+        metrics.describe('tags_exhausted_total', 'Backup trees that could not be created because all VLAN tags '
+                                                 'of their primary tree were in use')
+
+        metrics.gauge('groups', 'Multicast (group, source) pairs with a tree', lambda: len(self.builder.groups))
+        metrics.gauge('subscribers', 'Subscribers of all multicast trees', self._count_subscribers)
+        metrics.gauge('backup_trees', 'Backup trees of all multicast trees', self._count_backup_trees)
+        metrics.gauge('join_cache_hit_rate', 'Fraction of joins answered from the join cache',
+                      lambda: self.builder.join_cache.hit_rate())
+        metrics.gauge('pending_requests', 'Requests collected or waiting for the tree of their group to be free',
+                      lambda: self.coalescer.pending() + self.workers.pending())
+        metrics.gauge('join_cache_entries', 'Join results kept in the join cache', lambda: len(self.builder.join_cache.results))
+
+        self.add_backup = metrics.timed('backup_seconds', self.add_backup, operation = 'add')
+        self.remove_backup = metrics.timed('backup_seconds', self.remove_backup, operation = 'remove')
+
+    def _count_subscribers(self):
+        return sum(1 for T in self.builder.groups.values() for v in T if self._is_subscriber(T, v))
+
+    def _is_subscriber(self, T, v):
+        return T.out_degree(v) == 0 and v != T.graph['root'] and self.network.node[v].get('host', False)
+
+    def _count_backup_trees(self):
+        return sum(1 for T in self.builder.groups.values() for backup in self.builder._backup_trees(T))
+
+    def _message_sent(self, dp, msg):
+        self.metrics.inc('messages_sent_total', switch = dp.id, type = type(msg).__name__)
+        self._get_shadow(dp.id).apply(dp, msg)
+
+    def _get_shadow(self, switch_id):
+        shadow = self.shadows.get(switch_id)
+        if shadow is None:
+            shadow = self.shadows[switch_id] = ShadowTable.ShadowTable(self.HIGHESTPRIO)
+        return shadow
+
+    def log(self, message, *args):
+        self.logger.info(message, *args)
         return
 
+    def _transaction(self):
+        """Returns the transaction state of the current green thread.
+
+        Requests of different groups are processed at the same time, each of them sends its messages when
+        its own transaction is committed.
+        """
+
+        local = self.transactions
+        if not hasattr(local, 'batch'):
+            local.batch = MessageBatch.MessageBatch(
+                lambda dp: MessageBatch.supports_bundles(dp, self.ONF_BUNDLES), self._message_sent)
+            local.released_ids = {} #IdAllocator -> group ids or tags released in the current transaction
+            local.install = None #InstallSequencer.Install of the join of the current transaction
+        return local
+
+    @property
+    def batch(self):
+        """MessageBatch of the current green thread."""
+        return self._transaction().batch
+
+    def send_msg(self, dp, msg):
+        """Send msg to dp. Messages sent during a transaction are buffered until it is committed."""
+
+        transaction = self._transaction()
+        if transaction.install is not None:
+            transaction.install.sent(dp.id)
+        transaction.batch.send(dp, msg)
+
+    def track_install(self, key, subscribers, stages):
+        """Track the install of subscribers to the group identified by key (group, source) in the current transaction.
+
+        Stages 0 to stages-1 of the subscribers get InstallFutures, see InstallSequencer.
+        """
+
+        transaction = self._transaction()
+        if transaction.batch.depth > 0 and transaction.install is None:
+            transaction.install = self.installs.begin(key, subscribers, stages)
+
+    def install_stage(self, stage):
+        """Mark the messages sent from now on as stage 'stage' of the tracked join, 0 for primary paths and
+        k for the backups of protection level k."""
+
+        install = self._transaction().install
+        if install is not None:
+            install.stage = stage
+
+    def begin_transaction(self):
+        """Buffer all messages until the matching commit_transaction call."""
+        self.batch.begin()
+
+    def commit_transaction(self):
+        """Send all messages buffered since the matching begin_transaction call.
+
+        Returns the datapaths messages were sent to, which is empty for nested transactions.
+        """
+
+        transaction = self._transaction()
+        if transaction.batch.depth > 1:
+            return transaction.batch.commit()
+
+        with self.metrics.time('send_seconds'):
+            install = transaction.install
+            if install is None:
+                dps = transaction.batch.commit()
+            else:
+                transaction.install = None
+                dps = self.installs.commit(install, transaction.batch, self.builder.groups.get(install.key),
+                                           self.workers.in_worker())
+
+        #The deletes have been sent, so the group ids and tags can be used for new entries
+        #Ids released by transactions of other green threads stay released until those are committed
+        for ids, released in transaction.released_ids.items():
+            ids.recycle(released)
+        transaction.released_ids = {}
+
+        return dps
+
+    def _repair_loop(self):
+        """Restores protection lost by failures in the background."""
+
+        while True:
+            repairs = self.builder.take_repairs(self.REPAIR_BATCH)
+            for repair in repairs:
+                self.workers.submit(repair[0], self.builder.process_repair, repair)
+
+            if len(repairs) > 0:
+                hub.sleep(0)
+            else:
+                hub.sleep(self.REPAIR_INTERVAL)
+
+    def _snapshot_loop(self):
+        """Periodically saves the state of the controller to SNAPSHOT_PATH."""
+
+        while True:
+            hub.sleep(self.SNAPSHOT_INTERVAL)
+
+            #Trees of requests in progress do not match the flows that were sent yet
+            self.topology.flush()
+            self.coalescer.flush()
+            self.workers.wait()
+            try:
+                with self.metrics.time('snapshot_seconds'):
+                    Snapshot.save(self, self.SNAPSHOT_PATH)
+            except (IOError, OSError) as e:
+                self.logger.error('Could not write snapshot to %s: %s', self.SNAPSHOT_PATH, e)
+
     def get_network(self):
         """Returns network graph."""
         return self.network
 
+    def _topology_changed(self, links, new_host = False):
+        """Bump the topology version and record the links that were added or changed liveness.
+
+        Join functions use network.graph['version'] and network.graph['changes'] to find out what changed
+        since they last looked at the network. network.graph['paths_version'] is only bumped when paths between
+        nodes that were known already may have changed, so not for the links of a new host (see JoinCache).
+        """
+
+        graph = self.network.graph
+        graph['version'] += 1
+        graph['changes'].append((graph['version'], list(links)))
+        if not new_host:
+            graph['paths_version'] += 1
+
     def get_source_node(self, ip_source):
         """Returns id of node with IP address ip_source."""
         
@@ -64,47 +343,80 @@ class MulticastController(app_manager.RyuApp):
         
         Arguments:
         switch_id: id of switch to add group table to
-        g_key: key used to store this group in the FF_groups map
+        g_key: key used to store this group in the FF_groups store
         port: port to output to in bucket 1
         tag: packet VLAN tag
         """
+
+        g_id = self._add_group(switch_id, [FFGroupStore.FFBucket([port], tag)], None, g_key[1][0:2])
+        if g_id is None:
+            return None
+
+        self.network.node[switch_id]['FF_groups'].set_refs(g_key, [(g_id, 0)])
+
+        return g_id
+
+    def _add_group(self, switch_id, buckets, in_port, pair):
+        """Add a new FF group table to switch switch_id with buckets 'buckets' (a list of FFBucket).
+        
+        pair is the (ip_group, ip_source) the group belongs to.
+        Returns the id of the new group, or None if the group table of the switch is full.
+        """
+        
         dp = self.network.node[switch_id]['switch'].dp
         ofp = dp.ofproto
         parser = dp.ofproto_parser
 
-        actions = [parser.OFPActionOutput(port)]
-        buckets = [parser.OFPBucket(0, port, 0, actions)]
+        ids = self.network.node[switch_id]['group_ids']
+        g_id = ids.allocate()
+        if g_id is None:
+            self.logger.error('Group table of switch %s is full (%s groups), group not added', 
+                              switch_id, ids.capacity)
+            self.metrics.inc('group_table_full_total', switch = switch_id)
+            return None
 
-        g_id = self._add_group(switch_id, buckets)
+        if ids.in_use() == ids.warning_level:
+            self.logger.warning('Group table of switch %s is almost full: %s of %s groups in use', 
+                                switch_id, ids.in_use(), ids.capacity)
 
-        groups = self.network.node[switch_id]['FF_groups']
-        groups[g_key] = [(g_id, 0)]
+        group = self.network.node[switch_id]['FF_groups'].add_group(g_id, buckets, in_port)
+        self._pair_entries(switch_id, pair)[1].add(g_id)
 
-        buckets_map = self.network.node[switch_id]['buckets']
-        buckets_map[g_id] = [(port, tag, False)]
+        cmd = parser.OFPGroupMod(dp, ofp.OFPGC_ADD, ofp.OFPGT_FF, g_id, self._parse_buckets(dp, group))
+        self.send_msg(dp, cmd)
+
+        self.log('Added group %s to switch %s', g_id, switch_id)
+
+        return g_id
+
+    def _send_group_updates(self, switch_id):
+        """Send a GroupMod for every group of switch_id whose buckets changed."""
 
-    def _add_group(self, switch_id, buckets):
-        """Add a new FF group table to switch switch_id with buckets 'buckets'."""
-        
         dp = self.network.node[switch_id]['switch'].dp
         ofp = dp.ofproto
         parser = dp.ofproto_parser
 
-        g_id = self.network.node[switch_id]['group_id_index']
-        g_type = ofp.OFPGT_FF
+        for group in self.network.node[switch_id]['FF_groups'].take_dirty():
+            cmd = parser.OFPGroupMod(dp, ofp.OFPGC_MODIFY, ofp.OFPGT_FF, group.id, self._parse_buckets(dp, group))
+            self.send_msg(dp, cmd)
 
-        cmd = parser.OFPGroupMod(dp, ofp.OFPGC_ADD, g_type, g_id, buckets)
-        dp.send_msg(cmd)        
+    def _release_group_id(self, switch_id, g_id):
+        """Release g_id, it is reused once the delete of its group has been sent."""
+        self.release_id(self.network.node[switch_id]['group_ids'], g_id)
 
-        self.log('Added group ' + str(g_id) + ' to switch ' + str(switch_id))
+    def release_id(self, ids, id):
+        """Release id of IdAllocator ids, such as a group id or a VLAN tag.
 
-        #TODO: Use buckets map to check for free g_id's
-        g_index = g_id + 1
-        if g_index < 1: #TODO: Can we replace this with a maximum value gotten from the switch itself?
-            g_index = 1 #Here we assume that by this time group id 1 is available again
-        self.network.node[switch_id]['group_id_index'] = g_index
+        It is only reused once the current transaction, which deletes the entries using it, has been committed.
+        """
 
-        return g_id
+        ids.release(id)
+
+        transaction = self._transaction()
+        if transaction.batch.depth == 0:
+            ids.recycle([id])
+        else:
+            transaction.released_ids.setdefault(ids, []).append(id)
 
     def _remove_FF_group(self, switch_id, g_id, dst_address, src_address, prev_switch_id):
         """Remove group with id g_id from switch switch_id.
@@ -122,42 +434,32 @@ class MulticastController(app_manager.RyuApp):
         parser = dp.ofproto_parser
 
         cmd = parser.OFPGroupMod(dp, ofp.OFPGC_DELETE, ofp.OFPGT_FF, g_id)
-        dp.send_msg(cmd)
+        self.send_msg(dp, cmd)
 
         FF_groups = self.network.node[switch_id]['FF_groups']
-        buckets_map = self.network.node[switch_id]['buckets']
-
-        g_buckets = buckets_map[g_id]
+        g_buckets = FF_groups.remove_group(g_id).buckets
 
-        #Remove group from FF_groups
+        #Remove the references to the backup buckets of this group
         for i in range(len(g_buckets)-1,0,-1):
-            port,tag,drop = g_buckets[i]
+            bucket = g_buckets[i]
 
-            if not drop:
-                del FF_groups[self._get_FF_key(port, 
-                    self._get_key(True, dst_address, src_address, tag, prev_switch_id))]
+            if not bucket.drop:
+                key = self._get_key(True, dst_address, src_address, bucket.tag, prev_switch_id)
+                for p in bucket.ports:
+                    FF_groups.pop_refs(self._get_FF_key(p, key))
             else:
                 break
 
-        #Get list of all copies of FF groups for the same primary link
+        #Remove this group from the copies of FF groups for the same primary link
         first_bucket = g_buckets[0]
-        f_port = first_bucket[0]
-        f_tag = first_bucket[1]
-        f_g_key = self._get_FF_key(f_port, 
-            self._get_key(True, dst_address, src_address, f_tag, prev_switch_id))
-        first_groups = FF_groups[f_g_key]
-
-        #Remove this group from the list
-        for i in range(0,len(first_groups)):
-            if first_groups[i][0] == g_id:
-                first_groups.pop(i)
-
-        if len(first_groups) == 0:
-            del FF_groups[f_g_key]
+        f_g_key = self._get_FF_key(first_bucket.ports[0], 
+            self._get_key(True, dst_address, src_address, first_bucket.tag, prev_switch_id))
+        FF_groups.remove_ref(f_g_key, g_id)
 
-        del buckets_map[g_id]
+        self._release_group_id(switch_id, g_id)
+        self._pair_entries(switch_id, (dst_address, src_address))[1].discard(g_id)
 
-        self.log('removed group ' + str(g_id) + 'from switch ' + str(switch_id))        
+        self.log('removed group %s from switch %s', g_id, switch_id)        
 
     #Solely meant for Fast Tree Switching
     def set_tagged_flow(self, switch_id, dst_address, dsts, src_address, tag, origin_tag):
@@ -218,16 +520,17 @@ class MulticastController(app_manager.RyuApp):
                 action_list = [parser.OFPActionOutput(port) for port in ports_h]
                 actions.append(action_list)
 
-        self._install_actions(dp, parser, ofp, prio, current_tables, match, actions)
+        self._install_actions(dp, parser, ofp, prio, current_tables, match, actions,
+                              self._get_cookie(dst_address, src_address))
 
         flows[key] = (ports_s, ports_h, len(actions))
+        self._pair_entries(switch_id, key[0:2])[0].add(key)
 
-        self.log('ADDED/MODDIFIED FLOW FROM SWITCH ' + str(switch_id) 
-                + ' TO PORTS ' + str(ports_s) + ' AND ' + str(ports_h))
+        self.log('ADDED/MODDIFIED FLOW FROM SWITCH %s TO PORTS %s AND %s', switch_id, ports_s, ports_h)
 
-        self.log('DESTINATION = ' + str(dst_address))
+        self.log('DESTINATION = %s', dst_address)
         if tag is not None:
-            self.log('TAG = ' + str(tag))
+            self.log('TAG = %s', tag)
 
     def add_flow(self, switch_id, dst_address, dsts, multicast = False, 
                 src_address = None, tag = None, forced = False, prev_switch_id = None):
@@ -295,16 +598,19 @@ class MulticastController(app_manager.RyuApp):
             prio =  self._get_priority(tag, in_port)
                 
             actions = self._get_actions(parser, FF_groups, key, tag, ports_s, ports_h)
+            cookie = self._get_cookie(dst_address, src_address) if multicast else 0
 
-            self._install_actions(dp, parser, ofp, prio, current_tables, match, actions)
+            self._install_actions(dp, parser, ofp, prio, current_tables, match, actions, cookie)
 
             flows[key] = (ports_s,ports_h,len(actions))
+            if multicast:
+                self._pair_entries(switch_id, key[0:2])[0].add(key)
+            self._update_rejoins(switch_id, key)
 
-            self.log('ADDED/MODDIFIED FLOW FROM SWITCH ' + str(switch_id) + ' TO PORTS ' 
-                    + str(ports_s) + ' AND ' + str(ports_h))
-            self.log('DESTINATION = ' + str(dst_address))
+            self.log('ADDED/MODDIFIED FLOW FROM SWITCH %s TO PORTS %s AND %s', switch_id, ports_s, ports_h)
+            self.log('DESTINATION = %s', dst_address)
             if tag is not None:
-                self.log('TAG = ' + str(tag))
+                self.log('TAG = %s', tag)
 
     def _get_key(self, multicast, dst_address, src_address, tag, prev_switch_id):
         """Returns unique key for flow entry."""
@@ -319,6 +625,31 @@ class MulticastController(app_manager.RyuApp):
         
         return (port, key)
 
+    def _get_cookie(self, dst_address, src_address):
+        """Returns the cookie of the flows of multicast group dst_address with source src_address."""
+        return (ipv4_to_int(dst_address) << 32) | ipv4_to_int(src_address)
+
+    def _pair_entries(self, switch_id, pair):
+        """Returns [flow keys, group ids] of the entries of pair (ip_group, ip_source) in switch switch_id.
+
+        Flow keys include the keys of rejoins. The entries are indexed so all of them can be removed at once,
+        see remove_all_flows.
+        """
+
+        pairs = self.network.node[switch_id]['pairs']
+        entries = pairs.get(pair)
+        if entries is None:
+            entries = pairs[pair] = [set(), set()]
+            self.pair_switches.setdefault(pair, set()).add(switch_id)
+        return entries
+
+    def _unindex_flow(self, switch_id, key):
+        """Remove flow key 'key' from the index of its pair once it has neither a flow nor rejoins."""
+
+        node = self.network.node[switch_id]
+        if key not in node['flows'] and key not in node['rejoins']:
+            self._pair_entries(switch_id, key[0:2])[0].discard(key)
+
     def _get_priority(self, tag, in_port):
         ret = self.MEDPRIO if tag is None else self.HIGHPRIO
         return ret if in_port is None else ret+1
@@ -369,8 +700,9 @@ class MulticastController(app_manager.RyuApp):
         actions_remove_tag.append(parser.OFPActionPopVlan())
 
         for port in ports_s:
-            if self._get_FF_key(port, key) in FF_groups:
-                for g_id,index in FF_groups[(port, key)]:
+            refs = FF_groups.get(self._get_FF_key(port, key))
+            if refs is not None:
+                for g_id,index in refs:
                     actions_groups.append(parser.OFPActionGroup(g_id))
             else:
                 actions_outputs.append(parser.OFPActionOutput(port))
@@ -390,7 +722,7 @@ class MulticastController(app_manager.RyuApp):
 
         return actions            
 
-    def _install_actions(self, dp, parser, ofp, prio, current_tables, match, actions):
+    def _install_actions(self, dp, parser, ofp, prio, current_tables, match, actions, cookie = 0):
         for i in range(0, len(actions)):
             instr = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions[i])]
 
@@ -403,14 +735,14 @@ class MulticastController(app_manager.RyuApp):
                 command = ofp.OFPFC_ADD
 
             cmd = parser.OFPFlowMod(
-                datapath=dp, table_id=i, command=command, priority=prio, match=match,
+                datapath=dp, cookie=cookie, table_id=i, command=command, priority=prio, match=match,
                 instructions=instr, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY)
-            dp.send_msg(cmd)
+            self.send_msg(dp, cmd)
 
         for i in range(len(actions), current_tables):
             cmd = parser.OFPFlowMod(dp, table_id=i, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY,
                                     command=ofp.OFPFC_DELETE_STRICT, match=match, priority=prio)
-            dp.send_msg(cmd)
+            self.send_msg(dp, cmd)
 
     def remove_flow(self, switch_id, dst_address, dsts, multicast = False, 
                     src_address = None, tag = None, prev_switch_id = None):
@@ -439,10 +771,9 @@ class MulticastController(app_manager.RyuApp):
 
         flows = self.network.node[switch_id]['flows']
         if key not in flows:
-            self.log('Tried to remove flows from ' + str(switch_id) + ' to ' + 
-                    str(dsts) + ' , but these do not exist')
+            self.log('Tried to remove flows from %s to %s , but these do not exist', switch_id, dsts)
             if tag is not None:
-                self.log('Tag = ' + str(tag))
+                self.log('Tag = %s', tag)
             return
 
         current_s,current_h,current_tables = flows[key]
@@ -452,6 +783,7 @@ class MulticastController(app_manager.RyuApp):
         FF_groups = self.network.node[switch_id]['FF_groups']
 
         if dsts == 'all':
+            ports_s, ports_h = current_s, current_h
             other_s = []
             other_h = []
         else:
@@ -464,67 +796,104 @@ class MulticastController(app_manager.RyuApp):
 
         if len(other_s) == 0 and len(other_h) == 0:
             for i in range(0,current_tables):
-                cmd = parser.OFPFlowMod(dp, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY, 
+                cmd = parser.OFPFlowMod(dp, table_id=i, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY, 
                                         command=ofp.OFPFC_DELETE_STRICT, match=match, priority = prio)
-                dp.send_msg(cmd)
+                self.send_msg(dp, cmd)
         else:
             actions = self._get_actions(parser, FF_groups, key, tag, other_s, other_h)
+            cookie = self._get_cookie(dst_address, src_address) if multicast else 0
 
-            self._install_actions(dp, parser, ofp, prio, current_tables, match, actions)
+            self._install_actions(dp, parser, ofp, prio, current_tables, match, actions, cookie)
 
         if other_s or other_h:
            flows[key] = (other_s,other_h,len(actions))
+           self._update_rejoins(switch_id, key)
         else:
             del flows[key]
+            if multicast:
+                self._unindex_flow(switch_id, key)
 
-        #Remove all relevant groups
+        #Remove all relevant groups, _remove_FF_group changes the lists of copies so they are iterated over a copy
         if dsts == 'all':
             for port in current_s:
-                g_key = self._get_FF_key(port, key)
-                if g_key in FF_groups:
-                    for g_id,index in FF_groups[g_key]:
-                        self._remove_FF_group(switch_id, g_id, dst_address, src_address, prev_switch_id)
+                for g_id,index in list(FF_groups.get(self._get_FF_key(port, key), [])):
+                    self._remove_FF_group(switch_id, g_id, dst_address, src_address, prev_switch_id)
        
         else:
             for port in filter(lambda p: p in current_s, ports_s):
-                g_key = self._get_FF_key(port, key)
-                if g_key in FF_groups:
-                    for g_id,index in FF_groups[g_key]:
-                        self._remove_FF_group(switch_id, g_id, dst_address, src_address, prev_switch_id)
-
-        self.log('REMOVED FLOW FROM SWITCH ' + str(switch_id) + ' TO PORTS ' + 
-                str(ports_s) + 'AND ' + str(ports_h))
-        self.log('DESTINATION = ' + str(dst_address))
+                for g_id,index in list(FF_groups.get(self._get_FF_key(port, key), [])):
+                    self._remove_FF_group(switch_id, g_id, dst_address, src_address, prev_switch_id)
+
+        self.log('REMOVED FLOW FROM SWITCH %s TO PORTS %s AND %s', switch_id, ports_s, ports_h)
+        self.log('DESTINATION = %s', dst_address)
         if tag is not None:
-            self.log('TAG = ' + str(tag))
+            self.log('TAG = %s', tag)
+
+    def remove_all_flows(self, dst_address, src_address):
+        """Remove all flows, rejoins and FF groups of multicast group dst_address with source src_address.
+
+        Every switch gets a single FlowMod deleting the flows with the cookie of the pair in all tables, and
+        a GroupMod for each of its groups. The trees of the pair are not walked.
+
+        Arguments:
+        dst_address: IP address of the group
+        src_address: IP address of the source
+        """
+
+        pair = (dst_address, src_address)
+        cookie = self._get_cookie(dst_address, src_address)
+
+        for switch_id in self.pair_switches.pop(pair, ()):
+            node = self.network.node[switch_id]
+            keys, g_ids = node['pairs'].pop(pair)
+
+            dp = node['switch'].dp
+            ofp = dp.ofproto
+            parser = dp.ofproto_parser
+
+            cmd = parser.OFPFlowMod(dp, cookie=cookie, cookie_mask=self.COOKIE_MASK, table_id=ofp.OFPTT_ALL,
+                                    command=ofp.OFPFC_DELETE, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY,
+                                    match=parser.OFPMatch())
+            self.send_msg(dp, cmd)
+
+            for g_id in sorted(g_ids):
+                cmd = parser.OFPGroupMod(dp, ofp.OFPGC_DELETE, ofp.OFPGT_FF, g_id)
+                self.send_msg(dp, cmd)
+                self._release_group_id(switch_id, g_id)
+            node['FF_groups'].remove_groups(g_ids)
+
+            for key in keys:
+                node['flows'].pop(key, None)
+                node['rejoins'].pop(key, None)
+
+            self.log('removed %s flows and %s groups of %s from switch %s', len(keys), len(g_ids), pair, switch_id)
+
+    def _parse_buckets(self, dp, group):
+        """Returns the OFPBuckets of FFGroup group."""
 
-    def _parse_buckets_list(self, in_port, buckets, dp):
-        if len(buckets) == 0:
-            return []
         ofp = dp.ofproto
         parser = dp.ofproto_parser
 
+        in_port = group.in_port
         parsed = []
 
-        tagged = buckets[0][1] is not None
+        tagged = group.buckets[0].tag is not None
 
-        for port,tag,drop in buckets:
+        for bucket in group.buckets:
             actions = []
 
-            if not drop:
-                if tag is not None and len(parsed) > 0:
+            if not bucket.drop:
+                if bucket.tag is not None and len(parsed) > 0:
                     if not tagged:
                         actions.append(parser.OFPActionPushVlan())
-                    actions.append(parser.OFPActionSetField(vlan_vid = (0x1000 | tag)))
+                    actions.append(parser.OFPActionSetField(vlan_vid = (0x1000 | bucket.tag)))
 
-                if isinstance(port ,list):
-                    for p in port:
-                        actions.append(parser.OFPActionOutput(p if p != in_port else ofp.OFPP_IN_PORT))
-                    port = in_port
-                else:
-                    actions.append(parser.OFPActionOutput(port if port != in_port else ofp.OFPP_IN_PORT))
-        
-            parsed.append(parser.OFPBucket(0, port, 0, actions))
+                for p in bucket.ports:
+                    actions.append(parser.OFPActionOutput(p if p != in_port else ofp.OFPP_IN_PORT))
+
+            #Buckets outputting to several ports can not watch a single one of them
+            watch_port = in_port if bucket.shared else bucket.ports[0]
+            parsed.append(parser.OFPBucket(0, watch_port, 0, actions))
 
         return parsed
 
@@ -545,10 +914,6 @@ class MulticastController(app_manager.RyuApp):
         needs_backup: True if backup could also be added for backup_dst itself, False otherwise
         in_port_flow: True if in_port was matched to, False otherwise
         """
-                
-        dp = self.network.node[switch_id]['switch'].dp
-        ofp = dp.ofproto
-        parser = dp.ofproto_parser
 
         if prev_switch_id is None:
             in_port = 0
@@ -566,10 +931,11 @@ class MulticastController(app_manager.RyuApp):
 
         FF_groups = self.network.node[switch_id]['FF_groups']
 
-        log_message = 'Adding backup ' + str(backup_dst) + ' for ' + str(dst) + ' in switch ' + str(switch_id)
-        if prev_switch_id is not None:
-            log_message = log_message + ' (traffic coming from ' + str(prev_switch_id) + ')'
-        self.log(log_message)
+        if prev_switch_id is None:
+            self.log('Adding backup %s for %s in switch %s', backup_dst, dst, switch_id)
+        else:
+            self.log('Adding backup %s for %s in switch %s (traffic coming from %s)', backup_dst, dst, switch_id, 
+                     prev_switch_id)
 
         b_g_key = self._get_FF_key(backup_port, key_backup)
 
@@ -580,68 +946,49 @@ class MulticastController(app_manager.RyuApp):
         g_key = self._get_FF_key(port, key_origin)
 
         if g_key not in FF_groups:
-            self._add_FF_group(switch_id, g_key, port, tag_origin)
+            if self._add_FF_group(switch_id, g_key, port, tag_origin) is None:
+                self.log('FAILED: no group available for backup')
+                return
             self.add_flow(switch_id, dst_address, [], True, src_address, tag_origin, True, prev_switch_id)
         
-        buckets = self.network.node[switch_id]['buckets']
-
-        groups = FF_groups[g_key]
-        base_id, index = groups[0]
-        base_group = buckets[base_id]
+        base_id, index = FF_groups[g_key][0]
+        base_group = FF_groups.group(base_id)
 
         #Case with no existing backup
-        if len(base_group) == index+1:
-            base_group.append((backup_port, tag, False))
-
-            cmd = parser.OFPGroupMod(dp, ofp.OFPGC_MODIFY, ofp.OFPGT_FF, base_id, 
-                                    self._parse_buckets_list(in_port, base_group, dp))
-            dp.send_msg(cmd)
-
-            FF_groups[b_g_key] = [(base_id, index+1)]
+        if len(base_group.buckets) == index+1:
+            FF_groups.append_bucket(base_id, FFGroupStore.FFBucket([backup_port], tag), in_port)
+            FF_groups.set_refs(b_g_key, [(base_id, index+1)])
 
         #Can just output to multiple ports in last bucket
         #Here we assume tag is the same for both outputs (should be the case normally)
         elif not needs_backup:
-            port_list = base_group[index+1][0]
-            if not isinstance(port_list, list):
-                port_list = [port_list]
-                base_group[index+1] = (port_list, tag, False)
-            port_list.append(backup_port)
-
-            cmd = parser.OFPGroupMod(dp, ofp.OFPGC_MODIFY, ofp.OFPGT_FF, base_id, 
-                                    self._parse_buckets_list(in_port, base_group, dp))
-            dp.send_msg(cmd)
-
-            FF_groups[b_g_key] = [(base_id, index)]
+            FF_groups.add_port(base_id, index+1, backup_port, in_port)
+            FF_groups.set_refs(b_g_key, [(base_id, index+1)])
 
         #Case with already existing backup
         #Need to add a new FF group to the switch
         else:
-            b_group = []
+            b_group = [bucket.copy(True) for bucket in base_group.buckets[0:index+1]]
+            b_group.append(FFGroupStore.FFBucket([backup_port], tag))
 
-            for i in range(0, index+1):
-                p,t,drop = base_group[i]
-                b_group.append((p,t,True))            
-            
-            b_group.append((backup_port, tag, False))
-
-            g_id = self._add_group(switch_id, self._parse_buckets_list(in_port, b_group, dp))
-
-            buckets[g_id] = b_group
+            g_id = self._add_group(switch_id, b_group, in_port, (dst_address, src_address))
+            if g_id is None:
+                self.log('FAILED: no group available for backup')
+                return
 
             first_bucket = b_group[0]
-            f_port = first_bucket[0]
-            f_tag = first_bucket[1]
-            f_g_key = self._get_FF_key(f_port, 
-                        self._get_key(True, dst_address, src_address, f_tag, prev_switch_id))
+            f_g_key = self._get_FF_key(first_bucket.ports[0], 
+                        self._get_key(True, dst_address, src_address, first_bucket.tag, prev_switch_id))
 
-            FF_groups[f_g_key].append((g_id, 0))
-            FF_groups[b_g_key] = [(g_id, index+1)]
+            FF_groups.add_ref(f_g_key, g_id, 0)
+            FF_groups.set_refs(b_g_key, [(g_id, index+1)])
 
-            self.add_flow(switch_id, dst_address, [], True, src_address, f_tag, True, prev_switch_id)
+            self.add_flow(switch_id, dst_address, [], True, src_address, first_bucket.tag, True, prev_switch_id)
+
+        self._send_group_updates(switch_id)
 
-        self.log('Added backup for ' + str(dst) + ' to switch ' + str(switch_id))
-        self.log('From tag ' + str(tag_origin) + ' to tag ' + str(tag))
+        self.log('Added backup for %s to switch %s', dst, switch_id)
+        self.log('From tag %s to tag %s', tag_origin, tag)
         
     def remove_backup(self, prev_switch_id, switch_id, dst_address, dst, backup_dst, src_address, 
                     tag, in_port_flow = False):
@@ -656,10 +1003,6 @@ class MulticastController(app_manager.RyuApp):
         src_address: IP address of packet source
         tag: backup tag
         in_port_flow: True if in_port (previous switch) was matched to, False otherwise"""
-                    
-        dp = self.network.node[switch_id]['switch'].dp
-        ofp = dp.ofproto
-        parser = dp.ofproto_parser
 
         if prev_switch_id is None:
             in_port = 0
@@ -676,7 +1019,7 @@ class MulticastController(app_manager.RyuApp):
 
         FF_groups = self.network.node[switch_id]['FF_groups']
 
-        self.log('Removing backup ' + str(backup_dst) + ' for ' + str(dst) + ' in switch ' + str(switch_id))
+        self.log('Removing backup %s for %s in switch %s', backup_dst, dst, switch_id)
 
         b_g_key = self._get_FF_key(backup_port, key_backup)
 
@@ -684,80 +1027,158 @@ class MulticastController(app_manager.RyuApp):
             self.log('FAILED: backup not installed')
             return
 
-        buckets = self.network.node[switch_id]['buckets']
-
         base_id,index = FF_groups[b_g_key][0]
-        base_group = buckets[base_id]
+        base_group = FF_groups.group(base_id)
 
-        first_bucket = base_group[0]
-        f_port = first_bucket[0]
-        f_tag = first_bucket[1]
+        first_bucket = base_group.buckets[0]
+        f_tag = first_bucket.tag
 
         rem_groups = []
 
         #Case with no existing backup for backup
         #So no copies exist
-        if len(base_group) == index+1:
+        if len(base_group.buckets) == index+1:
             rem_groups.append(base_id)
 
         #Add all copies to removal list
         else:
-            f_g_key = self._get_FF_key(f_port, self._get_key(True, dst_address, src_address, 
+            f_g_key = self._get_FF_key(first_bucket.ports[0], self._get_key(True, dst_address, src_address, 
                                     f_tag, prev_switch_id))
 
-            for g_id,index in FF_groups[f_g_key]:
-                bucket = buckets[g_id][index]
-                if (bucket[0] == backup_port or (isinstance(bucket[0], list) and backup_port in bucket[0])) and bucket[1] == tag:
+            #Copies of the base group hold the same bucket at the same index
+            tagged = FF_groups.groups_with_tag(tag)
+            for g_id,g_index in FF_groups[f_g_key]:
+                if g_id not in tagged:
+                    continue
+                group = FF_groups.group(g_id)
+                if len(group.buckets) <= index:
+                    continue
+                bucket = group.buckets[index]
+                if backup_port in bucket.ports and bucket.tag == tag:
                     rem_groups.append(g_id)
 
         removed_group = False
         for g_id in rem_groups:
-            group = buckets[g_id]
-            if index == 0 or group[index-1][2]:
+            group = FF_groups.group(g_id)
+            if index == 0 or group.buckets[index-1].drop:
                 #can just be removed
                 self._remove_FF_group(switch_id, g_id, dst_address, src_address, prev_switch_id)
                 removed_group = True
             else:
-                if isinstance(group[index], list):
-                    group[index].remove(backup_port)
-                    cmd = parser.OFPGroupMod(dp, ofp.OFPGC_MODIFY, ofp.OFPGT_FF, g_id, 
-                                            self._parse_buckets_list(in_port, group, dp))
-                    dp.send_msg(cmd)
+                if len(group.buckets[index].ports) > 1:
+                    FF_groups.remove_port(g_id, index, backup_port, in_port)
+                    FF_groups.pop_refs(b_g_key)
                 else:
-                    for i in range(index,len(group)):
-                        p,t,d = group[i]
-                        if not d:
-                            g_k = self._get_FF_key(p, 
-                                    self._get_key(True, dst_address, src_address, t, prev_switch_id))
-                            del FF_groups[g_k]
-                    buckets[g_id] = group[0:index]
-                    cmd = parser.OFPGroupMod(dp, ofp.OFPGC_MODIFY, ofp.OFPGT_FF, g_id, self._parse_buckets_list(in_port, buckets[g_id], dp))
-                    dp.send_msg(cmd)
+                    for bucket in FF_groups.truncate(g_id, index, in_port):
+                        if not bucket.drop:
+                            b_key = self._get_key(True, dst_address, src_address, bucket.tag, prev_switch_id)
+                            for p in bucket.ports:
+                                FF_groups.pop_refs(self._get_FF_key(p, b_key))
+
+        self._send_group_updates(switch_id)
 
         if removed_group:
             self.add_flow(switch_id, dst_address, [], True, src_address, f_tag, True, prev_switch_id)
 
-        self.log('Removed backup ' + str(backup_dst) + ' for ' + str(dst) + ' in switch ' + str(switch_id))
+        self.log('Removed backup %s for %s in switch %s', backup_dst, dst, switch_id)
 
-    #This function gets triggered before the topology controller flows are added
-    #But late enough to be able to remove flows 
-    @set_ev_cls(ofp_event.EventOFPStateChange, [CONFIG_DISPATCHER])
-    def state_change_handler(self, ev):        
-        dp = ev.datapath
-        ofp = dp.ofproto
-        parser = dp.ofproto_parser        
+    #Only for ipv4 multicast trees
+    def add_rejoin(self, switch_id, dst_address, src_address, tag, rejoin_tag):
+        """Let packets with VLAN tag 'tag' rejoin the tree tagged with rejoin_tag in switch switch_id.
         
-        #Delete any possible currently existing flows.
-        del_flows = parser.OFPFlowMod(dp, table_id=ofp.OFPTT_ALL, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY, command=ofp.OFPFC_DELETE) 
-        dp.send_msg(del_flows)
+        The packets get tag rejoin_tag (or are untagged if it is None) and are forwarded by the actions of the
+        flow entry for rejoin_tag. The rejoin follows every later change of that flow entry.
         
-        #Delete any possible currently exising groups
-        del_groups = parser.OFPGroupMod(datapath=dp, command=ofp.OFPGC_DELETE, group_id=ofp.OFPG_ALL)
-        dp.send_msg(del_groups)
+        Arguments:
+        switch_id: id of switch where packets rejoin
+        dst_address: IP group address
+        src_address: IP address of packet source
+        tag: VLAN tag of the rejoining packets
+        rejoin_tag: VLAN tag of the tree they rejoin, None if that tree is untagged
+        """
+
+        key = self._get_key(True, dst_address, src_address, rejoin_tag, None)
+        tags = self.network.node[switch_id]['rejoins'].setdefault(key, set())
+        if tag in tags:
+            self.log('Rejoin from tag %s already installed in switch %s', tag, switch_id)
+            return
+
+        tags.add(tag)
+        self._pair_entries(switch_id, key[0:2])[0].add(key)
+        self._install_rejoin(switch_id, key, tag, True)
+
+        self.log('Added rejoin from tag %s to tag %s in switch %s', tag, rejoin_tag, switch_id)
+
+    def remove_rejoin(self, switch_id, dst_address, src_address, tag, rejoin_tag):
+        """Remove the rejoin of packets with VLAN tag 'tag' in switch_id, see add_rejoin."""
+
+        dp = self.network.node[switch_id]['switch'].dp
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+
+        key = self._get_key(True, dst_address, src_address, rejoin_tag, None)
+        rejoins = self.network.node[switch_id]['rejoins']
+
+        if tag not in rejoins.get(key, ()):
+            self.log('Tried to remove rejoin from tag %s in switch %s, but it does not exist', tag, switch_id)
+            return
+
+        rejoins[key].remove(tag)
+        if len(rejoins[key]) == 0:
+            del rejoins[key]
+            self._unindex_flow(switch_id, key)
+
+        match = self._get_match(parser, ofp, dst_address, src_address, True, tag, None)
+        cmd = parser.OFPFlowMod(dp, table_id=0, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY,
+                                command=ofp.OFPFC_DELETE_STRICT, match=match, priority=self._get_priority(tag, None))
+        self.send_msg(dp, cmd)
+
+        self.log('Removed rejoin from tag %s to tag %s in switch %s', tag, rejoin_tag, switch_id)
+
+    def _update_rejoins(self, switch_id, key):
+        """Reinstall the rejoins into the flow entry with key 'key' after it changed."""
+
+        for tag in self.network.node[switch_id]['rejoins'].get(key, ()):
+            self._install_rejoin(switch_id, key, tag, False)
+
+    def _install_rejoin(self, switch_id, key, tag, new):
+        """Install the flow entry retagging packets with tag to the flow entry with key 'key'.
         
-        #Make sure deletion is finished using a barrier before additional flows are added
-        barrier_req = parser.OFPBarrierRequest(dp)
-        dp.send_msg(barrier_req)
+        It copies the actions of the first table of that flow entry, its other tables match the retagged packets.
+        new should be True if the flow entry of the rejoin does not exist yet, it is modified otherwise.
+        """
+
+        dp = self.network.node[switch_id]['switch'].dp
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+
+        flows = self.network.node[switch_id]['flows']
+        if key not in flows:
+            return
+
+        dst_address, src_address, rejoin_tag, prev_switch_id = key
+        ports_s, ports_h, current_tables = flows[key]
+
+        actions = self._get_actions(parser, self.network.node[switch_id]['FF_groups'], key, rejoin_tag, 
+                                    ports_s, ports_h)
+        if len(actions) == 0:
+            return
+
+        if rejoin_tag is None:
+            retag = [parser.OFPActionPopVlan()]
+        else:
+            retag = [parser.OFPActionSetField(vlan_vid = (0x1000 | rejoin_tag))]
+
+        instr = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, retag + actions[0])]
+        if len(actions) > 1:
+            instr.append(parser.OFPInstructionGotoTable(1))
+
+        match = self._get_match(parser, ofp, dst_address, src_address, True, tag, None)
+        command = ofp.OFPFC_ADD if new else ofp.OFPFC_MODIFY_STRICT
+        cmd = parser.OFPFlowMod(datapath=dp, cookie=self._get_cookie(dst_address, src_address), table_id=0,
+                                command=command, priority=self._get_priority(tag, None), match=match,
+                                instructions=instr, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY)
+        self.send_msg(dp, cmd)
 
     #Switch connected
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -771,15 +1192,120 @@ class MulticastController(app_manager.RyuApp):
         actions = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
         instr = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
         cmd = parser.OFPFlowMod(datapath=dp, priority=0, match=match, instructions=instr)
-        dp.send_msg(cmd)
+        self.send_msg(dp, cmd)
+
+        if self.SETUP_PUNT_RATE > 0:
+            bands = [parser.OFPMeterBandDrop(rate=self.SETUP_PUNT_RATE, burst_size=self.SETUP_PUNT_RATE)]
+            cmd = parser.OFPMeterMod(dp, ofp.OFPMC_ADD, ofp.OFPMF_PKTPS | ofp.OFPMF_BURST, self.SETUP_METER_ID, bands)
+            self.send_msg(dp, cmd)
+
+        #Ask for the size of the group table
+        dp.send_msg(parser.OFPGroupFeaturesStatsRequest(dp, 0))
+
+        #Instead of clearing the switch, only the entries that differ from its shadow table are changed
+        self.reconciliations[dp.id] = {'dp': dp, 'flows': [], 'groups': [], 'pending': set(['flows', 'groups'])}
+        dp.send_msg(parser.OFPFlowStatsRequest(dp, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY, ofp.OFPG_ANY, 0, 0, 
+                                               parser.OFPMatch()))
+        dp.send_msg(parser.OFPGroupDescStatsRequest(dp, 0))
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        self.barriers.reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_handler(self, ev):
+        self._stats_received(ev.msg, 'flows')
+
+    @set_ev_cls(ofp_event.EventOFPGroupDescStatsReply, MAIN_DISPATCHER)
+    def group_desc_handler(self, ev):
+        self._stats_received(ev.msg, 'groups')
+
+    def _stats_received(self, msg, kind):
+        """Collect the flow or group statistics of a switch that is being reconciled."""
+
+        dp = msg.datapath
+        state = self.reconciliations.get(dp.id)
+        if state is None or state['dp'] is not dp:
+            return
+
+        state[kind].extend(msg.body)
+        if msg.flags & dp.ofproto.OFPMPF_REPLY_MORE:
+            return
+
+        state['pending'].discard(kind)
+        if len(state['pending']) == 0:
+            del self.reconciliations[dp.id]
+            self._reconcile(dp, state['flows'], state['groups'])
+
+    def _reconcile(self, dp, flow_stats, group_stats):
+        """Make the entries of switch dp match its shadow table.
+        
+        Arguments:
+        dp: datapath of the switch
+        flow_stats: OFPFlowStats of all flows of the switch
+        group_stats: OFPGroupDescStats of all groups of the switch
+        """
+
+        msgs = self._get_shadow(dp.id).diff(dp, flow_stats, group_stats)
+
+        self.begin_transaction()
+        try:
+            for msg in msgs:
+                self.send_msg(dp, msg)
+        finally:
+            self.commit_transaction()
+
+        self.metrics.inc('reconciled_entries_total', len(msgs), switch = dp.id)
+        self.log('Reconciled switch %s with %s messages, it had %s flows and %s groups', dp.id, len(msgs), 
+                 len(flow_stats), len(group_stats))
+
+    @set_ev_cls(ofp_event.EventOFPGroupFeaturesStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def group_features_handler(self, ev):
+        dp = ev.msg.datapath
+        ofp = dp.ofproto
+
+        #Switches that do not report a limit for FF groups are only limited by the group id range
+        capacity = ev.msg.body.max_groups[ofp.OFPGT_FF]
+        if capacity == 0:
+            capacity = None
+        self.group_capacity[dp.id] = capacity
+
+        if dp.id in self.network:
+            self.network.node[dp.id]['group_ids'].set_capacity(capacity)
+
+        self.log('Switch %s supports %s FF groups', dp.id, capacity)
 
     #Topology Events
     @set_ev_cls(event.EventSwitchEnter)
     def switchEnter(self,ev):
         switch = ev.switch
 
-        self.network.add_node(switch.dp.id, switch = switch, flows= {}, FF_groups = {}, buckets = {}, group_id_index = 1, host = False)
-        self.log('Added switch ' + str(switch.dp.id))
+        #Changes collected before, such as the switch leaving, happened before it (re)connected
+        self.topology.flush()
+
+        #A switch that reconnects keeps its flows and groups, its shadow table is restored on the switch
+        if switch.dp.id in self.network:
+            sid = switch.dp.id
+            self.network.node[sid]['switch'] = switch
+
+            #Links to hosts of a switch restored from a snapshot come up with the switch
+            links = []
+            for node in self.network.successors(sid):
+                if self.network.node[node]['host'] and not self.network[sid][node]['live']:
+                    self.network[sid][node]['live'] = True
+                    self.network[node][sid]['live'] = True
+                    links.extend([(sid, node), (node, sid)])
+            if len(links) > 0:
+                self._topology_changed(links)
+
+            self.log('Switch %s reconnected', sid)
+            return
+
+        ofp = switch.dp.ofproto
+        group_ids = IdAllocator.IdAllocator(1, ofp.OFPG_MAX, self.group_capacity.get(switch.dp.id))
+
+        self.network.add_node(switch.dp.id, switch = switch, flows= {}, FF_groups = FFGroupStore.FFGroupStore(), group_ids = group_ids, rejoins = {}, pairs = {}, host = False)
+        self.log('Added switch %s', switch.dp.id)
 
     @set_ev_cls(event.EventSwitchLeave)
     def switchLeave(self,ev):
@@ -787,36 +1313,79 @@ class MulticastController(app_manager.RyuApp):
         sid = switch.dp.id
 
         if sid in self.network:
-            for node in self.network.predecessors(sid):
-                self.network[node][sid]['live'] = False
-            for node in self.network.successors(sid):
-                self.network[sid][node]['live'] = False
-            
-            self.builder.repair(self.network.edges(sid))
+            links = list(self.network.in_edges(sid, data = True)) + list(self.network.out_edges(sid, data = True))
+            for x, y, data in links:
+                self._link_changed(x, y, data['src_port'], data['dst_port'], False)
                 
-            self.log('Removed switch ' + str(sid))
+            self.log('Removed switch %s', sid)
+
+    def _repair(self, links):
+        """Repair the trees of all groups for failures links, every group after its pending requests."""
+
+        for key in list(self.builder.groups):
+            self.workers.submit(key, self.builder.repair_group, key, links)
 
     @set_ev_cls(event.EventLinkAdd)
     def linkAdd(self,ev):
         link = ev.link
-        src = link.src.dpid
-        dst = link.dst.dpid
-
-        self.network.add_edge(src, dst, src_port = link.src.port_no, dst_port = link.dst.port_no, live = True)
-        self.log('Added link from ' + str(src) + ' to ' + str(dst))
+        self._link_changed(link.src.dpid, link.dst.dpid, link.src.port_no, link.dst.port_no, True)
 
     @set_ev_cls(event.EventLinkDelete)
     def linkDelete(self,ev):
         link = ev.link
-        src = link.src.dpid
-        dst = link.dst.dpid
+        self._link_changed(link.src.dpid, link.dst.dpid, link.src.port_no, link.dst.port_no, False)
+
+    def _link_changed(self, src, dst, src_port, dst_port, live):
+        """Collect a link coming up (live = True) or going down, see _update_links."""
 
-        if (src,dst) in self.network.edges():
-            self.network[src][dst]['live'] = False
+        link = (src, dst, src_port, dst_port)
 
-            self.builder.repair([(src, dst)])
+        #Changes that do not change anything are dropped, they would cancel a real change collected later
+        if self.topology.collected(None, link) is None:
+            if self.network.has_edge(src, dst):
+                data = self.network[src][dst]
+                if data['live'] == live and (not live or (data['src_port'], data['dst_port']) == (src_port, dst_port)):
+                    return
+            elif not live:
+                return
 
-            self.log('Removed link from ' + str(src) + ' to ' + str(dst))
+        if live:
+            self.topology.add(None, link)
+        else:
+            self.topology.remove(None, link)
+
+    def _update_links(self, key, adds, removes):
+        """Apply the link changes collected by self.topology.
+
+        All changes share a single topology version, and the trees of all groups are repaired once for all 
+        links that went down.
+
+        Arguments:
+        key: unused, all link changes are collected under None
+        adds: (src, dst, src port, dst port) of links that came up
+        removes: (src, dst, src port, dst port) of links that went down
+        """
+
+        changed = []
+        failed = []
+        for src, dst, src_port, dst_port in removes:
+            if self.network.has_edge(src, dst) and self.network[src][dst]['live']:
+                self.network[src][dst]['live'] = False
+                failed.append((src, dst))
+
+        for src, dst, src_port, dst_port in adds:
+            self.network.add_edge(src, dst, src_port = src_port, dst_port = dst_port, live = True)
+            changed.append((src, dst))
+
+        changed.extend(failed)
+        if len(changed) > 0:
+            self._topology_changed(changed)
+
+        if len(failed) > 0:
+            self._repair(failed)
+
+        self.metrics.inc('link_change_batches_total')
+        self.log('Added %s and removed %s links', len(adds), len(failed))
 
     @set_ev_cls(event.EventHostAdd)
     def hostFound(self,ev):
@@ -831,7 +1400,8 @@ class MulticastController(app_manager.RyuApp):
             self.network.add_node(mac, host = True)
             self.network.add_edge(mac, switch_id, src_port = -1, dst_port = port, live = True)
             self.network.add_edge(switch_id, mac, src_port = port, dst_port = -1, live = True)
-            self.log('Added host ' + mac + ' at switch ' + str(switch_id))
+            self._topology_changed([(mac, switch_id), (switch_id, mac)], True)
+            self.log('Added host %s at switch %s', mac, switch_id)
 
     #Packet received
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
@@ -839,7 +1409,38 @@ class MulticastController(app_manager.RyuApp):
         msg = ev.msg
         dp = msg.datapath
 
-        pkt = packet.Packet(msg.data)        
+        packet_class, src, ip_src, ip_dst = PacketClassifier.classify(msg.data)
+        self.metrics.inc('packet_in_total', type = PacketClassifier.NAMES[packet_class])
+
+        #Don't do anything with LLDP, not even logging
+        if packet_class == PacketClassifier.LLDP:
+            return
+
+        if packet_class == PacketClassifier.OTHER:
+            self.processPacket(dp, msg, packet.Packet(msg.data))
+            return
+
+        if src not in self.network:
+            self._hostFound(dp.id, msg.match['in_port'], src)
+
+        #Do not process unicast, broadcast and other non IPv4 multicast packets
+        if packet_class in PacketClassifier.NON_MULTICAST:
+            return
+
+        #Packets of known (S,G) pairs are only sent to the controller until their flows are installed
+        if packet_class == PacketClassifier.IP_MULTICAST and ip_src in self.groups.get(ip_dst, ()):
+            setup = self.setups.get((ip_dst, ip_src))
+            if setup is not None:
+                self._buffer_packet(setup, msg)
+            return
+
+        pkt = packet.Packet(msg.data)
+        self.log('Received multicast packet from %s to %s', src, pkt[0].dst)
+        self.processIPMulticast(dp, msg, pkt)
+
+    def processPacket(self, dp, msg, pkt):
+        """Process a fully parsed packet the classifier could not handle."""
+
         eth = pkt[0]
         
         if eth.protocol_name != 'ethernet':
@@ -854,7 +1455,7 @@ class MulticastController(app_manager.RyuApp):
         self.log('Received ethernet packet')
         src = eth.src
         dst = eth.dst
-        self.log('From ' + src + ' to ' + dst)
+        self.log('From %s to %s', src, dst)
 
         if src not in self.network:
             self._hostFound(dp.id, msg.match['in_port'], src)
@@ -898,7 +1499,7 @@ class MulticastController(app_manager.RyuApp):
         cmd = parser.OFPPacketOut(datapath=dp, buffer_id=ofp.OFP_NO_BUFFER, 
                 in_port=ofp.OFPP_CONTROLLER, actions=actions, data=msg.data)
 
-        dp.send_msg(cmd)
+        self.send_msg(dp, cmd)
 
     def processIPMulticast(self,dp,msg,pkt):
         self.log('IPV4 Multicast Message')
@@ -906,7 +1507,7 @@ class MulticastController(app_manager.RyuApp):
         ip = pkt[1]      
 
         if ip.protocol_name != 'ipv4':
-            self.log('Expected ipv4, but got ' + ip.protocol_name)
+            self.log('Expected ipv4, but got %s', ip.protocol_name)
             return
 
         #IGMP message
@@ -928,73 +1529,185 @@ class MulticastController(app_manager.RyuApp):
 
             self.ip_2_mac[ip.src] = eth.src
 
-            #Setup a flow to destroy all mesages from this group + src
-            ofp = dp.ofproto
-            parser = dp.ofproto_parser
-            actions = []
-            match = parser.OFPMatch(eth_dst=eth.dst, eth_src=eth.src)
-            instr = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
-            cmd = parser.OFPFlowMod(
-                datapath=dp, priority=self.LOWPRIO, match=match, instructions=instr)
-            dp.send_msg(cmd)
+            #Setup a flow to stop the packets from this group + src from coming to the controller
+            self._install_source_flow(dp, eth.dst, eth.src, self.SETUP_PUNT_RATE > 0)
+            self.setups[(ip.dst, ip.src)] = {'dp': dp, 'eth_dst': eth.dst, 'eth_src': eth.src, 'packets': [msg],
+                                             'start': timeit.default_timer()}
 
             #Add existing subscribers to new group
+            #All of them are added at once, so their trees are computed and installed together
+            new_subscribers = []
             subscribers = self.subscribers.get(ip.dst, {})
             for subscriber in it.ifilter(lambda eth_src: eth_src != eth.src, subscribers):
-                sub_info = subscribers[subscriber]
+                if self._is_eligible(subscribers[subscriber], ip.src):
+                    new_subscribers.append(subscriber)
 
-                #INCLUDE mode
-                if sub_info[0]:
-                    add = ip.src in sub_info[1]
-                        
-                #EXCLUDE mode
-                else:
-                    add = ip.src not in sub_info[1]
+            self.workers.submit((ip.dst, ip.src), self._add_subscribers, ip.dst, ip.src, new_subscribers)
+
+    def _install_source_flow(self, dp, eth_dst, eth_src, punt):
+        """Install the flow for the packets of a source that no flow of its tree matches.
+
+        While the tree of a new source is set up its packets are punted to the controller through the setup
+        meter (punt = True), otherwise they are dropped.
+        """
+
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+
+        match = parser.OFPMatch(eth_dst=eth_dst, eth_src=eth_src)
+        if punt:
+            actions = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
+            instr = [parser.OFPInstructionMeter(self.SETUP_METER_ID),
+                     parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        else:
+            instr = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, [])]
+
+        cmd = parser.OFPFlowMod(datapath=dp, priority=self.LOWPRIO, match=match, instructions=instr)
+        self.send_msg(dp, cmd)
+
+    def _buffer_packet(self, setup, msg):
+        """Keep packet-in msg of a new source until its tree is set up, unless the buffer is full."""
+
+        if len(setup['packets']) <= self.SETUP_BUFFER:
+            setup['packets'].append(msg)
+            self.metrics.inc('setup_packets_total', result = 'buffered')
+        else:
+            self.metrics.inc('setup_packets_total', result = 'dropped')
+
+    def _add_subscribers(self, ip_group, ip_source, subscribers):
+        """Add subscribers to the new source ip_source of ip_group.
+
+        Its buffered packets are sent to them once the switches confirmed the tree, see _end_setup.
+        """
+
+        key = (ip_group, ip_source)
+        dps = []
+
+        self.begin_transaction()
+        try:
+            self.builder.add_subscribers(ip_group, ip_source, subscribers)
+        finally:
+            dps = self.commit_transaction()
+            self.barriers.confirm(dps, lambda confirmed: self._end_setup(key, subscribers, confirmed),
+                                  self.SETUP_TIMEOUT)
+
+    def _end_setup(self, key, subscribers, confirmed):
+        """Send the buffered packets of the new source of key (group, source) to the subscribers in its tree."""
+
+        setup = self.setups.pop(key, None)
+        if setup is None:
+            return
+
+        if not confirmed:
+            self.logger.warning('Switches did not confirm the tree of %s within %s seconds', key, self.SETUP_TIMEOUT)
+
+        if self.SETUP_PUNT_RATE > 0:
+            self._install_source_flow(setup['dp'], setup['eth_dst'], setup['eth_src'], False)
+
+        tree = self.builder.groups.get(key)
+        receivers = [subscriber for subscriber in subscribers if tree is not None and subscriber in tree]
+        for msg in setup['packets']:
+            for subscriber in receivers:
+                self.send_packet(subscriber, msg)
 
-                if add:                    
-                    self.builder.add_subscriber(ip.dst, ip.src, subscriber)
-                    self.send_packet(subscriber, msg)
+        self.metrics.observe('setup_seconds', timeit.default_timer() - setup['start'])
 
-    #TODO: Support all types of IGMPV3 messages,
-    #instead of just INCLUDE and EXCLUDE messages
     def processIGMP(self, eth_src, ip_src, igmp_msg):
+        """Update the source filter of subscriber eth_src for every group record in igmp_msg.
+        
+        Only sources whose eligibility changed are passed on to the TreeBuilder, 
+        so repeated reports of the same state (e.g. MODE_IS_* answers to queries) do not cost anything.
+        """
+    
         #Only support IGMPV3
         if igmp_msg.protocol_name == 'igmpv3_report':
-            records = igmp_msg.records
-            for record in records:
-                address = record.address
-
-                if record.type_ == igmp.CHANGE_TO_INCLUDE_MODE or record.type_ == igmp.CHANGE_TO_EXCLUDE_MODE:
-
-                    mode = record.type_ == igmp.CHANGE_TO_INCLUDE_MODE
-
-                    self.log('Record change for group ' + address)
-
-                    if address not in self.subscribers:
-                        self.subscribers[address] = {}
-
-                    subscribers = self.subscribers[address]
-                    subscribers[eth_src] = [mode, record.srcs]                                
-
-                    if address in self.groups:
-                        group = self.groups[address]
-                        if mode:
-                            for src_ip in it.ifilter(lambda ip: ip != ip_src, group):
-                                if src_ip in record.srcs:
-                                    self.builder.add_subscriber(address, src_ip, eth_src)
-                                else:                       
-                                    self.builder.remove_subscriber(address, src_ip, eth_src)
-                        else:
-                            for src_ip in it.ifilter(lambda ip: ip != ip_src, group):
-                                if src_ip in record.srcs:
-                                    self.builder.remove_subscriber(address, src_ip, eth_src)
-                                else:                       
-                                    self.builder.add_subscriber(address, src_ip, eth_src)
-                    
-
+            for record in igmp_msg.records:
+                self.processIGMPRecord(eth_src, ip_src, record)
         else:
             self.log('Only supporting IGMPV3')
-    
+
+    def processIGMPRecord(self, eth_src, ip_src, record):
+        address = record.address
+        subscribers = self.subscribers.setdefault(address, {})
+
+        #Hosts without state have not joined any source, which is the same as INCLUDE mode without sources
+        old_info = subscribers.get(eth_src, [True, set()])
+        new_info = self._apply_IGMP_record(old_info, record)
+
+        if new_info is None:
+            self.log('Ignoring IGMPv3 record of type %s for group %s', record.type_, address)
+            return
+
+        if new_info[0] == old_info[0] and new_info[1] == old_info[1]:
+            return
+
+        self.log('Record change for group %s', address)
+
+        #INCLUDE mode without sources means the host is no longer interested in the group
+        if new_info[0] and len(new_info[1]) == 0:
+            subscribers.pop(eth_src, None)
+        else:
+            subscribers[eth_src] = new_info
+
+        for src_ip in it.ifilter(lambda ip: ip != ip_src, self.groups.get(address, ())):
+            was_eligible = self._is_eligible(old_info, src_ip)
+            eligible = self._is_eligible(new_info, src_ip)
+
+            if eligible and not was_eligible:
+                self.coalescer.add((address, src_ip), eth_src)
+            elif was_eligible and not eligible:
+                self.coalescer.remove((address, src_ip), eth_src)
+
+    def _submit_requests(self, key, adds, removes):
+        self.workers.submit(key, self._process_requests, key, adds, removes)
+
+    def _process_requests(self, key, adds, removes):
+        """Remove subscribers removes from and add subscribers adds to the group identified by key (group, source)."""
+
+        self.begin_transaction()
+        try:
+            for subscriber in removes:
+                self.builder.remove_subscriber(key[0], key[1], subscriber)
+
+            if len(adds) == 1:
+                self.builder.add_subscriber(key[0], key[1], adds[0])
+            elif len(adds) > 1:
+                self.builder.add_subscribers(key[0], key[1], adds)
+        finally:
+            self.commit_transaction()
+
+    def _apply_IGMP_record(self, sub_info, record):
+        """Returns the [MODE, ip_sources] of a subscriber with sub_info after record, or None if the record type is unknown.
+        
+        See section 6.4 of RFC 3376, ignoring the timers as every subscriber is tracked separately.
+        """
+
+        mode, sources = sub_info
+        record_sources = set(record.srcs)
+
+        if record.type_ in (igmp.MODE_IS_INCLUDE, igmp.CHANGE_TO_INCLUDE_MODE):
+            return [True, record_sources]
+
+        if record.type_ in (igmp.MODE_IS_EXCLUDE, igmp.CHANGE_TO_EXCLUDE_MODE):
+            return [False, record_sources]
+
+        if record.type_ == igmp.ALLOW_NEW_SOURCES:
+            return [mode, sources | record_sources if mode else sources - record_sources]
+
+        if record.type_ == igmp.BLOCK_OLD_SOURCES:
+            return [mode, sources - record_sources if mode else sources | record_sources]
+
+        return None
+
+    def _is_eligible(self, sub_info, ip_source):
+        """Returns True if a subscriber with sub_info ([MODE, ip_sources]) should receive packets from ip_source."""
+
+        #INCLUDE mode
+        if sub_info[0]:
+            return ip_source in sub_info[1]
+
+        #EXCLUDE mode
+        return ip_source not in sub_info[1]
 
     def isMulticast(self, dst):
         return (dst[0:2] == '01' or dst[0:5] == '33:33' or dst == 'ff:ff:ff:ff:ff:ff')
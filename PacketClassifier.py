@@ -0,0 +1,69 @@
+"""Classifies packet-ins by reading a few fields straight from the raw frame.
+
+Only the packets the controller actually acts on (IGMP reports and the first packets of new (S,G) flows)
+have to be decoded with ryu.lib.packet afterwards.
+"""
+
+import socket
+import struct
+
+from ryu.lib.packet import ether_types
+from ryu.lib.packet import in_proto
+
+#Packet classes
+OTHER = 0 #Frames the classifier does not understand, these have to be fully parsed
+LLDP = 1
+UNICAST = 2
+IGMP = 3
+IP_MULTICAST = 4 #IPv4 multicast packets other than IGMP
+BROADCAST = 5
+L2_MULTICAST = 6 #Frames to a multicast MAC address that are not IPv4 packets, such as IPv6 multicast
+
+NAMES = {OTHER: 'other', LLDP: 'lldp', UNICAST: 'unicast', IGMP: 'igmp', IP_MULTICAST: 'ip_multicast',
+         BROADCAST: 'broadcast', L2_MULTICAST: 'l2_multicast'}
+
+#Classes the controller only learns the sender of
+NON_MULTICAST = (UNICAST, BROADCAST, L2_MULTICAST)
+
+_ETHERNET_HEADER = struct.Struct('!6s6sH')
+_IPV4_HEADER = struct.Struct('!B8xB2x4s4s')
+
+_ETH_MULTICAST_PREFIXES = (b'\x01', b'\x33\x33')
+_ETH_BROADCAST = b'\xff' * 6
+
+def classify(data):
+    """Returns (packet class, Ethernet source, IP source, IP destination) of the raw frame data.
+
+    The Ethernet source is set for all classes but OTHER and LLDP, the IP addresses only
+    for IGMP and IP_MULTICAST packets. No data gets copied apart from the addresses themselves.
+    """
+
+    if len(data) < _ETHERNET_HEADER.size:
+        return OTHER, None, None, None
+
+    dst, src, ethertype = _ETHERNET_HEADER.unpack_from(data)
+
+    if ethertype == ether_types.ETH_TYPE_LLDP:
+        return LLDP, None, None, None
+
+    eth_src = '%02x:%02x:%02x:%02x:%02x:%02x' % struct.unpack('!6B', src)
+
+    if dst == _ETH_BROADCAST:
+        return BROADCAST, eth_src, None, None
+
+    if not dst.startswith(_ETH_MULTICAST_PREFIXES):
+        return UNICAST, eth_src, None, None
+
+    if ethertype != ether_types.ETH_TYPE_IP:
+        return L2_MULTICAST, eth_src, None, None
+
+    if len(data) < _ETHERNET_HEADER.size + _IPV4_HEADER.size:
+        return OTHER, None, None, None
+
+    version, proto, ip_src, ip_dst = _IPV4_HEADER.unpack_from(data, _ETHERNET_HEADER.size)
+    if version >> 4 != 4:
+        return OTHER, None, None, None
+
+    packet_class = IGMP if proto == in_proto.IPPROTO_IGMP else IP_MULTICAST
+
+    return packet_class, eth_src, socket.inet_ntoa(ip_src), socket.inet_ntoa(ip_dst)
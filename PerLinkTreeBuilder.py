@@ -1,13 +1,31 @@
-import networkx as nx
-
 import AbstractTreeBuilder
-from collections import deque
+import JoinCache
+import JoinPool
 
 class PerLinkTreeBuilder(AbstractTreeBuilder.AbstractTreeBuilder):
     """Protects against F link failures by installing backup trees for all protected links"""
 
+    def __init__(self, F, controller, join, join_many = None, processes = 0):
+        """
+        Arguments:
+        F: amount of (link) fault tolerance
+        controller: MulticastController used to install flows
+        join: join function used to compute paths
+        join_many: function used to compute the paths of many subscribers at once, see add_subscribers
+        processes: amount of worker processes used to compute backup paths, 0 to compute them in this process
+        """
+
+        super(PerLinkTreeBuilder, self).__init__(F, controller, join, join_many)
+        self.pool = JoinPool.JoinPool(join, processes) if processes > 0 else None
+        self.pool_map = controller.workers.offload(self.pool.map) if processes > 0 else None
+
     def _process_request(self, T, v, r, F, ip_group, ip_source):
-        """Implementation of algorithm 4 from 'Resilient SDN-based multicast'"""
+        """Implementation of algorithm 4 from 'Resilient SDN-based multicast'
+        
+        The backup paths are computed one level of the breadth-first search at a time.
+        All paths of a level are independent searches, so they are computed as a batch
+        and installed afterwards in the same order as the search visits them.
+        """
     
         if not r:
             return self._leave(T, v, ip_group, ip_source)
@@ -16,54 +34,224 @@ class PerLinkTreeBuilder(AbstractTreeBuilder.AbstractTreeBuilder):
         path = self.join(network, [], T, v)
         
         if len(path) == 0:
-            self.controller.log('no path from ' + str(T.graph['root']) + ' to ' + str(v))
+            self.controller.log('no path from %s to %s', T.graph['root'], v)
             return False
             
         self._add_path(ip_group, ip_source, T, path, F > 0)
         
-        queue = deque()
+        level = []
         if F > 0:
-            queue.append((path, T, []))
+            level.append((path, T, []))
         
-        while len(queue) > 0:
-            path, T, down = queue.popleft()
-            
-            for i in range(1, len(path)):
-                x = path[i-1]
-                y = path[i]
-                predecessor = path[i-2] if i >= 2 else T.graph['predecessor_switch']
-                
-                backup = T[x][y]['backup']
+        #Every level of the search protects against one more failure
+        stage = 1
+        while len(level) > 0:
+            self.controller.install_stage(stage)
+            level = self._protect_level(network, level, v, F, ip_group, ip_source)
+            stage += 1
+
+        return True
+
+    def _process_requests(self, T, subscribers, F, ip_group, ip_source):
+        """Add all subscribers to T at once.
+        
+        The primary paths of all subscribers come from a single join_many call. Afterwards every protected
+        link gets a single join_many call for all new subscribers below it, instead of one join per subscriber.
+        """
+
+        if self.join_many is None:
+            return super(PerLinkTreeBuilder, self)._process_requests(T, subscribers, F, ip_group, ip_source)
+
+        network = self.controller.get_network()
+        paths = self.join_many(network, [], T, subscribers)
+
+        added = []
+        for v in subscribers:
+            path = paths.get(v, [])
+            if len(path) == 0:
+                self.controller.log('no path from %s to %s', T.graph['root'], v)
+                continue
+
+            self._add_path(ip_group, ip_source, T, path, F > 0)
+            added.append(v)
+
+        level = []
+        if F > 0 and len(added) > 0:
+            level.append((T, added, []))
+
+        stage = 1
+        while len(level) > 0:
+            self.controller.install_stage(stage)
+            level = self._protect_tree_level(network, level, F, ip_group, ip_source)
+            stage += 1
+
+        return added
+
+    def _protect_tree_level(self, network, level, F, ip_group, ip_source):
+        """Compute and install the backups for all (tree, subscribers, excluded links) in level.
+        
+        Every link of a tree on the path to one of its subscribers is protected for all of these 
+        subscribers below it at once. Returns the next level of the breadth-first search.
+        """
+
+        next_level = []
+        for T, subscribers, down in level:
+            root = T.graph['root']
+
+            #Link -> subscribers below it, in the order the breadth-first search visits the links
+            below = {}
+            links = []
+            for v in subscribers:
+                path = self._get_path(T, v)
+                for i in range(1, len(path)):
+                    link = (path[i-1], path[i])
+                    if link not in below:
+                        below[link] = []
+                        links.append(link)
+                    below[link].append(v)
+
+            for x, y in links:
+                predecessor = list(T.predecessors(x))[0] if x != root else T.graph['predecessor_switch']
 
-                if backup is None:
-                    backup = self._create_tree(x, T, predecessor)
-                    T[x][y]['backup'] = backup
-                    
                 L = set(down)
                 L.add((x,y))
                 L.add((y,x))
-                
-                b_path = self.join(network, L, backup , v)
-                
-                if len(b_path) > 0:
+
+                backup = T[x][y]['backup']
+                #Backup trees only get created when a backup path exists, until then an empty tree suffices
+                b_paths = self.join_many(network, L, backup if backup is not None else self._empty_tree(x), 
+                                        below[x,y])
+
+                protected = []
+                for v in below[x,y]:
+                    b_path = b_paths.get(v, [])
+                    if len(b_path) == 0:
+                        self.controller.log('no backup path from %s to %s', x, v)
+                        continue
+
+                    if backup is None:
+                        backup = self._create_tree(x, T, predecessor)
+                        if backup is None:
+                            break
+                        backup.graph['exclude'] = L
+                        T[x][y]['backup'] = backup
+
                     not_done = len(L)/2 < F
 
-                    if b_path[1] not in backup[x]:                        
+                    if b_path[1] not in backup[x]:
                         self.controller.add_backup(predecessor, x, ip_group, y, b_path[1], 
                         ip_source, backup.graph['tag'], T.graph['tag'], not_done)
                         backup.add_edge(x, b_path[1], backup = None)
 
                     self._add_path(ip_group, ip_source, backup, b_path[1:], not_done)
-                    
-                    if not_done:
-                        queue.append((b_path, backup, L))
-                else:
-                    self.controller.log('no backup path from ' + str(x) + ' to ' + str(v))
-
-                    if backup.number_of_edges() == 0:
-                        T[x][y]['backup'] = None
-                        self._undo_tree(backup)
-        return True
+                    protected.append(v)
+
+                if backup is not None and backup.number_of_edges() == 0:
+                    T[x][y]['backup'] = None
+                    self._release_tags(backup)
+
+                if len(protected) > 0 and len(L)/2 < F:
+                    next_level.append((backup, protected, L))
+
+        return next_level
+
+    def _protect_level(self, network, level, v, F, ip_group, ip_source):
+        """Compute and install the backups for all (path, tree, excluded links) in level.
+        
+        Returns the next level of the breadth-first search.
+        """
+
+        links = []
+        for path, T, down in level:
+            for i in range(1, len(path)):
+                x = path[i-1]
+                y = path[i]
+                predecessor = path[i-2] if i >= 2 else T.graph['predecessor_switch']
+
+                L = set(down)
+                L.add((x,y))
+                L.add((y,x))
+
+                links.append((T, x, y, predecessor, L))
+
+        return self._protect_links(network, links, v, F, ip_group, ip_source)
+
+    def _protect_links(self, network, links, v, F, ip_group, ip_source):
+        """Compute and install the backups for v for all (tree, x, y, predecessor, excluded links) in links.
+        
+        Returns the next level of the breadth-first search.
+        """
+
+        requests = []
+        for T, x, y, predecessor, L in links:
+            backup = T[x][y]['backup']
+            #Backup trees only get created when a backup path exists, until then an empty tree suffices
+            requests.append((L, backup if backup is not None else self._empty_tree(x)))
+
+        if self.pool is not None and len(requests) > 1:
+            b_paths = self.join_cache.join_all(network, requests, v, self.pool_map)
+        else:
+            b_paths = [self.join(network, L, backup, v) for L, backup in requests]
+
+        next_level = []
+        for (T, x, y, predecessor, L), b_path in zip(links, b_paths):
+            backup = T[x][y]['backup']
+
+            if len(b_path) > 0:
+                if backup is None:
+                    backup = self._create_tree(x, T, predecessor)
+                    if backup is None:
+                        continue
+                    backup.graph['exclude'] = L
+                    T[x][y]['backup'] = backup
+
+                not_done = len(L)/2 < F
+
+                if b_path[1] not in backup[x]:                        
+                    self.controller.add_backup(predecessor, x, ip_group, y, b_path[1], 
+                    ip_source, backup.graph['tag'], T.graph['tag'], not_done)
+                    backup.add_edge(x, b_path[1], backup = None)
+
+                self._add_path(ip_group, ip_source, backup, b_path[1:], not_done)
+                
+                if not_done:
+                    next_level.append((b_path, backup, L))
+            else:
+                self.controller.log('no backup path from %s to %s', x, v)
+
+                if backup is not None and backup.number_of_edges() == 0:
+                    T[x][y]['backup'] = None
+                    self._release_tags(backup)
+
+        return next_level
+
+    def _protect(self, T, v, ip_group, ip_source):
+        network = self.controller.get_network()
+
+        level = [(self._get_path(T, v), T, [])]
+        while len(level) > 0:
+            level = self._protect_level(network, level, v, self.F, ip_group, ip_source)
+
+    def _reprotect(self, T, x, y, backup, v, ip_group, ip_source):
+        if backup is not None and T[x][y]['backup'] is backup:
+            self._leave(backup, v, ip_group, ip_source, y)
+
+        network = self.controller.get_network()
+
+        predecessor = list(T.predecessors(x))[0] if x != T.graph['root'] else T.graph['predecessor_switch']
+        L = set(T.graph.get('exclude', ()))
+        L.add((x,y))
+        L.add((y,x))
+
+        links = [(T, x, y, predecessor, L)]
+        level = self._protect_links(network, links, v, self.F, ip_group, ip_source)
+        while len(level) > 0:
+            level = self._protect_level(network, level, v, self.F, ip_group, ip_source)
+
+    def _empty_tree(self, switch_id):
+        tree = JoinCache.Tree(root = switch_id)
+        tree.add_node(switch_id)
+        return tree
 
     def _add_path(self, ip_group, ip_source, tree, path, needs_backup=False):
         """Add path to tree and install the necessary flow entries."""
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+
+from ryu.lib import hub
+
+class RequestCoalescer(object):
+    """Collects the joins and leaves of subscribers for a short window before they are processed.
+
+    A join and a leave of the same subscriber for the same (group, source) pair cancel each other, hosts that
+    flap or switch channels back and forth within the window cost nothing. The requests that remain are
+    passed on per (group, source) pair, so all of them are processed in a single transaction.
+
+    Other requests that cancel each other are collected the same way, such as links that go down and come
+    back up (see MulticastController._update_links).
+    """
+
+    def __init__(self, window, limit, process, metrics, counter = 'coalesced_requests_total'):
+        """
+        Arguments:
+        window: seconds requests are collected before they are processed, 0 to process them right away
+        limit: amount of collected requests after which they are processed without waiting for the window
+        process: function called with ((group, source), subscribers to add, subscribers to remove)
+        metrics: Metrics counting the cancelled requests
+        counter: name of the metric counting the cancelled requests
+        """
+
+        self.window = window
+        self.limit = limit
+        self.process = process
+        self.metrics = metrics
+        self.counter = counter
+        self.requests = OrderedDict() #(group, source) -> OrderedDict subscriber -> True to add, False to remove
+        self.size = 0
+        self.timer = None
+
+    def add(self, key, subscriber):
+        """Add subscriber to the group identified by key (group, source)."""
+        self._request(key, subscriber, True)
+
+    def remove(self, key, subscriber):
+        """Remove subscriber from the group identified by key (group, source)."""
+        self._request(key, subscriber, False)
+
+    def collected(self, key, subscriber):
+        """Returns True if adding subscriber is collected, False if removing it is, or None."""
+        return self.requests.get(key, {}).get(subscriber)
+
+    def _request(self, key, subscriber, add):
+        if self.window <= 0:
+            self.process(key, [subscriber] if add else [], [] if add else [subscriber])
+            return
+
+        requests = self.requests.setdefault(key, OrderedDict())
+        pending = requests.get(subscriber)
+
+        if pending is None:
+            requests[subscriber] = add
+            self.size += 1
+        elif pending != add:
+            #The subscriber ends up where it started
+            del requests[subscriber]
+            self.size -= 1
+            self.metrics.inc(self.counter, 2)
+            if len(requests) == 0:
+                del self.requests[key]
+
+        if self.size >= self.limit:
+            self.flush()
+        elif self.timer is None and self.size > 0:
+            self.timer = hub.spawn_after(self.window, self._expire)
+
+    def _expire(self):
+        self.timer = None
+        self.flush()
+
+    def flush(self):
+        """Process all collected requests now."""
+
+        #The window starts again with the next request
+        if self.timer is not None:
+            hub.kill(self.timer)
+            self.timer = None
+
+        requests = self.requests
+        self.requests = OrderedDict()
+        self.size = 0
+
+        for key, subscribers in requests.items():
+            adds = [subscriber for subscriber, add in subscribers.items() if add]
+            removes = [subscriber for subscriber, add in subscribers.items() if not add]
+            self.process(key, adds, removes)
+
+    def pending(self):
+        """Returns the amount of collected requests."""
+        return self.size
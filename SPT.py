@@ -1,34 +1,271 @@
-import networkx as nx
+import heapq
+import weakref
+
+from collections import OrderedDict
+
+#Cost of a hop over a link that is not part of the tree. Links in the tree cost one less.
+#As long as a tree has fewer than _HOP links, this only breaks ties between paths with the same amount of hops
+#in favor of the path reusing the most tree links, just like weights of 1 and 1 - 1/(num_edges + 1) do.
+_HOP = 1 << 32
+
+class SPTEngine(object):
+    """Computes the joins of SPTs from cached shortest path trees.
+
+    A shortest path tree of the network is kept per (tree, exclusion set). When the tree gains or loses
+    links, or links of the network change (see MulticastController._topology_changed), only the part
+    of the shortest path tree affected by those changes is recomputed (dynamic SSSP). A join then only
+    has to read the path from the cache.
+    """
+
+    def __init__(self, max_states = 256):
+        """
+        Arguments:
+        max_states: maximum amount of (tree, exclusion set) shortest path trees to keep
+        """
+
+        self.max_states = max_states
+        self.states = OrderedDict() #(id(T), exclusion set) -> (weakref to T, _SearchState)
+
+    def join(self, network, exclude, T, v):
+        """See join."""
+
+        if v in T:
+            return []
+
+        return self._path(self._state(network, exclude, T), v)
+
+    def join_many(self, network, exclude, T, targets):
+        """See join_many."""
+
+        state = None
+        paths = {}
+        for v in targets:
+            if v in T:
+                paths[v] = []
+                continue
+
+            if state is None:
+                state = self._state(network, exclude, T)
+            paths[v] = self._path(state, v)
+
+        return paths
+
+    def _state(self, network, exclude, T):
+        """Returns the up to date shortest path tree for T and exclude."""
+
+        exclude = frozenset(exclude)
+        key = (id(T), exclude)
+
+        entry = self.states.pop(key, None)
+        state = None
+        if entry is not None and entry[0]() is T:
+            state = entry[1]
+
+        if state is None or state.root != T.graph['root'] or not self._update(network, exclude, T, state):
+            state = self._compute(network, exclude, T)
+
+        self.states[key] = (weakref.ref(T, lambda ref: self._discard(key, ref)), state)
+        if len(self.states) > self.max_states:
+            self.states.popitem(last = False)
+
+        return state
+
+    def _path(self, state, v):
+        """Returns the path from the root to v in the shortest path tree state."""
+
+        if v not in state.dist:
+            return []
+
+        path = [v]
+        pred = state.pred
+        cur = pred[v]
+        while cur is not None:
+            path.append(cur)
+            cur = pred[cur]
+        path.reverse()
+
+        return path
+
+    def _discard(self, key, ref):
+        """Drop the state of a tree that no longer exists."""
+
+        entry = self.states.get(key)
+        if entry is not None and entry[0] is ref:
+            del self.states[key]
+
+    def _compute(self, network, exclude, T):
+        """Compute the shortest path tree for T from scratch."""
+
+        root = T.graph['root']
+        state = _SearchState(root, network.graph.get('version', 0), T)
+
+        state.dist[root] = 0
+        state.pred[root] = None
+        self._relax(network, exclude, T, state, [(0, root)])
+
+        return state
+
+    def _update(self, network, exclude, T, state):
+        """Update state to the current T and network. Returns False if it should be recomputed instead."""
+
+        changed = set()
+
+        version = network.graph.get('version', 0)
+        if version != state.version:
+            changes = network.graph.get('changes')
+            if not changes or changes[0][0] > state.version + 1:
+                return False
+
+            for change_version, links in changes:
+                if change_version > state.version:
+                    changed.update(links)
+
+        tree_nodes = set(T)
+        tree_edges = set(T.edges())
+
+        changed.update(tree_edges.symmetric_difference(state.tree_edges))
+        for node in tree_nodes.symmetric_difference(state.tree_nodes):
+            if node in network:
+                changed.update((pre, node) for pre in network.pred[node])
+
+        state.version = version
+        state.tree_nodes = tree_nodes
+        state.tree_edges = tree_edges
+
+        if len(changed) == 0:
+            return True
+
+        dist = state.dist
+        pred = state.pred
+        children = state.children
+
+        #Links of the shortest path tree that became more expensive invalidate the subtree below them
+        affected = set()
+        for x, y in changed:
+            if pred.get(y, None) != x or x not in dist or y in affected:
+                continue
+            w = _weight(network, exclude, T, x, y)
+            if w is None or w > dist[y] - dist[x]:
+                stack = [y]
+                while len(stack) > 0:
+                    node = stack.pop()
+                    if node not in affected:
+                        affected.add(node)
+                        stack.extend(children.get(node, ()))
+
+        for node in affected:
+            del dist[node]
+            state.set_pred(node, None)
+            del pred[node]
+
+        heap = []
+
+        #Affected nodes restart from their best link coming from an unaffected node
+        for node in affected:
+            for pre in network.pred[node]:
+                if pre in dist:
+                    w = _weight(network, exclude, T, pre, node)
+                    if w is not None and (node not in dist or dist[pre] + w < dist[node]):
+                        dist[node] = dist[pre] + w
+                        state.set_pred(node, pre)
+            if node in dist:
+                heapq.heappush(heap, (dist[node], node))
+
+        #Links that became cheaper (or usable) can shorten paths of unaffected nodes
+        for x, y in changed:
+            if x in dist and y not in affected:
+                w = _weight(network, exclude, T, x, y)
+                if w is not None and (y not in dist or dist[x] + w < dist[y]):
+                    dist[y] = dist[x] + w
+                    state.set_pred(y, x)
+                    heapq.heappush(heap, (dist[y], y))
+
+        self._relax(network, exclude, T, state, heap)
+
+        return True
+
+    def _relax(self, network, exclude, T, state, heap):
+        """Dijkstra's algorithm starting from the (distance, node) pairs in heap."""
+
+        dist = state.dist
+        succ = network.succ
+
+        while len(heap) > 0:
+            d, x = heapq.heappop(heap)
+            if d != dist.get(x):
+                continue
+
+            for y in succ[x]:
+                w = _weight(network, exclude, T, x, y)
+                if w is None:
+                    continue
+                if y not in dist or d + w < dist[y]:
+                    dist[y] = d + w
+                    state.set_pred(y, x)
+                    heapq.heappush(heap, (dist[y], y))
+
+class _SearchState(object):
+    """Shortest path tree of the network for a single (tree, exclusion set)."""
+
+    __slots__ = ('root', 'version', 'tree_nodes', 'tree_edges', 'dist', 'pred', 'children')
+
+    def __init__(self, root, version, T):
+        self.root = root
+        self.version = version
+        self.tree_nodes = set(T)
+        self.tree_edges = set(T.edges())
+        self.dist = {}
+        self.pred = {}
+        self.children = {}
+
+    def set_pred(self, node, pre):
+        old = self.pred.get(node)
+        if old is not None:
+            self.children[old].discard(node)
+        self.pred[node] = pre
+        if pre is not None:
+            self.children.setdefault(pre, set()).add(node)
+
+def _weight(network, exclude, T, x, y):
+    edata = network.succ[x].get(y)
+    if edata is None or not edata['live']:
+        return None
+    if (x,y) in exclude:
+        return None
+    if T.has_edge(x,y):
+        return _HOP - 1
+    if y in T:
+        return None #Resulting trees should actually be trees
+    return _HOP
+
+_engine = SPTEngine()
 
 def join(network, exclude, T, v):
     """Used to construct SPTs.
-    
+
     See algorithm 2 in 'Resilient SDN-based multicast'.
-    
+
     Arguments:
     network: network graph
     exclude: all links that should be excluded from the trees
     T: current trees
     v: node to be added to T
     """
-    
-    if v in T:
-        return []
-        
-    epsilon = 1.0/(T.size() + 1) #1/(num_edges + 1)
-        
-    def weight(x, y, edata):
-        if not edata['live']:
-            return None
-        if (x,y) in exclude:
-            return None
-        if T.has_edge(x,y):
-            return 1.0 - epsilon
-        if y in T:
-            return None #Resulting trees should actually be trees
-        return 1.0
-
-    try:
-        return nx.dijkstra_path(network, T.graph['root'], v, weight)
-    except (nx.NetworkXNoPath, nx.NetworkXError):
-        return []
+
+    return _engine.join(network, exclude, T, v)
+
+def join_many(network, exclude, T, targets):
+    """Computes the joins of all targets to T with a single shortest path tree.
+
+    Returns a dictionary target -> path, where every path is what join would return for that target.
+    T is not changed. Since all paths come from the same shortest path tree, together they form a tree
+    with T, so they can all be added to T.
+
+    Arguments:
+    network: network graph
+    exclude: all links that should be excluded from the trees
+    T: current trees
+    targets: nodes to be added to T
+    """
+
+    return _engine.join_many(network, exclude, T, targets)
@@ -0,0 +1,135 @@
+class ShadowTable(object):
+    """The flow and group entries the controller intends a switch to have.
+
+    Every FlowMod and GroupMod is applied to the shadow table when it is sent to the switch, in the order the
+    switch receives them. When the switch reconnects, diff() compares the shadow table with the entries the
+    switch reports in its flow and group statistics and returns the messages that make the switch match it.
+
+    Only flows with a priority of at most max_priority are managed, higher priority flows belong to other
+    applications (such as the LLDP flow of Ryu's topology discovery) and are left alone.
+    """
+
+    def __init__(self, max_priority):
+        """
+        Arguments:
+        max_priority: highest priority of the flows installed by the controller
+        """
+
+        self.max_priority = max_priority
+        self.flows = {} #(table_id, priority, match) -> OFPFlowMod
+        self.groups = {} #group id -> OFPGroupMod
+
+    def apply(self, dp, msg):
+        """Apply msg, which is sent to datapath dp, to the shadow table."""
+
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+
+        if isinstance(msg, parser.OFPFlowMod):
+            if msg.priority > self.max_priority and msg.command in (ofp.OFPFC_ADD, ofp.OFPFC_MODIFY_STRICT):
+                return
+
+            key = _flow_key(msg.table_id, msg.priority, msg.match)
+
+            if msg.command == ofp.OFPFC_ADD:
+                self.flows[key] = msg
+            elif msg.command in (ofp.OFPFC_MODIFY, ofp.OFPFC_MODIFY_STRICT):
+                if key in self.flows:
+                    self.flows[key] = msg
+            elif msg.command == ofp.OFPFC_DELETE_STRICT:
+                self.flows.pop(key, None)
+            elif msg.command == ofp.OFPFC_DELETE:
+                self._delete_flows(ofp, msg)
+
+        elif isinstance(msg, parser.OFPGroupMod):
+            if msg.command in (ofp.OFPGC_ADD, ofp.OFPGC_MODIFY):
+                self.groups[msg.group_id] = msg
+            elif msg.command == ofp.OFPGC_DELETE:
+                if msg.group_id == ofp.OFPG_ALL:
+                    self.groups.clear()
+                    self.flows = dict((key, flow) for key, flow in self.flows.items()
+                                      if len(_output_groups(flow.instructions)) == 0)
+                else:
+                    self.groups.pop(msg.group_id, None)
+                    #Switches remove the flows forwarding to a deleted group along with it
+                    self.flows = dict((key, flow) for key, flow in self.flows.items()
+                                      if msg.group_id not in _output_groups(flow.instructions))
+
+    def _delete_flows(self, ofp, msg):
+        match = msg.match.items()
+        for key in list(self.flows):
+            flow = self.flows[key]
+            if msg.table_id != ofp.OFPTT_ALL and msg.table_id != key[0]:
+                continue
+            if (flow.cookie & msg.cookie_mask) != (msg.cookie & msg.cookie_mask):
+                continue
+            if any(dict(key[2]).get(field) != value for field, value in match):
+                continue
+            del self.flows[key]
+
+    def diff(self, dp, flow_stats, group_stats):
+        """Returns the messages that turn the entries of switch dp into the entries of the shadow table.
+
+        Arguments:
+        dp: datapath of the switch
+        flow_stats: OFPFlowStats of all flows of the switch
+        group_stats: OFPGroupDescStats of all groups of the switch
+        """
+
+        ofp = dp.ofproto
+        parser = dp.ofproto_parser
+
+        msgs = []
+
+        actual_groups = dict((stats.group_id, stats) for stats in group_stats)
+        for g_id, msg in self.groups.items():
+            stats = actual_groups.get(g_id)
+            if stats is None:
+                msgs.append(parser.OFPGroupMod(dp, ofp.OFPGC_ADD, msg.type, g_id, msg.buckets))
+            elif stats.type != msg.type or _serialize(stats.buckets) != _serialize(msg.buckets):
+                msgs.append(parser.OFPGroupMod(dp, ofp.OFPGC_MODIFY, msg.type, g_id, msg.buckets))
+
+        actual_flows = {}
+        for stats in flow_stats:
+            if stats.priority <= self.max_priority:
+                actual_flows[_flow_key(stats.table_id, stats.priority, stats.match)] = stats
+
+        for key, msg in self.flows.items():
+            stats = actual_flows.get(key)
+            if (stats is None or stats.cookie != msg.cookie
+                    or _serialize(stats.instructions) != _serialize(msg.instructions)):
+                msgs.append(parser.OFPFlowMod(dp, cookie = msg.cookie, table_id = msg.table_id,
+                                              command = ofp.OFPFC_ADD, priority = msg.priority,
+                                              match = msg.match, instructions = msg.instructions))
+
+        for key, stats in actual_flows.items():
+            if key not in self.flows:
+                msgs.append(parser.OFPFlowMod(dp, table_id = stats.table_id, command = ofp.OFPFC_DELETE_STRICT,
+                                              priority = stats.priority, match = stats.match,
+                                              out_port = ofp.OFPP_ANY, out_group = ofp.OFPG_ANY))
+
+        for g_id in actual_groups:
+            if g_id not in self.groups:
+                msgs.append(parser.OFPGroupMod(dp, ofp.OFPGC_DELETE, ofp.OFPGT_FF, g_id))
+
+        return msgs
+
+def _flow_key(table_id, priority, match):
+    return (table_id, priority, tuple(sorted(match.items())))
+
+def _serialize(items):
+    """Returns the wire format of a list of instructions or buckets."""
+
+    buf = bytearray()
+    for item in items:
+        item.serialize(buf, len(buf))
+    return bytes(buf)
+
+def _output_groups(instructions):
+    groups = []
+    for instruction in instructions:
+        for action in getattr(instruction, 'actions', []):
+            group_id = getattr(action, 'group_id', None)
+            if group_id is not None:
+                groups.append(group_id)
+    return groups
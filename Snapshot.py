@@ -0,0 +1,395 @@
+"""Compact on-disk snapshots of the state of a MulticastController and its TreeBuilder.
+
+A snapshot starts with MAGIC, the length of a JSON header and the header itself, followed by flat arrays of
+64 bit integers and raw OpenFlow structures. The header holds the irregular state (multicast groups,
+subscribers, the bookkeeping of every switch) and the location of every array. The trees are stored as
+parent pointers:
+
+* tree_info: ROOT, PARENT_TREE, PARENT_X, PARENT_Y, PREDECESSOR, TAG, NODES and EXCLUDES of every tree,
+  backup trees follow the tree they belong to
+* tree_nodes, tree_parents: the nodes of all trees, with the index of their parent (-1 for the root)
+* tree_excludes: pairs of nodes, the links excluded by backup trees
+
+Nodes are referred to by their index in the header's node table, missing values are -1. The shadow tables
+are stored as the wire format of their matches, instructions and buckets.
+
+Loading maps the file into memory and builds the trees straight from the arrays, no path is recomputed.
+"""
+
+import json
+import mmap
+import numbers
+import os
+import struct
+import sys
+from array import array
+
+from ryu.ofproto import ofproto_v1_3_parser
+
+import IdAllocator
+import JoinCache
+import FFGroupStore
+import ShadowTable
+
+MAGIC = b'MCSNAP01'
+_LENGTH = struct.Struct('!Q')
+
+#Typecode of 64 bit integers, Python 2 has no 'q' arrays
+_INT64 = 'q' if sys.version_info[0] >= 3 else 'l'
+
+#Fields of tree_info
+ROOT, PARENT_TREE, PARENT_X, PARENT_Y, PREDECESSOR, TAG, NODES, EXCLUDES = range(8)
+_TREE_FIELDS = 8
+
+#Fields of shadow_flows and shadow_groups
+_FLOW_FIELDS = 7 #switch, table_id, priority, cookie, match length, instructions length, blob offset
+_GROUP_FIELDS = 5 #switch, group id, type, buckets length, blob offset
+
+def save(controller, path):
+    """Write a snapshot of controller to path. The file is replaced atomically."""
+
+    writer = _Writer()
+    header = {'byteorder': sys.byteorder}
+
+    network = controller.network
+    nodes = writer.nodes
+
+    switches = []
+    for node, data in network.nodes(data = True):
+        writer.node(node)
+        if not data['host']:
+            switches.append(_switch_state(node, data))
+
+    header['hosts'] = [node for node, data in network.nodes(data = True) if data['host']]
+    header['switches'] = switches
+    header['links'] = [[src, dst, data['src_port'], data['dst_port']] for src, dst, data in network.edges(data = True)]
+
+    header['groups'] = dict((ip_group, sorted(sources)) for ip_group, sources in controller.groups.items())
+    header['subscribers'] = dict((ip_group, [[subscriber, mode, sorted(sources)]
+                                             for subscriber, (mode, sources) in subscribers.items()])
+                                 for ip_group, subscribers in controller.subscribers.items())
+    header['ip_2_mac'] = controller.ip_2_mac
+
+    trees = []
+    for (ip_group, ip_source), tree in controller.builder.groups.items():
+        trees.append([ip_group, ip_source, writer.tree_count(), _allocator_state(tree.graph['tags'])])
+        writer.tree(tree, -1, None)
+    header['trees'] = trees
+
+    for switch_id, shadow in controller.shadows.items():
+        writer.shadow(switch_id, shadow)
+
+    header['nodes'] = nodes.order
+    header['arrays'] = writer.layout()
+
+    encoded = json.dumps(header, separators = (',', ':')).encode('utf-8')
+
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_LENGTH.pack(len(encoded)))
+        f.write(encoded)
+        writer.write(f)
+    os.rename(temp, path)
+
+def load(controller, path):
+    """Restore the state of controller from the snapshot at path.
+
+    Must be called before any switch connects. All links start out down, they come back up when topology
+    discovery finds them again. Switches keep their flows and groups, see MulticastController.switchEnter.
+    """
+
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            if data[0:len(MAGIC)] != MAGIC:
+                raise ValueError(path + ' is not a multicast controller snapshot')
+
+            start = len(MAGIC) + _LENGTH.size
+            length = _LENGTH.unpack_from(data, len(MAGIC))[0]
+            header = json.loads(data[start:start + length].decode('utf-8'))
+            reader = _Reader(data, start + length, header)
+
+            _load(controller, header, reader)
+        finally:
+            data.close()
+
+def _load(controller, header, reader):
+    nodes = [_node(node) for node in header['nodes']]
+    network = controller.network
+
+    for host in header['hosts']:
+        network.add_node(_node(host), host = True)
+
+    for state in header['switches']:
+        switch_id = _node(state['id'])
+        network.add_node(switch_id, switch = None, host = False, flows = _flows(state['flows']),
+                         FF_groups = _FF_store(state['FF_groups']), group_ids = _allocator(state['group_ids']),
+                         rejoins = dict((_key(key), set(tags)) for key, tags in state['rejoins']))
+        _index_pairs(controller, switch_id)
+
+    for src, dst, src_port, dst_port in header['links']:
+        network.add_edge(_node(src), _node(dst), src_port = src_port, dst_port = dst_port, live = False)
+
+    controller.groups = dict((ip_group, set(sources)) for ip_group, sources in header['groups'].items())
+    controller.subscribers = dict((ip_group, dict((subscriber, [mode, set(sources)])
+                                                  for subscriber, mode, sources in subscribers))
+                                  for ip_group, subscribers in header['subscribers'].items())
+    controller.ip_2_mac = dict(header['ip_2_mac'])
+
+    info = reader.array('tree_info')
+    tree_nodes = reader.array('tree_nodes')
+    tree_parents = reader.array('tree_parents')
+    excludes = reader.array('tree_excludes')
+
+    first_trees = dict((index, (ip_group, ip_source, tags)) for ip_group, ip_source, index, tags in header['trees'])
+
+    trees = []
+    node_offset = 0
+    exclude_offset = 0
+    for t in range(len(info) // _TREE_FIELDS):
+        fields = info[t * _TREE_FIELDS:(t + 1) * _TREE_FIELDS]
+
+        predecessor = nodes[fields[PREDECESSOR]] if fields[PREDECESSOR] >= 0 else None
+        root = nodes[fields[ROOT]]
+
+        if fields[PARENT_TREE] < 0:
+            ip_group, ip_source, tags = first_trees[t]
+            tree = JoinCache.Tree(root = root, parent = None, predecessor_switch = predecessor, tag = None,
+                                  tags = _allocator(tags))
+            tree.graph['primary'] = tree
+            controller.builder.groups[(ip_group, ip_source)] = tree
+        else:
+            parent = trees[fields[PARENT_TREE]]
+            tree = JoinCache.Tree(root = root, parent = parent, predecessor_switch = predecessor,
+                                  tag = fields[TAG], primary = parent.graph['primary'])
+            tree.graph['exclude'] = set((nodes[excludes[i]], nodes[excludes[i+1]]) for i in
+                                        range(exclude_offset, exclude_offset + 2 * fields[EXCLUDES], 2))
+            exclude_offset += 2 * fields[EXCLUDES]
+            parent[nodes[fields[PARENT_X]]][nodes[fields[PARENT_Y]]]['backup'] = tree
+
+        tree.add_node(root)
+        for i in range(node_offset, node_offset + fields[NODES]):
+            if tree_parents[i] >= 0:
+                tree.add_edge(nodes[tree_parents[i]], nodes[tree_nodes[i]], backup = None)
+        node_offset += fields[NODES]
+
+        trees.append(tree)
+
+    blob = reader.blob('shadow_blob')
+    parser = ofproto_v1_3_parser
+
+    flows = reader.array('shadow_flows')
+    for i in range(0, len(flows), _FLOW_FIELDS):
+        switch_id, table_id, priority, cookie, match_length, instructions_length, offset = flows[i:i+_FLOW_FIELDS]
+        match = parser.OFPMatch.parser(blob, offset)
+        instructions = _parse_list(parser.OFPInstruction.parser, blob, offset + match_length, instructions_length)
+
+        msg = parser.OFPFlowMod(None, cookie = cookie & 0xffffffffffffffff, table_id = table_id, priority = priority,
+                                match = match, instructions = instructions)
+        shadow = controller._get_shadow(nodes[switch_id])
+        shadow.flows[ShadowTable._flow_key(table_id, priority, match)] = msg
+
+    groups = reader.array('shadow_groups')
+    for i in range(0, len(groups), _GROUP_FIELDS):
+        switch_id, g_id, g_type, buckets_length, offset = groups[i:i+_GROUP_FIELDS]
+        buckets = _parse_list(parser.OFPBucket.parser, blob, offset, buckets_length)
+        controller._get_shadow(nodes[switch_id]).groups[g_id] = parser.OFPGroupMod(None, group_id = g_id,
+                                                                                   type_ = g_type, buckets = buckets)
+
+    controller._topology_changed(list(network.edges()))
+
+class _NodeTable(object):
+    def __init__(self):
+        self.order = []
+        self.index = {}
+
+    def __call__(self, node):
+        if node is None:
+            return -1
+        index = self.index.get(node)
+        if index is None:
+            index = self.index[node] = len(self.order)
+            self.order.append(node)
+        return index
+
+class _Writer(object):
+    """Collects the arrays of a snapshot."""
+
+    def __init__(self):
+        self.nodes = _NodeTable()
+        self.arrays = {}
+        for name in ('tree_info', 'tree_nodes', 'tree_parents', 'tree_excludes', 'shadow_flows', 'shadow_groups'):
+            self.arrays[name] = array(_INT64)
+        self.blob = bytearray()
+
+    def node(self, node):
+        return self.nodes(node)
+
+    def tree_count(self):
+        return len(self.arrays['tree_info']) // _TREE_FIELDS
+
+    def tree(self, tree, parent_index, parent_link):
+        """Append tree and all backup trees below it."""
+
+        index = self.tree_count()
+        node = self.nodes
+        x, y = parent_link if parent_link is not None else (None, None)
+        tag = tree.graph['tag']
+        exclude = tree.graph.get('exclude', ())
+
+        self.arrays['tree_info'].extend([node(tree.graph['root']), parent_index, node(x), node(y),
+                                         node(tree.graph['predecessor_switch']), -1 if tag is None else tag,
+                                         tree.number_of_nodes(), len(exclude)])
+
+        for v in tree:
+            predecessors = list(tree.predecessors(v))
+            self.arrays['tree_nodes'].append(node(v))
+            self.arrays['tree_parents'].append(node(predecessors[0]) if len(predecessors) > 0 else -1)
+
+        for a, b in exclude:
+            self.arrays['tree_excludes'].extend([node(a), node(b)])
+
+        for x, y, data in tree.edges(data = True):
+            if data['backup'] is not None:
+                self.tree(data['backup'], index, (x, y))
+
+    def shadow(self, switch_id, shadow):
+        switch = self.nodes(switch_id)
+
+        for msg in shadow.flows.values():
+            offset = len(self.blob)
+            match_length = msg.match.serialize(self.blob, offset)
+            instructions = ShadowTable._serialize(msg.instructions)
+            self.blob.extend(instructions)
+
+            #Cookies are unsigned 64 bit numbers, the array holds signed ones
+            cookie = msg.cookie - (1 << 64) if msg.cookie >= (1 << 63) else msg.cookie
+            self.arrays['shadow_flows'].extend([switch, msg.table_id, msg.priority, cookie, match_length,
+                                                len(instructions), offset])
+
+        for g_id, msg in shadow.groups.items():
+            offset = len(self.blob)
+            buckets = ShadowTable._serialize(msg.buckets)
+            self.blob.extend(buckets)
+            self.arrays['shadow_groups'].extend([switch, g_id, msg.type, len(buckets), offset])
+
+    def layout(self):
+        """Returns name -> [offset, length in bytes] of every array, relative to the end of the header."""
+
+        layout = {}
+        offset = 0
+        for name in sorted(self.arrays):
+            length = len(self.arrays[name]) * self.arrays[name].itemsize
+            layout[name] = [offset, length]
+            offset += length
+        layout['shadow_blob'] = [offset, len(self.blob)]
+        return layout
+
+    def write(self, f):
+        for name in sorted(self.arrays):
+            f.write(_to_bytes(self.arrays[name]))
+        f.write(bytes(self.blob))
+
+class _Reader(object):
+    def __init__(self, data, start, header):
+        self.data = data
+        self.start = start
+        self.layout = header['arrays']
+        self.swap = header['byteorder'] != sys.byteorder
+
+    def blob(self, name):
+        offset, length = self.layout[name]
+        return self.data[self.start + offset:self.start + offset + length]
+
+    def array(self, name):
+        values = array(_INT64)
+        _from_bytes(values, self.blob(name))
+        if self.swap:
+            values.byteswap()
+        return values
+
+def _to_bytes(values):
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+def _from_bytes(values, data):
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+
+def _parse_list(parse, buf, offset, length):
+    items = []
+    end = offset + length
+    while offset < end:
+        item = parse(buf, offset)
+        items.append(item)
+        offset += item.len
+    return items
+
+def _node(node):
+    """JSON turns strings into unicode on Python 2, node ids have to stay str."""
+    return node if isinstance(node, numbers.Integral) else str(node)
+
+def _key(key):
+    """Returns the flow key key, which JSON turned into a list."""
+    return tuple(key) if isinstance(key, list) else key
+
+def _switch_state(switch_id, data):
+    store = data['FF_groups']
+    return {
+        'id': switch_id,
+        #remove_flow keeps the remaining ports in lists, in the order of the actions
+        'flows': [[key, list(ports_s), list(ports_h), tables, isinstance(ports_s, set)]
+                  for key, (ports_s, ports_h, tables) in data['flows'].items()],
+        'FF_groups': {
+            'groups': [[group.id, group.in_port, [[bucket.ports, bucket.tag, bucket.drop, bucket.shared]
+                                                  for bucket in group.buckets]]
+                       for group in store.groups.values()],
+            'refs': [[port, key, refs] for (port, key), refs in store.refs.items()],
+        },
+        'group_ids': _allocator_state(data['group_ids']),
+        'rejoins': [[key, sorted(tags)] for key, tags in data['rejoins'].items()],
+    }
+
+def _flows(state):
+    flows = {}
+    for key, ports_s, ports_h, tables, is_set in state:
+        if is_set:
+            ports_s, ports_h = set(ports_s), set(ports_h)
+        flows[_key(key)] = (ports_s, ports_h, tables)
+    return flows
+
+def _index_pairs(controller, switch_id):
+    #The entries of every (group, source) pair, see MulticastController._pair_entries
+    node = controller.network.node[switch_id]
+    node['pairs'] = {}
+
+    for key in list(node['flows']) + list(node['rejoins']):
+        if isinstance(key, tuple):
+            controller._pair_entries(switch_id, key[0:2])[0].add(key)
+
+    for (port, key), refs in node['FF_groups'].refs.items():
+        for g_id, index in refs:
+            controller._pair_entries(switch_id, key[0:2])[1].add(g_id)
+
+def _FF_store(state):
+    store = FFGroupStore.FFGroupStore()
+    for g_id, in_port, buckets in state['groups']:
+        store.add_group(g_id, [FFGroupStore.FFBucket(ports, tag, drop, shared)
+                               for ports, tag, drop, shared in buckets], in_port)
+    for port, key, refs in state['refs']:
+        store.set_refs((port, _key(key)), [tuple(ref) for ref in refs])
+    return store
+
+def _allocator_state(ids):
+    #Released ids are free once the transaction that released them has been sent
+    return [ids.first, ids.last, ids.capacity, ids.next_id, list(ids.free) + sorted(ids.released), sorted(ids.used)]
+
+def _allocator(state):
+    first, last, capacity, next_id, free, used = state
+    ids = IdAllocator.IdAllocator(first, last, capacity)
+    ids.next_id = next_id
+    ids.free.extend(free)
+    ids.used.update(used)
+    return ids
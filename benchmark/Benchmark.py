@@ -0,0 +1,166 @@
+"""Runs IGMP workloads against the controller on fake datapaths and reports its costs.
+
+For every combination of F and group size this reports:
+
+* join and leave latency percentiles (time the controller spends on an IGMP report)
+* percentiles of the time until the switches confirmed the primary paths of joins (see InstallSequencer)
+* messages sent to the switches per join
+* flow and group entries per switch once all subscribers joined
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+
+import SPT
+import DST
+import PerLinkTreeBuilder
+import DetourTreeBuilder
+
+from benchmark import Topologies
+from benchmark import Workloads
+from benchmark.FakeNetwork import FakeNetwork
+
+#Name -> (join, join_many)
+JOINS = {
+    'spt': (SPT.join, SPT.join_many),
+    'dst': (DST.join, DST.join_many),
+}
+
+#Name -> TreeBuilder class
+BUILDERS = {
+    'per-link': PerLinkTreeBuilder.PerLinkTreeBuilder,
+    'detour': DetourTreeBuilder.DetourTreeBuilder,
+}
+
+PERCENTILES = (50, 90, 99)
+
+def percentile(values, p):
+    """Returns the p-th percentile of values (nearest rank), or None if there are no values."""
+
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+def run(topology, F, join, events, join_many = None, builder = PerLinkTreeBuilder.PerLinkTreeBuilder):
+    """Replay events (see Workloads) on a fresh controller for topology.
+
+    Returns a dictionary with the measurements.
+
+    Arguments:
+    topology: switch topology, see Topologies
+    F: amount of (link) fault tolerance
+    join: join function used to compute paths
+    events: list of (operation, host, group address)
+    join_many: function used to compute the paths of many subscribers at once, or None
+    builder: TreeBuilder class used by the controller
+    """
+
+    network = FakeNetwork(topology, F, join, join_many, builder = builder)
+    timer = timeit.default_timer
+
+    latencies = {'join': [], 'leave': [], 'live': []}
+    messages = {'join': 0, 'leave': 0}
+    peak = None
+
+    for operation, host, address in events:
+        if operation == 'leave' and peak is None:
+            peak = (network.flow_counts(), network.group_counts())
+
+        sent = network.message_count()
+        start = timer()
+
+        if operation == 'source':
+            network.start_source(host, address)
+        elif operation == 'join':
+            network.join(host, address)
+        elif operation == 'leave':
+            network.leave(host, address)
+        else:
+            raise ValueError('unknown operation ' + str(operation))
+
+        if operation in messages:
+            latencies[operation].append(timer() - start)
+            messages[operation] += network.message_count() - sent
+
+        if operation == 'join':
+            for source in network.controller.groups.get(address, ()):
+                future = network.controller.installs.future((address, source), host)
+                if future is not None and future.confirmed:
+                    latencies['live'].append(future.seconds)
+
+    if peak is None:
+        peak = (network.flow_counts(), network.group_counts())
+
+    flows, groups = peak
+    joins = len(latencies['join'])
+    leaves = len(latencies['leave'])
+
+    return {
+        'switches': len(network.datapaths),
+        'hosts': len(network.hosts),
+        'joins': joins,
+        'leaves': leaves,
+        'join_latency': [percentile(latencies['join'], p) for p in PERCENTILES],
+        'leave_latency': [percentile(latencies['leave'], p) for p in PERCENTILES],
+        'live_latency': [percentile(latencies['live'], p) for p in PERCENTILES],
+        'messages_per_join': float(messages['join']) / joins if joins > 0 else 0.0,
+        'messages_per_leave': float(messages['leave']) / leaves if leaves > 0 else 0.0,
+        'flows_max': max(flows.values()),
+        'flows_mean': float(sum(flows.values())) / len(flows),
+        'groups_max': max(groups.values()),
+        'groups_mean': float(sum(groups.values())) / len(groups),
+        'join_cache_hit_rate': network.controller.builder.join_cache.hit_rate(),
+        'errors': network.errors(),
+    }
+
+def _milliseconds(values):
+    return '/'.join('-' if value is None else '%.2f' % (value * 1000) for value in values)
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the multicast controller on fake switches.')
+    parser.add_argument('--topology', choices = sorted(Topologies.TOPOLOGIES), default = 'fat-tree')
+    parser.add_argument('--size', type = int, default = 4,
+                        help = 'k of a fat-tree, spines of a leaf-spine, switches of a Waxman graph or '
+                               'rings (and switches per ring) of a ring-of-rings')
+    parser.add_argument('--join', choices = sorted(JOINS), default = 'spt')
+    parser.add_argument('--builder', choices = sorted(BUILDERS), default = 'per-link')
+    parser.add_argument('--F', type = int, nargs = '+', default = [0, 1, 2])
+    parser.add_argument('--group-size', type = int, nargs = '+', default = [4, 8])
+    parser.add_argument('--groups', type = int, default = 4)
+    parser.add_argument('--leave-fraction', type = float, default = 0.5)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(args)
+
+    topology = Topologies.generate(args.topology, args.size, args.seed)
+
+    header = ('F', 'size', 'joins', 'join ms p' + '/'.join(str(p) for p in PERCENTILES), 'leave ms', 'live ms',
+              'msgs/join', 'msgs/leave', 'flows max', 'flows mean', 'groups max', 'groups mean',
+              'cache hits')
+    row = '%3s %5s %6s %22s %22s %22s %10s %10s %10s %10s %10s %11s %10s'
+
+    print('%s: %d switches, join %s, builder %s' % (args.topology, topology.number_of_nodes(), args.join, 
+                                                    args.builder))
+    print(row % header)
+
+    for F in args.F:
+        for group_size in args.group_size:
+            hosts = FakeNetwork.host_addresses(topology)
+            events = Workloads.join_leave(hosts, args.groups, group_size, args.leave_fraction, args.seed)
+            join, join_many = JOINS[args.join]
+            result = run(topology, F, join, events, join_many, BUILDERS[args.builder])
+
+            print(row % (F, group_size, result['joins'], _milliseconds(result['join_latency']),
+                         _milliseconds(result['leave_latency']), _milliseconds(result['live_latency']),
+                         '%.1f' % result['messages_per_join'], '%.1f' % result['messages_per_leave'], result['flows_max'],
+                         '%.1f' % result['flows_mean'], result['groups_max'], '%.1f' % result['groups_mean'],
+                         '%.2f' % result['join_cache_hit_rate']))
+
+            for switch_id, error in result['errors']:
+                print('  switch %s: %s' % (switch_id, error))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Checks that the flow and group entries the controller installed deliver packets under link failures.
+
+Packets of every source are replayed through the flow and group tables of the fake datapaths, where fast
+failover groups use the first bucket whose watched port is still up. A trial fails up to F links one after
+another, each of them on the way the packets take with the failures before it, so the failures hit the
+backup paths of earlier failures as well. After every failure each subscriber that can still be reached
+should get exactly one copy of the packet, without the controller doing anything.
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+
+import networkx as nx
+
+from collections import Counter
+
+from benchmark import Topologies
+from benchmark import Workloads
+from benchmark.Benchmark import JOINS, BUILDERS
+from benchmark.FakeNetwork import FakeNetwork, multicast_mac
+
+MAX_HOPS = 1000 #Packets taking more hops than this are in a loop
+
+def deliver(network, source, ip_group, failed = ()):
+    """Replay a packet of source to ip_group through the switches of network.
+
+    Returns (copies, links): the amount of copies every host received and the links between switches the
+    packet crossed.
+
+    Arguments:
+    network: FakeNetwork
+    source: MAC address of the sending host
+    ip_group: IP group address
+    failed: links between switches that are down (both directions)
+    """
+
+    switch_id, port, ip = network.hosts[source]
+    ports = network.ports
+    neighbours = dict(((x, p), y) for (x, y), p in ports.items())
+    hosts = dict(((s, p), mac) for mac, (s, p, i) in network.hosts.items())
+
+    def live(x, p):
+        return (x, neighbours.get((x, p))) not in failed
+
+    fields = {'eth_dst': multicast_mac(ip_group), 'eth_src': source}
+
+    copies = Counter()
+    links = set()
+    queue = [(switch_id, port, None, 0)]
+    while len(queue) > 0:
+        x, in_port, tag, hops = queue.pop()
+        if hops > MAX_HOPS:
+            raise RuntimeError('packet of %s to %s loops' % (source, ip_group))
+
+        for out_port, out_tag in _process(network.datapaths[x], in_port, tag, fields, live):
+            if (x, out_port) in hosts:
+                if out_tag is None:
+                    copies[hosts[(x, out_port)]] += 1
+            elif (x, out_port) in neighbours and live(x, out_port):
+                y = neighbours[(x, out_port)]
+                links.add((x, y))
+                queue.append((y, ports[(y, x)], out_tag, hops + 1))
+
+    return copies, links
+
+def _process(dp, in_port, tag, fields, live):
+    """Returns the (port, VLAN tag) pairs a packet leaves datapath dp on."""
+
+    ofp = dp.ofproto
+    parser = dp.ofproto_parser
+
+    outputs = []
+    table = 0
+    while table is not None:
+        packet = dict(fields, in_port = in_port)
+        if tag is not None:
+            packet['vlan_vid'] = 0x1000 | tag
+
+        flow = _lookup(dp, table, packet)
+        if flow is None:
+            break
+
+        table = None
+        for instruction in flow.instructions:
+            if isinstance(instruction, parser.OFPInstructionGotoTable):
+                table = instruction.table_id
+            elif isinstance(instruction, parser.OFPInstructionActions):
+                tag = _apply(dp, instruction.actions, tag, in_port, outputs, live)
+
+    return [(port, tag) for port, tag in outputs if port != ofp.OFPP_CONTROLLER]
+
+def _lookup(dp, table, packet):
+    """Returns the flow entry of table matching packet with the highest priority, or None."""
+
+    best = None
+    for (table_id, priority, match), flow in dp.flows.items():
+        if table_id == table and all(packet.get(field) == value for field, value in match):
+            if best is None or priority > best[0]:
+                best = (priority, flow)
+    return best[1] if best is not None else None
+
+def _apply(dp, actions, tag, in_port, outputs, live):
+    """Apply actions to a packet with VLAN tag tag, adding its outputs to outputs. Returns the new tag."""
+
+    ofp = dp.ofproto
+    parser = dp.ofproto_parser
+
+    for action in actions:
+        if isinstance(action, parser.OFPActionOutput):
+            outputs.append((in_port if action.port == ofp.OFPP_IN_PORT else action.port, tag))
+        elif isinstance(action, parser.OFPActionPushVlan):
+            tag = 0
+        elif isinstance(action, parser.OFPActionPopVlan):
+            tag = None
+        elif isinstance(action, parser.OFPActionSetField) and action.key == 'vlan_vid':
+            tag = action.value & 0xfff
+        elif isinstance(action, parser.OFPActionGroup):
+            for bucket in dp.groups[action.group_id].buckets:
+                if bucket.watch_port == ofp.OFPP_ANY or live(dp.id, bucket.watch_port):
+                    _apply(dp, bucket.actions, tag, in_port, outputs, live)
+                    break
+
+    return tag
+
+def trial(network, topology, source, ip_group, subscribers, F, rng):
+    """Fail up to F links on the way of the packets of source, one after another.
+
+    Returns a list of (failed links, {subscriber: copies}) for every time a reachable subscriber did not get
+    exactly one copy, or a host that is no subscriber got one.
+    """
+
+    hosts = network.hosts
+    failed = set()
+    problems = []
+
+    for i in range(F):
+        copies, links = deliver(network, source, ip_group, failed)
+        links = sorted(link for link in links if link not in failed)
+        if len(links) == 0:
+            break
+
+        x, y = rng.choice(links)
+        failed.add((x, y))
+        failed.add((y, x))
+
+        up = topology.copy()
+        up.remove_edges_from(failed)
+        reachable = set(nx.node_connected_component(up, hosts[source][0]))
+
+        copies, links = deliver(network, source, ip_group, failed)
+        wrong = dict((host, copies[host]) for host in subscribers
+                     if hosts[host][0] in reachable and copies[host] != 1)
+        wrong.update((host, amount) for host, amount in copies.items() if host not in subscribers)
+        if len(wrong) > 0:
+            problems.append((sorted(link for link in failed if link[0] < link[1]), wrong))
+
+    return problems
+
+def run(topology, F, join, events, trials, join_many = None, builder = BUILDERS['per-link'], seed = None):
+    """Replay events (see Workloads) on a fresh controller for topology, then run trials for every source.
+
+    Returns a list of (group address, source, failed links, {host: copies}) for the failed checks.
+    """
+
+    network = FakeNetwork(topology, F, join, join_many, builder = builder)
+    for operation, host, address in events:
+        getattr(network, 'start_source' if operation == 'source' else operation)(host, address)
+
+    rng = random.Random(seed)
+    problems = []
+    for address in sorted(network.controller.groups):
+        subscribers = set(network.controller.subscribers.get(address, ()))
+        for source in sorted(network.controller.groups[address]):
+            source_mac = network.controller.ip_2_mac[source]
+            for i in range(trials):
+                for failed, wrong in trial(network, topology, source_mac, address, subscribers, F, rng):
+                    problems.append((address, source_mac, failed, wrong))
+
+    return problems
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = 'Check packet delivery of the installed flows and groups '
+                                                   'under link failures.')
+    parser.add_argument('--topology', choices = sorted(Topologies.TOPOLOGIES), default = 'fat-tree')
+    parser.add_argument('--size', type = int, default = 4)
+    parser.add_argument('--join', choices = sorted(JOINS), default = 'spt')
+    parser.add_argument('--builder', choices = sorted(BUILDERS), default = 'per-link')
+    parser.add_argument('--F', type = int, nargs = '+', default = [1, 2])
+    parser.add_argument('--group-size', type = int, default = 6)
+    parser.add_argument('--groups', type = int, default = 4)
+    parser.add_argument('--leave-fraction', type = float, default = 0.5)
+    parser.add_argument('--trials', type = int, default = 10, help = 'trials per source')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(args)
+
+    topology = Topologies.generate(args.topology, args.size, args.seed)
+    hosts = FakeNetwork.host_addresses(topology)
+    join, join_many = JOINS[args.join]
+
+    failures = 0
+    for F in args.F:
+        events = Workloads.join_leave(hosts, args.groups, args.group_size, args.leave_fraction, args.seed)
+        problems = run(topology, F, join, events, args.trials, join_many, BUILDERS[args.builder], args.seed)
+
+        print('%s F=%d: %d failed checks' % (args.topology, F, len(problems)))
+        for address, source, failed, wrong in problems:
+            print('  %s from %s, failed %s: %s' % (address, source, failed, wrong))
+        failures += len(problems)
+
+    return 1 if failures > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
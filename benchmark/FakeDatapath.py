@@ -0,0 +1,126 @@
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+from collections import Counter
+
+class FakeDatapath(object):
+    """Stand-in for a Ryu datapath of an OpenFlow 1.3 switch.
+
+    Every message sent to it is recorded. Flow and group modifications are applied to its own flow and
+    group tables the way a switch would, so the amount of entries a switch would need can be read from it.
+    Barrier requests are answered right away, every message before them has been applied already.
+    """
+
+    def __init__(self, dpid, reply = None):
+        """
+        Arguments:
+        dpid: datapath id of the switch
+        reply: function called with every reply of the switch, or None to drop the replies
+        """
+
+        self.id = dpid
+        self.reply = reply
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+
+        self.flows = {} #(table_id, priority, match) -> OFPFlowMod
+        self.groups = {} #group id -> OFPGroupMod
+        self.messages = Counter() #message type -> amount of messages received
+        self.errors = []
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+
+        self.messages[type(msg).__name__] += 1
+
+        parser = self.ofproto_parser
+        if isinstance(msg, parser.OFPFlowMod):
+            self._flow_mod(msg)
+        elif isinstance(msg, parser.OFPGroupMod):
+            self._group_mod(msg)
+        elif isinstance(msg, parser.ONFBundleAddMsg):
+            self.send_msg(msg.message)
+        elif isinstance(msg, parser.OFPBarrierRequest) and self.reply is not None:
+            reply = parser.OFPBarrierReply(self)
+            reply.set_xid(msg.xid)
+            self.reply(reply)
+
+    def message_count(self):
+        """Returns the total amount of messages received."""
+        return sum(self.messages.values())
+
+    def flow_count(self):
+        """Returns the amount of entries in the flow tables."""
+        return len(self.flows)
+
+    def group_count(self):
+        """Returns the amount of entries in the group table."""
+        return len(self.groups)
+
+    def _flow_mod(self, msg):
+        ofp = self.ofproto
+        key = (msg.table_id, msg.priority, tuple(sorted(msg.match.items())))
+
+        if msg.command == ofp.OFPFC_ADD:
+            self.flows[key] = msg
+        elif msg.command in (ofp.OFPFC_MODIFY, ofp.OFPFC_MODIFY_STRICT):
+            if key in self.flows:
+                self.flows[key] = msg
+        elif msg.command == ofp.OFPFC_DELETE_STRICT:
+            self.flows.pop(key, None)
+        elif msg.command == ofp.OFPFC_DELETE:
+            match = msg.match.items()
+            for other in list(self.flows):
+                flow = self.flows[other]
+                if msg.table_id != ofp.OFPTT_ALL and msg.table_id != other[0]:
+                    continue
+                if (flow.cookie & msg.cookie_mask) != (msg.cookie & msg.cookie_mask):
+                    continue
+                if any(dict(other[2]).get(field) != value for field, value in match):
+                    continue
+                del self.flows[other]
+        else:
+            self.errors.append(('unknown flow command', msg.command))
+
+    def _group_mod(self, msg):
+        ofp = self.ofproto
+
+        if msg.command == ofp.OFPGC_ADD:
+            if msg.group_id in self.groups:
+                self.errors.append(('group already exists', msg.group_id))
+            self.groups[msg.group_id] = msg
+        elif msg.command == ofp.OFPGC_MODIFY:
+            if msg.group_id not in self.groups:
+                self.errors.append(('unknown group', msg.group_id))
+            self.groups[msg.group_id] = msg
+        elif msg.command == ofp.OFPGC_DELETE:
+            if msg.group_id == ofp.OFPG_ALL:
+                self.groups.clear()
+            else:
+                self.groups.pop(msg.group_id, None)
+                #Flows forwarding to a deleted group are removed along with it
+                for key in list(self.flows):
+                    if msg.group_id in _output_groups(self.flows[key]):
+                        del self.flows[key]
+
+class FakeSwitch(object):
+    """Stand-in for ryu.topology.switches.Switch, which is all MulticastController keeps of a switch."""
+
+    def __init__(self, dp):
+        self.dp = dp
+
+def _output_groups(flow):
+    groups = []
+    for instruction in flow.instructions:
+        for action in getattr(instruction, 'actions', []):
+            group_id = getattr(action, 'group_id', None)
+            if group_id is not None:
+                groups.append(group_id)
+    return groups
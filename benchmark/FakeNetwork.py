@@ -0,0 +1,170 @@
+import logging
+
+from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import ether_types
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import in_proto
+from ryu.lib.packet import igmp
+from ryu.lib.packet import udp
+
+import MulticastController
+import PerLinkTreeBuilder
+
+from benchmark.FakeDatapath import FakeDatapath, FakeSwitch
+
+class _Event(object):
+    """Minimal stand-in for the Ryu events MulticastController handles."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class FakeNetwork(object):
+    """A MulticastController connected to fake datapaths for a given topology.
+
+    The controller is fed the same events Ryu would give it (switches entering, links being discovered,
+    packets coming in), so the full path from an IGMP report to the installed flows is exercised.
+    """
+
+    def __init__(self, topology, F, join, join_many = None, log_level = logging.WARNING, 
+                 builder = PerLinkTreeBuilder.PerLinkTreeBuilder):
+        """
+        Arguments:
+        topology: undirected networkx graph of switches, nodes with attribute hosts = n get n hosts
+        F: amount of (link) fault tolerance
+        join: join function used to compute paths
+        join_many: function used to compute the paths of many subscribers at once, or None
+        log_level: log level of the controller
+        builder: TreeBuilder class used by the controller
+        """
+
+        self.controller = MulticastController.MulticastController()
+        self.controller.logger.setLevel(log_level)
+        self.controller.builder = builder(F, self.controller, join, join_many = join_many)
+
+        self.datapaths = {} #switch id -> FakeDatapath
+        self.hosts = {} #MAC address -> (switch id, port, IP address)
+        self.ports = {} #(switch id, neighbouring switch id) -> port
+
+        next_port = {}
+        for switch_id in topology:
+            dp = FakeDatapath(switch_id, self._reply)
+            self.datapaths[switch_id] = dp
+            next_port[switch_id] = 1
+            self.controller.switchEnter(_Event(switch = FakeSwitch(dp)))
+
+        for x, y in topology.edges():
+            x_port = next_port[x]
+            y_port = next_port[y]
+            next_port[x] += 1
+            next_port[y] += 1
+            self.ports[(x, y)] = x_port
+            self.ports[(y, x)] = y_port
+
+            self._link_event(self.controller.linkAdd, x, x_port, y, y_port)
+            self._link_event(self.controller.linkAdd, y, y_port, x, x_port)
+        self.controller.topology.flush()
+
+        for switch_id, mac, ip in FakeNetwork._hosts(topology):
+            port = next_port[switch_id]
+            next_port[switch_id] += 1
+
+            self.hosts[mac] = (switch_id, port, ip)
+            self.controller._hostFound(switch_id, port, mac)
+
+    def _reply(self, msg):
+        if isinstance(msg, msg.datapath.ofproto_parser.OFPBarrierReply):
+            self.controller.barrier_reply_handler(_Event(msg = msg))
+
+    @staticmethod
+    def host_addresses(topology):
+        """Returns the MAC addresses of the hosts a FakeNetwork for topology would have."""
+        return [mac for switch_id, mac, ip in FakeNetwork._hosts(topology)]
+
+    @staticmethod
+    def _hosts(topology):
+        """Returns (switch id, MAC address, IP address) for all hosts of topology."""
+
+        hosts = []
+        for switch_id in topology:
+            for i in range(topology.node[switch_id].get('hosts', 0)):
+                number = len(hosts) + 1
+                octets = ((number >> 16) & 0xff, (number >> 8) & 0xff, number & 0xff)
+                hosts.append((switch_id, '00:00:00:%02x:%02x:%02x' % octets, '10.%d.%d.%d' % octets))
+        return hosts
+
+    def _link_event(self, handler, src, src_port, dst, dst_port):
+        handler(_Event(link = _Event(src = _Event(dpid = src, port_no = src_port),
+                                     dst = _Event(dpid = dst, port_no = dst_port))))
+
+    def start_source(self, host, ip_group):
+        """Let host start sending to ip_group, which creates the multicast group in the controller."""
+
+        switch_id, port, ip = self.hosts[host]
+        group_mac = multicast_mac(ip_group)
+
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(dst = group_mac, src = host, ethertype = ether_types.ETH_TYPE_IP))
+        pkt.add_protocol(ipv4.ipv4(src = ip, dst = ip_group, proto = in_proto.IPPROTO_UDP))
+        pkt.add_protocol(udp.udp(src_port = 5000, dst_port = 5000))
+        pkt.serialize()
+
+        self.packet_in(switch_id, port, pkt.data)
+
+    def join(self, host, ip_group, sources = ()):
+        """Send an IGMPv3 report for host to receive ip_group from all sources except sources."""
+        self._igmp(host, ip_group, igmp.CHANGE_TO_EXCLUDE_MODE, sources)
+
+    def leave(self, host, ip_group, sources = ()):
+        """Send an IGMPv3 report for host to only receive ip_group from sources."""
+        self._igmp(host, ip_group, igmp.CHANGE_TO_INCLUDE_MODE, sources)
+
+    def _igmp(self, host, ip_group, record_type, sources):
+        switch_id, port, ip = self.hosts[host]
+
+        record = igmp.igmpv3_report_group(type_ = record_type, address = ip_group, srcs = list(sources))
+
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(dst = '01:00:5e:00:00:16', src = host,
+                                           ethertype = ether_types.ETH_TYPE_IP))
+        pkt.add_protocol(ipv4.ipv4(src = ip, dst = '224.0.0.22', proto = in_proto.IPPROTO_IGMP, ttl = 1))
+        pkt.add_protocol(igmp.igmpv3_report(record_num = 1, records = [record]))
+        pkt.serialize()
+
+        self.packet_in(switch_id, port, pkt.data)
+
+    def packet_in(self, switch_id, port, data):
+        """Deliver a packet received by switch switch_id on port to the controller."""
+
+        dp = self.datapaths[switch_id]
+        ofp = dp.ofproto
+        msg = _Event(datapath = dp, data = data, match = {'in_port': port}, buffer_id = ofp.OFP_NO_BUFFER,
+                     reason = ofp.OFPR_NO_MATCH, total_len = len(data))
+
+        self.controller.packet_in_handler(_Event(msg = msg))
+
+        #Joins and leaves are processed by the workers of the controller, wait until they are installed
+        self.controller.coalescer.flush()
+        self.controller.workers.wait()
+
+    def message_count(self):
+        """Returns the total amount of messages sent to all switches."""
+        return sum(dp.message_count() for dp in self.datapaths.values())
+
+    def flow_counts(self):
+        """Returns the amount of flow entries per switch."""
+        return dict((switch_id, dp.flow_count()) for switch_id, dp in self.datapaths.items())
+
+    def group_counts(self):
+        """Returns the amount of group entries per switch."""
+        return dict((switch_id, dp.group_count()) for switch_id, dp in self.datapaths.items())
+
+    def errors(self):
+        """Returns all (switch id, error) pairs of messages the switches could not apply."""
+        return [(switch_id, error) for switch_id, dp in self.datapaths.items() for error in dp.errors]
+
+def multicast_mac(ip_group):
+    """Returns the Ethernet address IPv4 multicast address ip_group maps to."""
+
+    octets = [int(octet) for octet in ip_group.split('.')]
+    return '01:00:5e:%02x:%02x:%02x' % (octets[1] & 0x7f, octets[2], octets[3])
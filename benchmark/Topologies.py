@@ -0,0 +1,141 @@
+"""Generators for switch topologies.
+
+All generators return an undirected networkx graph with switch ids 1..n. The attribute 'hosts' of a switch
+is the amount of hosts connected to it.
+"""
+
+import networkx as nx
+import math
+import random
+
+def fat_tree(k, hosts = None):
+    """k-ary fat-tree with (k/2)^2 core switches and k pods of k/2 aggregation and k/2 edge switches.
+
+    Arguments:
+    k: amount of ports per switch, must be even
+    hosts: amount of hosts per edge switch, k/2 if None
+    """
+
+    if k < 2 or k % 2 != 0:
+        raise ValueError('k should be an even number of at least 2, not ' + str(k))
+
+    half = k // 2
+    hosts = half if hosts is None else hosts
+
+    graph = nx.Graph()
+    core = [('core', i) for i in range(half * half)]
+    graph.add_nodes_from(core, hosts = 0)
+
+    for pod in range(k):
+        aggregation = [('aggregation', pod, i) for i in range(half)]
+        edge = [('edge', pod, i) for i in range(half)]
+        graph.add_nodes_from(aggregation, hosts = 0)
+        graph.add_nodes_from(edge, hosts = hosts)
+
+        for i, a in enumerate(aggregation):
+            for e in edge:
+                graph.add_edge(a, e)
+            for c in core[i * half:(i + 1) * half]:
+                graph.add_edge(a, c)
+
+    return _relabel(graph)
+
+def leaf_spine(spines, leaves, hosts = 1):
+    """Two tier Clos network where every leaf switch connects to every spine switch.
+
+    Arguments:
+    spines: amount of spine switches
+    leaves: amount of leaf switches
+    hosts: amount of hosts per leaf switch
+    """
+
+    graph = nx.Graph()
+    graph.add_nodes_from((('spine', i) for i in range(spines)), hosts = 0)
+    graph.add_nodes_from((('leaf', i) for i in range(leaves)), hosts = hosts)
+
+    for s in range(spines):
+        for l in range(leaves):
+            graph.add_edge(('spine', s), ('leaf', l))
+
+    return _relabel(graph)
+
+def waxman(n, alpha = 0.4, beta = 0.2, hosts = 1, seed = None):
+    """Random Waxman graph of n switches, made connected by linking its components.
+
+    Switches are placed uniformly in the unit square. Two switches at distance d are linked with 
+    probability alpha * exp(-d / (beta * L)), where L is the largest distance between two switches.
+
+    Arguments:
+    n: amount of switches
+    alpha: higher values give more links
+    beta: higher values give more long links
+    hosts: amount of hosts per switch
+    seed: random seed
+    """
+
+    rng = random.Random(seed)
+
+    graph = nx.Graph()
+    position = {}
+    for i in range(n):
+        graph.add_node(i, hosts = hosts)
+        position[i] = (rng.random(), rng.random())
+
+    distance = lambda a, b: math.hypot(position[a][0] - position[b][0], position[a][1] - position[b][1])
+    L = max([distance(a, b) for a in range(n) for b in range(a)] or [1.0])
+
+    for a in range(n):
+        for b in range(a):
+            if rng.random() < alpha * math.exp(-distance(a, b) / (beta * L)):
+                graph.add_edge(a, b)
+
+    #Connect every component to a random switch of the previous one
+    components = [sorted(component) for component in nx.connected_components(graph)]
+    for previous, component in zip(components, components[1:]):
+        graph.add_edge(rng.choice(previous), rng.choice(component))
+
+    return _relabel(graph)
+
+def ring_of_rings(rings, ring_size, hosts = 1):
+    """A core ring of rings switches, each of them also part of its own ring of ring_size switches.
+
+    Arguments:
+    rings: amount of rings connected to the core ring
+    ring_size: amount of switches per ring, including the switch in the core ring
+    hosts: amount of hosts per switch that is not in the core ring
+    """
+
+    graph = nx.Graph()
+    for r in range(rings):
+        ring = [('ring', r, i) for i in range(ring_size)]
+        graph.add_node(ring[0], hosts = 0)
+        graph.add_nodes_from(ring[1:], hosts = hosts)
+
+        for i in range(len(ring)):
+            if ring[i] != ring[i - 1]:
+                graph.add_edge(ring[i - 1], ring[i])
+
+        if rings > 1:
+            graph.add_edge(ring[0], ('ring', (r + 1) % rings, 0))
+
+    return _relabel(graph)
+
+def _relabel(graph):
+    """Returns graph with its switches numbered 1..n, in a deterministic order."""
+    return nx.convert_node_labels_to_integers(graph, first_label = 1, ordering = 'sorted')
+
+#Name -> (generator, function from size to its arguments)
+TOPOLOGIES = {
+    'fat-tree': (fat_tree, lambda size: (size,)),
+    'leaf-spine': (leaf_spine, lambda size: (size, 2 * size)),
+    'waxman': (waxman, lambda size: (size,)),
+    'ring-of-rings': (ring_of_rings, lambda size: (size, size)),
+}
+
+def generate(name, size, seed = None):
+    """Returns topology name of the given size, see TOPOLOGIES."""
+
+    generator, arguments = TOPOLOGIES[name]
+    if generator is waxman:
+        return waxman(*arguments(size), seed = seed)
+    return generator(*arguments(size))
@@ -0,0 +1,55 @@
+"""Generators for IGMP workloads.
+
+A workload is a list of (operation, host, group address) events, where operation is one of:
+
+* 'source': host starts sending to the group
+* 'join': host joins the group (IGMPv3 CHANGE_TO_EXCLUDE_MODE without sources)
+* 'leave': host leaves the group (IGMPv3 CHANGE_TO_INCLUDE_MODE without sources)
+"""
+
+import random
+
+def group_address(i):
+    """Returns the i-th multicast group address, starting at 225.0.0.1."""
+
+    i += 1
+    return '225.%d.%d.%d' % ((i >> 16) & 0x7f, (i >> 8) & 0xff, i & 0xff)
+
+def join_leave(hosts, groups, group_size, leave_fraction = 0.5, seed = None):
+    """Every group gets a random source and group_size random subscribers, which join in random order.
+    Afterwards a random leave_fraction of the subscribers of every group leaves again, also in random order.
+
+    Arguments:
+    hosts: MAC addresses of all hosts
+    groups: amount of multicast groups
+    group_size: amount of subscribers per group
+    leave_fraction: fraction of the subscribers that leave after all joins
+    seed: random seed
+    """
+
+    if group_size + 1 > len(hosts):
+        raise ValueError('a group of ' + str(group_size) + ' subscribers and a source needs more than '
+                         + str(len(hosts)) + ' hosts')
+
+    rng = random.Random(seed)
+    hosts = sorted(hosts)
+
+    events = []
+    members = []
+    for i in range(groups):
+        address = group_address(i)
+        chosen = rng.sample(hosts, group_size + 1)
+
+        events.append(('source', chosen[0], address))
+        members.append((address, chosen[1:]))
+
+    joins = [('join', host, address) for address, subscribers in members for host in subscribers]
+    rng.shuffle(joins)
+
+    leaves = []
+    for address, subscribers in members:
+        amount = int(round(leave_fraction * len(subscribers)))
+        leaves.extend(('leave', host, address) for host in rng.sample(subscribers, amount))
+    rng.shuffle(leaves)
+
+    return events + joins + leaves
@@ -0,0 +1,6 @@
+"""Offline simulation harness and benchmarks for the multicast controller.
+
+Run from the root of the repository, e.g.:
+
+python -m benchmark.Benchmark --topology fat-tree --size 4 --F 0 1 2 --group-size 4 8
+"""